@@ -0,0 +1,282 @@
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+import asyncio
+import os
+from chat_service import ChatService
+from group_commit import ACK_ON_WRITE
+from storage import create_storage
+from models import Message, message_type_for
+from pagination import DEFAULT_PAGE_SIZE
+
+
+# A message to send: its text and an optional blob attachment
+Outgoing = Tuple[str, Optional[Dict[str, Any]]]
+
+
+class AsyncChatService:
+    """Async facade the server uses to reach its ``ChatService``.
+
+    The service and everything it owns (chats, indexes, the hot window,
+    storage reads and snapshots) live on one dedicated thread. Every method
+    here is a call handed to that thread, so the event loop never blocks on
+    file or database I/O, and the service is never touched by two threads
+    at once without needing a lock. Results come back as plain dicts in the
+    shape the frontend expects.
+
+    The search index is built on that thread too, one chunk per call, each
+    queued behind whatever calls are already waiting, so indexing a large
+    history never holds up a request for longer than a chunk.
+
+    When the service's hot window has an age limit, ``hot_window.sweep()``
+    runs on that thread every ``sweep_interval`` seconds, so chats nobody
+    writes to or reads from drop their old messages too.
+
+    Sends return once the group commit writer has committed them at the
+    service's durability level; that wait is on the loop, so the service
+    thread goes straight on to the next call.
+
+    Presence needs each user's contacts synchronously, so the facade keeps
+    them on the loop side for every connected user until ``leave_user``.
+    """
+    def __init__(self, factory: Callable[[], ChatService], sweep_interval: float = 60.0):
+        self.factory = factory
+        self.sweep_interval = sweep_interval
+        self.service: Optional[ChatService] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-service")
+        self._contacts: Dict[str, Set[str]] = {}
+        self._closed = False
+        self._sweeper: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls) -> "AsyncChatService":
+        """A facade over the store named by ``STORAGE_URL`` or ``DATA_FILE``, set up from the environment"""
+        storage_url = os.environ.get("STORAGE_URL") or "json://" + os.environ.get("DATA_FILE", "chat_data.json")
+        paged = storage_url.startswith("sqlite://")
+        # Build messages on first access instead of at startup; the default with SQLite
+        lazy = os.environ.get("LAZY_LOAD", "1" if paged else "0").lower() in ("1", "true", "yes")
+        # Hot window limits for engines that page from disk; the JSON engine keeps all history in memory
+        memory_budget_mb = float(os.environ.get("MEMORY_BUDGET_MB", 0))
+        hot_window_age = float(os.environ.get("HOT_WINDOW_AGE", 0))
+        if (memory_budget_mb or hot_window_age) and not paged:
+            print("MEMORY_BUDGET_MB and HOT_WINDOW_AGE only apply with a sqlite:// STORAGE_URL")
+        # When a send counts as stored, and how long the writer gathers a batch
+        durability = os.environ.get("COMMIT_DURABILITY", ACK_ON_WRITE).lower()
+        commit_delay = float(os.environ.get("COMMIT_DELAY_MS", 2)) / 1000
+        return cls(
+            lambda: ChatService(
+                storage=create_storage(storage_url),
+                durability=durability,
+                commit_delay=commit_delay,
+                lazy=lazy,
+                memory_budget=int(memory_budget_mb * 1024 * 1024) or None,
+                hot_window_age=hot_window_age or None
+            ),
+            sweep_interval=float(os.environ.get("HOT_WINDOW_SWEEP_SECONDS", 60))
+        )
+
+    async def _call(self, fn: Callable, *args) -> Any:
+        return await asyncio.get_event_loop().run_in_executor(self._executor, fn, *args)
+
+    def _submit(self, fn: Callable, *args):
+        """Run ``fn`` on the service thread without waiting for it"""
+        def report(future: Future):
+            if future.exception() is not None:
+                print(f"Error in chat service call {fn.__name__}: {future.exception()}")
+
+        self._executor.submit(fn, *args).add_done_callback(report)
+
+    async def start(self):
+        """Load the service (and its data) on the service thread"""
+        self.service = await self._call(self.factory)
+        self.service.message_format = self.message_to_wire
+        self._submit(self._index_history)
+        if self.service.hot_window.max_age is not None:
+            self._sweeper = asyncio.get_event_loop().create_task(self._sweep_hot_window())
+
+    async def close(self):
+        self._closed = True
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        if self.service is not None:
+            await self._call(self.service.close)
+        self._executor.shutdown()
+
+    async def _sweep_hot_window(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self._call(self.service.hot_window.sweep)
+            except Exception as e:
+                print(f"Error sweeping hot window: {e}")
+
+    def message_to_wire(self, message: Message) -> Dict[str, Any]:
+        """The message shape the frontend expects, built only when sent"""
+        timestamp = message.timestamp
+        sender = self.service.users.get(message.sender_id)
+        wire = {
+            "id": message.message_id,
+            "text": message.text,
+            "sender": message.sender_id,
+            "senderName": sender.username if sender is not None else message.sender_id,
+            "time": timestamp.strftime("%I:%M %p"),
+            "timestamp": timestamp.isoformat(),
+            "seq": message.seq
+        }
+        if message.attachment is not None:
+            wire["type"] = message.message_type.value
+            wire["attachment"] = message.attachment
+        return wire
+
+    def contacts(self, user_id: str) -> Set[str]:
+        """Everyone who shares a chat with a user that connected to this worker"""
+        return self._contacts.get(user_id, set())
+
+    # Calls made on the service thread
+
+    def _index_history(self):
+        """Index the next chunk of history, then queue the rest behind waiting calls"""
+        if not self._closed and not self.service.build_search_index():
+            self._submit(self._index_history)
+
+    def _join_user(self, user_id: str) -> Tuple[List[str], Set[str]]:
+        self.service.get_or_create_user(user_id)
+        return self.service.chat_index.chat_ids(user_id), self.service.get_contacts(user_id)
+
+    def _chat_summaries(self, user_id: str) -> List[Dict[str, Any]]:
+        return [
+            chat.to_summary_dict(message_format=self.message_to_wire, user_id=user_id)
+            for chat in self.service.get_user_chats(user_id)
+        ]
+
+    def _send_messages(self, user_id: str, by_chat: Dict[str, List[Outgoing]]) -> Tuple[List[Tuple[str, List[dict], List[str]]], Future]:
+        # Checked up front so a rejected batch stores nothing
+        for chat_id in by_chat:
+            if self.service.get_chat(chat_id) is not None and not self.service.chat_index.is_member(user_id, chat_id):
+                raise PermissionError("Not a participant")
+        sent = []
+        for chat_id, items in by_chat.items():
+            chat = self.service.get_chat(chat_id)
+            if chat is None:
+                continue
+            messages = [
+                self.message_to_wire(self.service.add_message(
+                    chat_id, user_id, text, message_type_for(attachment), attachment
+                ))
+                for text, attachment in items
+            ]
+            sent.append((chat_id, messages, list(chat.participants)))
+        return sent, self.service.committed()
+
+    def _mark_read(self, user_id: str, chat_id: str, seq: int) -> Optional[Tuple[int, List[str]]]:
+        seq = self.service.mark_read(chat_id, user_id, seq)
+        if seq is None:
+            return None
+        return seq, list(self.service.chats[chat_id].participants)
+
+    def _history(
+        self,
+        user_id: str,
+        chat_id: str,
+        before: Optional[str],
+        after: Optional[str],
+        limit: int
+    ) -> Optional[Dict[str, Any]]:
+        if self.service.get_chat(chat_id) is None:
+            return None
+        if not self.service.chat_index.is_member(user_id, chat_id):
+            raise PermissionError("Not a participant")
+        return self.service.get_chat_history(chat_id, before, after, limit)
+
+    # Async API for the server
+
+    async def join(self, user_id: str) -> Tuple[List[str], Set[str]]:
+        """Register a user; returns their chat ids, most recent first, and their contacts"""
+        return await self._call(self._join_user, user_id)
+
+    async def join_user(self, user_id: str) -> List[str]:
+        """Register a connecting user; returns their chat ids, most recent first"""
+        chat_ids, contacts = await self.join(user_id)
+        self._contacts[user_id] = contacts
+        return chat_ids
+
+    def leave_user(self, user_id: str):
+        """Forget a user's contacts once they have gone offline"""
+        self._contacts.pop(user_id, None)
+
+    async def chat_ids(self, user_id: str) -> List[str]:
+        return await self._call(self.service.chat_index.chat_ids, user_id)
+
+    async def chat_summaries(self, user_id: str) -> List[Dict[str, Any]]:
+        return await self._call(self._chat_summaries, user_id)
+
+    async def sync_delta(self, user_id: str, since: Dict[str, int]) -> Dict[str, Any]:
+        return await self._call(self.service.get_sync_delta, user_id, since)
+
+    async def send_message(
+        self,
+        user_id: str,
+        chat_id: str,
+        text: str,
+        attachment: Optional[Dict[str, Any]] = None
+    ) -> Optional[Tuple[dict, List[str]]]:
+        """Store a message; returns it and the chat's participants, or None for an unknown chat.
+
+        Raises PermissionError if the sender is not a participant, and
+        CommitFailed if the message could not be committed.
+        """
+        sent = await self.send_messages(user_id, {chat_id: [(text, attachment)]})
+        if not sent:
+            return None
+        _, messages, participants = sent[0]
+        return messages[0], participants
+
+    async def send_messages(self, user_id: str, by_chat: Dict[str, List[Outgoing]]) -> List[Tuple[str, List[dict], List[str]]]:
+        """Store a batch of (text, attachment) in one call; returns (chat_id, messages, participants) per known chat.
+
+        Raises PermissionError, storing nothing, if the sender is not in one of the chats.
+        Returns once the batch is committed at the service's durability level,
+        or raises CommitFailed if it could not be.
+        """
+        sent, committed = await self._call(self._send_messages, user_id, by_chat)
+        if sent:
+            await asyncio.wrap_future(committed)
+        return sent
+
+    async def mark_read(self, user_id: str, chat_id: str, seq: int) -> Optional[Tuple[int, List[str]]]:
+        """Advance a read watermark; returns it and the chat's participants, or None if it did not move"""
+        return await self._call(self._mark_read, user_id, chat_id, seq)
+
+    async def history(
+        self,
+        user_id: str,
+        chat_id: str,
+        before: Optional[str] = None,
+        after: Optional[str] = None,
+        limit: int = DEFAULT_PAGE_SIZE
+    ) -> Optional[Dict[str, Any]]:
+        """A page of a chat's history; None for an unknown chat.
+
+        Raises PermissionError for a non-participant and ValueError for a bad cursor.
+        """
+        return await self._call(self._history, user_id, chat_id, before, after, limit)
+
+    async def search(self, user_id: str, query: str, cursor: Optional[str], limit: int) -> Dict[str, Any]:
+        """Raises ValueError for a bad query or cursor and SearchNotReady while indexing"""
+        return await self._call(self.service.search_messages, user_id, query, cursor, limit)
+
+    def record_presence(self, user_id: str, is_online: bool, last_seen_us: int):
+        self._submit(self.service.update_presence, user_id, is_online, last_seen_us)
+
+    async def get_stats(self) -> Dict[str, Any]:
+        def stats():
+            return {
+                "chats": len(self.service.chats),
+                "users": len(self.service.users),
+                "commit_batches": self.service.writer.batches,
+                "commit_records": self.service.writer.records,
+                "commit_failed": self.service.writer.failed,
+                "hot_window": self.service.get_cache_stats(),
+            }
+
+        return await self._call(stats)
@@ -0,0 +1,220 @@
+"""Pub/sub backplane connecting the ConnectionManager of every worker.
+
+A worker never writes to a socket directly when fanning out; it publishes a
+delivery (recipients plus an already encoded frame) to the backplane, and every
+worker subscribed to it hands the frame to whichever recipients are connected
+locally. ``InProcessBackplane`` short-circuits this for a single worker.
+``UnixSocketBackplane`` talks to a ``BackplaneBroker`` over a Unix socket, so
+several workers on one box share deliveries. The broker relays frames in the
+order it receives them, which gives every worker the same delivery order.
+
+Run the broker for a multi-worker deployment with:
+
+    python backplane.py --path /tmp/chat-backplane.sock
+"""
+from typing import Callable, List, Optional
+import argparse
+import asyncio
+import os
+from encoding import dumps, loads
+
+# Largest frame a worker or the broker will read in one line
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+# Unsent bytes a worker or the broker lets build up for one peer. Writes never
+# wait on a peer; past this a worker drops deliveries and the broker
+# disconnects the subscriber, which reconnects once it has caught up.
+MAX_BUFFERED_BYTES = 8 * 1024 * 1024
+
+# deliver(user_ids or None for everyone, payload, coalesce_key, exclude_user)
+Deliver = Callable[[Optional[List[str]], str, Optional[str], Optional[str]], None]
+
+
+class Backplane:
+    """Interface ConnectionManager publishes deliveries to and subscribes from"""
+    def __init__(self):
+        self._deliver: Optional[Deliver] = None
+        # Deliveries this worker could not hand to the backplane
+        self.dropped = 0
+
+    def attach(self, deliver: Deliver):
+        """Register the callback that delivers to this worker's connections"""
+        self._deliver = deliver
+
+    async def start(self):
+        """Open any connections the backplane needs"""
+
+    async def stop(self):
+        """Release the backplane's resources"""
+
+    def publish(
+        self,
+        user_ids: Optional[List[str]],
+        payload: str,
+        coalesce_key: Optional[str] = None,
+        exclude_user: Optional[str] = None
+    ):
+        raise NotImplementedError
+
+
+class InProcessBackplane(Backplane):
+    """Single-worker backplane that delivers straight to local connections"""
+    def publish(
+        self,
+        user_ids: Optional[List[str]],
+        payload: str,
+        coalesce_key: Optional[str] = None,
+        exclude_user: Optional[str] = None
+    ):
+        if self._deliver is not None:
+            self._deliver(user_ids, payload, coalesce_key, exclude_user)
+
+
+def _encode_frame(
+    user_ids: Optional[List[str]],
+    payload: str,
+    coalesce_key: Optional[str],
+    exclude_user: Optional[str]
+) -> bytes:
+    # A header line with routing, then the payload line. Compact JSON never
+    # contains a raw newline, so the payload is relayed without re-escaping.
+    header = dumps({"to": user_ids, "key": coalesce_key, "exclude": exclude_user})
+    return f"{header}\n{payload}\n".encode()
+
+
+class UnixSocketBackplane(Backplane):
+    """Backplane that shares deliveries through a local ``BackplaneBroker``"""
+    def __init__(self, path: str, reconnect_delay: float = 0.5, max_pending: int = 10000):
+        super().__init__()
+        self.path = path
+        self.reconnect_delay = reconnect_delay
+        self.max_pending = max_pending
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        # Frames published while the broker is unreachable
+        self._pending: List[bytes] = []
+        self._connected = asyncio.Event()
+
+    async def start(self):
+        self._reader_task = asyncio.get_event_loop().create_task(self._run())
+        await self._connected.wait()
+
+    async def stop(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def publish(
+        self,
+        user_ids: Optional[List[str]],
+        payload: str,
+        coalesce_key: Optional[str] = None,
+        exclude_user: Optional[str] = None
+    ):
+        frame = _encode_frame(user_ids, payload, coalesce_key, exclude_user)
+        if self._writer is not None:
+            if self._writer.transport.get_write_buffer_size() > MAX_BUFFERED_BYTES:
+                self.dropped += 1
+                print("Backplane broker is not keeping up, dropping delivery")
+                return
+            self._writer.write(frame)
+        elif len(self._pending) < self.max_pending:
+            self._pending.append(frame)
+        else:
+            self.dropped += 1
+            print("Backplane unreachable, dropping delivery")
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=MAX_FRAME_BYTES)
+            except OSError as e:
+                print(f"Backplane broker unavailable at {self.path}: {e}")
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+
+            self._writer = writer
+            for frame in self._pending:
+                writer.write(frame)
+            self._pending = []
+            self._connected.set()
+
+            try:
+                while True:
+                    header = await reader.readline()
+                    payload = await reader.readline()
+                    if not header or not payload:
+                        break
+                    route = loads(header)
+                    if self._deliver is not None:
+                        self._deliver(route["to"], payload[:-1].decode(), route["key"], route["exclude"])
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                print(f"Lost backplane connection: {e}")
+            finally:
+                self._writer = None
+                writer.close()
+            await asyncio.sleep(self.reconnect_delay)
+
+
+class BackplaneBroker:
+    """Relays every frame from any worker to all connected workers, in order"""
+    def __init__(self, path: str):
+        self.path = path
+        self._subscribers: List[asyncio.StreamWriter] = []
+        self._server = None
+        self.slow_disconnects = 0
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._server = await asyncio.start_unix_server(
+            self._handle, path=self.path, limit=MAX_FRAME_BYTES
+        )
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._subscribers.append(writer)
+        try:
+            while True:
+                header = await reader.readline()
+                payload = await reader.readline()
+                if not header or not payload:
+                    break
+                frame = header + payload
+                for subscriber in list(self._subscribers):
+                    if subscriber.transport.get_write_buffer_size() > MAX_BUFFERED_BYTES:
+                        # One stalled worker must not grow the broker without bound
+                        print("Disconnecting a backplane subscriber that is not reading")
+                        self.slow_disconnects += 1
+                        self._subscribers.remove(subscriber)
+                        subscriber.close()
+                        continue
+                    subscriber.write(frame)
+        except ConnectionError:
+            pass
+        finally:
+            if writer in self._subscribers:
+                self._subscribers.remove(writer)
+            writer.close()
+
+
+def create_backplane(url: Optional[str]) -> Backplane:
+    """Build a backplane from ``BACKPLANE_URL``: empty or ``unix:///path/to.sock``"""
+    if not url:
+        return InProcessBackplane()
+    if url.startswith("unix://"):
+        return UnixSocketBackplane(url[len("unix://"):])
+    raise ValueError(f"Unsupported backplane URL: {url}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the local backplane broker")
+    parser.add_argument("--path", default="/tmp/chat-backplane.sock")
+    args = parser.parse_args()
+    print(f"Backplane broker listening on {args.path}")
+    asyncio.run(BackplaneBroker(args.path).serve_forever())
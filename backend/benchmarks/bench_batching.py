@@ -0,0 +1,148 @@
+"""Outbound frames and server CPU for bursty senders, with and without batching.
+
+Starts a uvicorn worker, connects the members of a group chat and has one of
+them send bursts of messages. Each scenario reports events delivered, frames
+written and the server's CPU time per thousand events:
+
+- ``baseline``: one ``send_message`` per message, no coalescing
+- ``coalesce``: receivers connect with ``?coalesce_ms=``
+- ``batched``: bursts go out as one ``send_messages`` frame, plus coalescing
+
+Run from the backend directory:
+
+    python benchmarks/bench_batching.py --bursts 200 --burst-size 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+GROUP_CHAT = "chat_2"
+MEMBERS = ["alice", "bob", "charlie", "diana"]
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def cpu_seconds(pid: int) -> float:
+    """User plus system CPU time of a process, from /proc"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime and stime are fields 14 and 15; the split starts at field 3
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+async def wait_for_port(port: int, timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def count_messages(event: dict) -> int:
+    if event["type"] == "events":
+        return sum(count_messages(inner) for inner in event["events"])
+    return 1 if event["type"] == "new_message" and event["chat_id"] == GROUP_CHAT else 0
+
+
+async def receive(ws, expected: int, stats: dict):
+    while stats["events"] < expected:
+        stats["events"] += count_messages(json.loads(await ws.recv()))
+        stats["frames"] += 1
+
+
+async def scenario(port: int, pid: int, name: str, bursts: int, burst_size: int, coalesce_ms: int):
+    query = f"?coalesce_ms={coalesce_ms}" if coalesce_ms else ""
+    sockets = {}
+    for user_id in MEMBERS:
+        ws = await websockets.connect(f"ws://127.0.0.1:{port}/ws/{user_id}{query}", max_size=None)
+        sockets[user_id] = ws
+    # Let connect-time presence settle, then discard it
+    await asyncio.sleep(0.2 + coalesce_ms / 1000)
+    for ws in sockets.values():
+        while True:
+            try:
+                await asyncio.wait_for(ws.recv(), timeout=0.05)
+            except asyncio.TimeoutError:
+                break
+
+    expected = bursts * burst_size
+    stats = {user_id: {"events": 0, "frames": 0} for user_id in MEMBERS}
+    receivers = [
+        asyncio.create_task(receive(ws, expected, stats[user_id]))
+        for user_id, ws in sockets.items()
+    ]
+
+    sender = sockets["alice"]
+    cpu_start = cpu_seconds(pid)
+    start = time.perf_counter()
+    for burst in range(bursts):
+        texts = [f"burst {burst} message {i}" for i in range(burst_size)]
+        if name == "batched":
+            await sender.send(json.dumps({
+                "type": "send_messages",
+                "messages": [{"chat_id": GROUP_CHAT, "text": text} for text in texts]
+            }))
+        else:
+            for text in texts:
+                await sender.send(json.dumps({"type": "send_message", "chat_id": GROUP_CHAT, "text": text}))
+        await asyncio.sleep(0.001)
+    await asyncio.wait_for(asyncio.gather(*receivers), timeout=120)
+    elapsed = time.perf_counter() - start
+    cpu = cpu_seconds(pid) - cpu_start
+
+    events = sum(s["events"] for s in stats.values())
+    frames = sum(s["frames"] for s in stats.values())
+    print(f"{name:>9} {events:>8} {frames:>8} {frames / elapsed:>10.0f} "
+          f"{events / frames:>13.1f} {cpu * 1000 / events * 1000:>15.1f}")
+    for ws in sockets.values():
+        await ws.close()
+    await asyncio.sleep(0.2)
+
+
+async def run(port: int, pid: int, bursts: int, burst_size: int, coalesce_ms: int):
+    await wait_for_port(port)
+    print(f"bursts={bursts} burst size={burst_size} members={len(MEMBERS)} coalesce_ms={coalesce_ms}")
+    print(f"{'scenario':>9} {'events':>8} {'frames':>8} {'frames/sec':>10} "
+          f"{'events/frame':>13} {'CPU ms/1k ev':>15}")
+    await scenario(port, pid, "baseline", bursts, burst_size, 0)
+    await scenario(port, pid, "coalesce", bursts, burst_size, coalesce_ms)
+    await scenario(port, pid, "batched", bursts, burst_size, coalesce_ms)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--bursts", type=int, default=200)
+    parser.add_argument("--burst-size", type=int, default=10)
+    parser.add_argument("--coalesce-ms", type=int, default=10)
+    parser.add_argument("--port", type=int, default=8111)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+            cwd=BACKEND, env=dict(
+                os.environ, DATA_FILE=os.path.join(tmp, "chat_data.json"),
+                # Bursts go far past the default rate limits; measure delivery, not the limiter
+                RATE_LIMIT_USER_RATE="0", RATE_LIMIT_CHAT_RATE="0"
+            )
+        )
+        try:
+            asyncio.run(run(args.port, server.pid, args.bursts, args.burst_size, args.coalesce_ms))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Cost of encoding a new_message frame for a group, per recipient vs once.
+
+Run from the backend directory:
+
+    python benchmarks/bench_fanout.py
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import encoding  # noqa: E402
+
+
+def make_event() -> dict:
+    now = datetime.now()
+    return {
+        "type": "new_message",
+        "chat_id": "3",
+        "message": {
+            "id": str(uuid.uuid4()),
+            "text": "Joining in 5 mins, can someone share the agenda?",
+            "sender": "charlie",
+            "senderName": "Charlie",
+            "time": now.strftime("%I:%M %p"),
+            "timestamp": now.isoformat()
+        }
+    }
+
+
+def per_recipient(event: dict, recipients: int):
+    for _ in range(recipients):
+        json.dumps(event)
+
+
+def encode_once(event: dict, recipients: int):
+    payload = encoding.dumps(event)
+    for _ in range(recipients):
+        # Stand-in for handing the frame to each connection's queue
+        payload.__len__()
+
+
+def measure(fn, event: dict, recipients: int, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(event, recipients)
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="2,10,100,1000,10000")
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    event = make_event()
+    print(f"JSON backend: {encoding.JSON_BACKEND}")
+    print(f"{'group size':>10} {'per-recipient us':>17} {'encode-once us':>15} {'speedup':>8}")
+    for size in (int(size) for size in args.sizes.split(",")):
+        before = measure(per_recipient, event, size, args.rounds)
+        after = measure(encode_once, event, size, args.rounds)
+        print(f"{size:>10} {before * 1e6:>17.1f} {after * 1e6:>15.1f} {before / after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
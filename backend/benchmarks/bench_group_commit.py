@@ -0,0 +1,73 @@
+"""Sustained messages/sec at each group-commit durability level.
+
+Runs concurrent asyncio senders that each add a message and wait for its
+commit acknowledgment before sending the next, like websocket handlers that
+ack the sender only once the message is stored.
+
+Run from the backend directory:
+
+    python benchmarks/bench_group_commit.py --senders 200 --seconds 3
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from chat_service import ChatService  # noqa: E402
+from group_commit import DURABILITY_LEVELS  # noqa: E402
+from storage import JsonStorage, SqliteStorage  # noqa: E402
+
+ENGINES = {
+    "json": lambda tmp: JsonStorage(os.path.join(tmp, "chat_data.json")),
+    "sqlite": lambda tmp: SqliteStorage(os.path.join(tmp, "chat_data.db")),
+}
+
+
+async def sender(service: ChatService, index: int, deadline: float, counts: list):
+    sent = 0
+    while time.perf_counter() < deadline:
+        service.add_message("chat_2", "alice", f"sender {index} message {sent}")
+        await asyncio.wrap_future(service.committed())
+        sent += 1
+    counts[index] = sent
+
+
+async def run(service: ChatService, senders: int, seconds: float) -> float:
+    counts = [0] * senders
+    start = time.perf_counter()
+    deadline = start + seconds
+    await asyncio.gather(*(sender(service, i, deadline, counts) for i in range(senders)))
+    return sum(counts) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--senders", type=int, default=100)
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--commit-delay", type=float, default=0.002)
+    parser.add_argument("--engines", default="json,sqlite")
+    args = parser.parse_args()
+
+    print(f"{'engine':>8} {'durability':>10} {'msgs/sec':>10} {'batches':>8} {'avg batch':>10}")
+    for engine in args.engines.split(","):
+        for durability in DURABILITY_LEVELS:
+            with tempfile.TemporaryDirectory() as tmp:
+                service = ChatService(
+                    os.path.join(tmp, "chat_data.json"),
+                    storage=ENGINES[engine](tmp),
+                    durability=durability,
+                    commit_delay=args.commit_delay
+                )
+                rate = asyncio.run(run(service, args.senders, args.seconds))
+                service.close()
+                batches = service.writer.batches
+                average = service.writer.records / batches if batches else 0
+                print(f"{engine:>8} {durability:>10} {rate:>10.0f} {batches:>8} {average:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
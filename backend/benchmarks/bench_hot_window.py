@@ -0,0 +1,91 @@
+"""Memory under sustained traffic with and without a hot window budget.
+
+Sends ``--messages`` messages into ``--chats`` SQLite-backed chats, a few of
+them much busier than the rest, reading the latest page of a random chat
+every ``--read-every`` messages. RSS is sampled as the history grows. Each
+configuration runs in its own process so memory freed by one run does not
+flatter the next. The service starts lazily so the full-text index, which
+grows with history by design, is not built.
+
+Run from the backend directory:
+
+    python benchmarks/bench_hot_window.py --messages 500000 --budget-mb 16
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from chat_service import ChatService  # noqa: E402
+from storage import SqliteStorage  # noqa: E402
+
+CHECKPOINTS = 5
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def run(args, budget_mb, results):
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        service = ChatService(
+            storage=SqliteStorage(os.path.join(tmp, "chat_data.db")),
+            preload_messages=args.window,
+            lazy=True,
+            memory_budget=int(budget_mb * 1024 * 1024) if budget_mb else None
+        )
+        chat_ids = [
+            service.create_chat(f"group {i}", "group", ["alice", "bob", "charlie"]).chat_id
+            for i in range(args.chats)
+        ]
+        weights = [1 / (rank + 1) for rank in range(args.chats)]
+        samples = []
+        start = time.perf_counter()
+        for i in range(args.messages):
+            chat_id = rng.choices(chat_ids, weights)[0]
+            service.add_message(chat_id, "alice", f"sustained traffic message {i} " + "x" * rng.randint(0, 120))
+            if i % args.read_every == 0:
+                service.get_chat_history(rng.choice(chat_ids), limit=50)
+            if (i + 1) % (args.messages // CHECKPOINTS) == 0:
+                samples.append(rss_mb())
+        elapsed = time.perf_counter() - start
+        stats = service.get_cache_stats()
+        service.close()
+    results.put((samples, args.messages / elapsed, stats))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--chats", type=int, default=2000)
+    parser.add_argument("--window", type=int, default=200, help="messages kept per chat")
+    parser.add_argument("--budget-mb", type=float, default=16.0)
+    parser.add_argument("--read-every", type=int, default=10)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("fork")
+    print(f"RSS MB after each {args.messages // CHECKPOINTS} messages")
+    for label, budget_mb in (("window only", None), (f"{args.budget_mb:g}MB budget", args.budget_mb)):
+        results = context.Queue()
+        process = context.Process(target=run, args=(args, budget_mb, results))
+        process.start()
+        samples, rate, stats = results.get()
+        process.join()
+        print(f"{label:>14}: " + " ".join(f"{sample:7.1f}" for sample in samples) + f"   {rate:,.0f} msg/s")
+        print(f"{'':>14}  resident {stats['resident_messages']} messages in {stats['resident_chats']} chats, "
+              f"hit rate {stats['hit_rate']:.2f}, {stats['faults']} faults, "
+              f"{stats['trimmed_messages']} trimmed, {stats['evicted_chats']} chat evictions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Sender latency, fan-out completion and small-chat lag for one very large group.
+
+Connects ``--online`` of a ``--members`` member group to a ConnectionManager
+over in-memory sockets and publishes ``--messages`` frames into the group,
+once delivering inline and once through the sharded delivery workers. For
+each frame it records how long publishing held the sender's handler and how
+long until every online member had the frame queued. A ticker standing in
+for small chats wakes every ``--tick-ms`` and records how late it ran, which
+is how long a message into a small chat would have waited.
+
+Run from the backend directory:
+
+    python benchmarks/bench_large_group.py --members 10000 --online 0.5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from connection_manager import ConnectionManager  # noqa: E402
+from fanout import ShardedFanout  # noqa: E402
+
+FRAME = '{"type":"new_message","chat_id":"town_hall","message":{"text":"Welcome everyone!"}}'
+
+
+class NullSocket:
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)] if samples else 0.0
+
+
+async def ticker(interval: float, lags: List[float], done: asyncio.Event):
+    loop = asyncio.get_event_loop()
+    while not done.is_set():
+        due = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(loop.time() - due, 0.0))
+
+
+async def run(mode: str, args):
+    fanout = ShardedFanout(shards=args.shards)
+    manager = ConnectionManager(fanout=fanout)
+    if mode == "sharded":
+        fanout.start()
+    members = [f"user{i}" for i in range(args.members)]
+    step = max(int(round(1 / args.online)), 1) if args.online > 0 else args.members + 1
+    for user_id in members[::step]:
+        await manager.connect(NullSocket(), user_id)
+
+    lags: List[float] = []
+    done = asyncio.Event()
+    tick = asyncio.get_event_loop().create_task(ticker(args.tick_ms / 1000, lags, done))
+    publish, completion = [], []
+    for n in range(args.messages):
+        start = time.perf_counter()
+        manager.broadcast_to_users(FRAME, members)
+        publish.append(time.perf_counter() - start)
+        while mode == "sharded" and fanout.completed <= n:
+            await asyncio.sleep(0)
+        completion.append(time.perf_counter() - start)
+        # Let the writers drain before the next frame
+        await asyncio.sleep(args.gap_ms / 1000)
+    done.set()
+    await tick
+    await fanout.stop()
+    for user_id in list(manager.active_connections):
+        manager.disconnect_user(user_id)
+    return publish, completion, lags
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--members", type=int, default=10000)
+    parser.add_argument("--online", type=float, default=0.5, help="fraction of members connected")
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--tick-ms", type=float, default=1.0)
+    parser.add_argument("--gap-ms", type=float, default=20.0, help="pause between frames into the group")
+    args = parser.parse_args()
+
+    print(f"{args.members} members, {args.online:.0%} online, {args.messages} frames, ms")
+    print(f"{'mode':>8} {'publish p50':>12} {'publish p99':>12} {'complete p50':>13} "
+          f"{'complete p99':>13} {'small-chat lag p99':>19}")
+    for mode in ("inline", "sharded"):
+        publish, completion, lags = asyncio.run(run(mode, args))
+        print(f"{mode:>8} {percentile(publish, 0.5) * 1000:>12.2f} {percentile(publish, 0.99) * 1000:>12.2f} "
+              f"{percentile(completion, 0.5) * 1000:>13.2f} {percentile(completion, 0.99) * 1000:>13.2f} "
+              f"{percentile(lags, 0.99) * 1000:>19.2f}")
+
+
+if __name__ == "__main__":
+    main()
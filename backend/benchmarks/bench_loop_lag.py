@@ -0,0 +1,141 @@
+"""Event loop lag while the chat service is busy with persistence.
+
+Seeds ``--history`` messages into a few chats, then runs the same workload
+twice on an event loop: bursts of ``add_message``, history pages read from
+deep in the backlog and a full ``save_data`` snapshot every
+``--snapshot-every`` bursts. ``direct`` calls the ``ChatService`` on the loop
+the way the server used to; ``async`` goes through ``AsyncChatService``. A
+ticker sleeping ``--tick-ms`` at a time records how late each wakeup was,
+which is how long a WebSocket frame would have waited.
+
+Exits non-zero when the async p99 is above ``--threshold-ms``.
+
+Run from the backend directory:
+
+    python benchmarks/bench_loop_lag.py --storage sqlite --history 200000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from async_chat_service import AsyncChatService  # noqa: E402
+from chat_service import ChatService  # noqa: E402
+from pagination import encode_cursor  # noqa: E402
+from storage import create_storage  # noqa: E402
+
+CHATS = 4
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+def build_service(url: str) -> ChatService:
+    return ChatService(storage=create_storage(url), lazy=True)
+
+
+def seed(url: str, history: int) -> List[str]:
+    service = build_service(url)
+    chat_ids = [
+        service.create_chat(f"busy {i}", "group", ["alice", "bob", "charlie"]).chat_id
+        for i in range(CHATS)
+    ]
+    for i in range(history):
+        service.add_message(chat_ids[i % CHATS], "alice", f"seeded message {i} " + "x" * (i % 80))
+    service.save_data()
+    service.close()
+    return chat_ids
+
+
+async def ticker(interval: float, lags: List[float], done: asyncio.Event):
+    loop = asyncio.get_event_loop()
+    while not done.is_set():
+        due = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(loop.time() - due, 0.0))
+
+
+def work(service: ChatService, chat_ids: List[str], args, rng: random.Random, burst: int):
+    """One burst of the workload, run wherever the caller puts it"""
+    for i in range(args.burst):
+        service.add_message(rng.choice(chat_ids), "bob", f"burst {burst} message {i}")
+    chat_id = rng.choice(chat_ids)
+    before = encode_cursor(chat_id, rng.randrange(1, args.history // CHATS))
+    service.get_chat_history(chat_id, before=before, limit=50)
+    if (burst + 1) % args.snapshot_every == 0:
+        service.save_data()
+
+
+async def run(mode: str, url: str, chat_ids: List[str], args) -> List[float]:
+    rng = random.Random(1)
+    lags: List[float] = []
+    done = asyncio.Event()
+    if mode == "async":
+        facade = AsyncChatService(lambda: build_service(url))
+        await facade.start()
+    else:
+        service = build_service(url)
+    tick = asyncio.get_event_loop().create_task(ticker(args.tick_ms / 1000, lags, done))
+    for burst in range(args.bursts):
+        if mode == "async":
+            await facade._call(work, facade.service, chat_ids, args, rng, burst)
+        else:
+            work(service, chat_ids, args, rng, burst)
+        # Other connections get a turn between bursts either way
+        await asyncio.sleep(0)
+    done.set()
+    await tick
+    if mode == "async":
+        await facade.close()
+    else:
+        service.close()
+    return lags
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--storage", choices=("json", "sqlite"), default="sqlite")
+    parser.add_argument("--history", type=int, default=100000, help="messages seeded before measuring")
+    parser.add_argument("--bursts", type=int, default=200)
+    parser.add_argument("--burst", type=int, default=50, help="messages per burst")
+    parser.add_argument("--snapshot-every", type=int, default=20)
+    parser.add_argument("--tick-ms", type=float, default=5.0)
+    parser.add_argument("--threshold-ms", type=float, default=20.0, help="highest acceptable async p99")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.storage == "sqlite":
+            url = "sqlite:///" + os.path.join(tmp, "chat_data.db")
+        else:
+            url = "json://" + os.path.join(tmp, "chat_data.json")
+        start = time.perf_counter()
+        chat_ids = seed(url, args.history)
+        print(f"seeded {args.history} messages into {args.storage} in {time.perf_counter() - start:.1f}s")
+
+        print(f"loop lag over {args.bursts} bursts of {args.burst} messages, ms")
+        print(f"{'mode':>8} {'p50':>8} {'p99':>8} {'max':>8} {'ticks':>7}")
+        measured = {}
+        for mode in ("direct", "async"):
+            lags = asyncio.run(run(mode, url, chat_ids, args))
+            measured[mode] = percentile(lags, 0.99) * 1000
+            print(f"{mode:>8} {percentile(lags, 0.5) * 1000:>8.2f} {measured[mode]:>8.2f} "
+                  f"{max(lags, default=0.0) * 1000:>8.2f} {len(lags):>7}")
+
+    if measured["async"] > args.threshold_ms:
+        print(f"FAIL: async p99 {measured['async']:.2f}ms is above {args.threshold_ms:g}ms")
+        sys.exit(1)
+    print(f"OK: async p99 {measured['async']:.2f}ms is within {args.threshold_ms:g}ms")
+
+
+if __name__ == "__main__":
+    main()
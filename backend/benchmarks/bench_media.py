@@ -0,0 +1,121 @@
+"""Media upload and download throughput, and what media costs the message path.
+
+Starts a uvicorn worker, uploads a ``--size-mb`` file in ``--chunk-mb``
+chunks through the upload API, uploads it again to check deduplication,
+then downloads it whole and in ``--range-kb`` ranges. Finally compares the
+``new_message`` frame for the attachment with the frame an inline base64
+copy would have needed.
+
+Run from the backend directory:
+
+    python benchmarks/bench_media.py --size-mb 64 --chunk-mb 4
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def wait_for_server(base: str, timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"{base}/api/health", timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+def upload(client: httpx.Client, data: bytes, chunk: int) -> dict:
+    session = client.post("/api/uploads", params={
+        "user_id": "alice", "filename": "video.mp4", "content_type": "video/mp4"
+    }).json()
+    for offset in range(0, len(data), chunk):
+        client.put(
+            f"/api/uploads/{session['upload_id']}",
+            params={"user_id": "alice", "offset": offset},
+            content=data[offset:offset + chunk]
+        ).raise_for_status()
+    response = client.post(f"/api/uploads/{session['upload_id']}/complete", params={"user_id": "alice"})
+    response.raise_for_status()
+    return response.json()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=64)
+    parser.add_argument("--chunk-mb", type=float, default=4)
+    parser.add_argument("--range-kb", type=int, default=256)
+    parser.add_argument("--ranges", type=int, default=200)
+    parser.add_argument("--port", type=int, default=8131)
+    args = parser.parse_args()
+
+    size = int(args.size_mb * 1024 * 1024)
+    data = random.Random(1).randbytes(size)
+    base = f"http://127.0.0.1:{args.port}"
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATA_FILE=os.path.join(tmp, "chat_data.json"), MEDIA_ROOT=os.path.join(tmp, "media"))
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+            cwd=BACKEND, env=env
+        )
+        try:
+            wait_for_server(base)
+            with httpx.Client(base_url=base, timeout=120) as client:
+                start = time.perf_counter()
+                metadata = upload(client, data, int(args.chunk_mb * 1024 * 1024))
+                elapsed = time.perf_counter() - start
+                print(f"upload {args.size_mb:g}MB in {args.chunk_mb:g}MB chunks: {args.size_mb / elapsed:.0f} MB/s")
+
+                start = time.perf_counter()
+                again = upload(client, data, int(args.chunk_mb * 1024 * 1024))
+                elapsed = time.perf_counter() - start
+                print(f"same content again: {args.size_mb / elapsed:.0f} MB/s, "
+                      f"deduplicated={again['deduplicated']}, same blob={again['blob_id'] == metadata['blob_id']}")
+
+                url = f"/api/media/{metadata['blob_id']}"
+                start = time.perf_counter()
+                body = client.get(url).content
+                elapsed = time.perf_counter() - start
+                assert body == data
+                print(f"full download: {args.size_mb / elapsed:.0f} MB/s")
+
+                rng = random.Random(2)
+                length = args.range_kb * 1024
+                latencies = []
+                for _ in range(args.ranges):
+                    offset = rng.randrange(0, size - length)
+                    start = time.perf_counter()
+                    response = client.get(url, headers={"Range": f"bytes={offset}-{offset + length - 1}"})
+                    latencies.append(time.perf_counter() - start)
+                    assert response.status_code == 206 and response.content == data[offset:offset + length]
+                latencies.sort()
+                print(f"{args.range_kb}KB range requests: p50 {latencies[len(latencies) // 2] * 1000:.2f}ms "
+                      f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms")
+        finally:
+            server.terminate()
+            server.wait()
+
+    reference = {"type": "new_message", "chat_id": "chat_1", "message": {
+        "id": "05380f70-dd93-4607-8236-5c5c82b98492", "text": "", "sender": "alice", "senderName": "Alice",
+        "time": "02:57 PM", "timestamp": "2024-01-01T14:57:45.531646", "seq": 2, "type": "file",
+        "attachment": {"blob_id": metadata["blob_id"], "name": "video.mp4", "size": size, "content_type": "video/mp4"}
+    }}
+    reference_bytes = len(json.dumps(reference))
+    inline_bytes = reference_bytes + len(base64.b64encode(data))
+    print(f"new_message frame: {reference_bytes} bytes with a blob reference, "
+          f"{inline_bytes / 1024 / 1024:.1f}MB with inline base64 (per recipient, and in the log)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Retained bytes per message for the old and compact representations.
+
+Compares the original plain-class Message, the dict main.py used to keep per
+message, and the current slotted Message.
+
+Run from the backend directory:
+
+    python benchmarks/bench_memory.py --messages 200000
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from models import Message, MessageType  # noqa: E402
+
+SENDERS = ["alice", "bob", "charlie", "diana"]
+
+
+def fresh(value: str) -> str:
+    """A new string object, as ids decoded from the wire or a JSON file are"""
+    return "".join(list(value))
+
+
+class LegacyMessage:
+    """Message as it was before __slots__: per-instance __dict__ and a datetime"""
+    def __init__(self, message_id, chat_id, sender_id, text, message_type=MessageType.TEXT, timestamp=None):
+        self.message_id = message_id
+        self.chat_id = chat_id
+        self.sender_id = sender_id
+        self.text = text
+        self.message_type = message_type
+        self.timestamp = timestamp or datetime.now()
+        self.is_read = False
+
+
+def legacy_dict(i: int) -> dict:
+    now = datetime.now()
+    return {
+        "id": str(uuid.uuid4()),
+        "text": f"message {i}",
+        "sender": fresh(SENDERS[i % 4]),
+        "senderName": SENDERS[i % 4].title(),
+        "time": now.strftime("%I:%M %p"),
+        "timestamp": now.isoformat()
+    }
+
+
+def legacy_object(i: int) -> LegacyMessage:
+    return LegacyMessage(str(uuid.uuid4()), fresh("chat_2"), fresh(SENDERS[i % 4]), f"message {i}")
+
+
+def compact_object(i: int) -> Message:
+    return Message(str(uuid.uuid4()), fresh("chat_2"), fresh(SENDERS[i % 4]), f"message {i}")
+
+
+def measure(factory, count: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    retained = [factory(i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del retained
+    return (after - before) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"{'representation':>24} {'bytes/message':>14}")
+    for name, factory in (
+        ("main.py message dict", legacy_dict),
+        ("plain Message", legacy_object),
+        ("slotted Message", compact_object),
+    ):
+        print(f"{name:>24} {measure(factory, args.messages):>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
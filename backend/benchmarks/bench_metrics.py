@@ -0,0 +1,69 @@
+"""Overhead of the built-in instrumentation on a hot path.
+
+Times ``encoding.dumps`` of a new_message frame, which is timed into
+``chat_json_encode_seconds``, with metrics disabled and enabled, against the
+bare JSON backend call.
+
+Run from the backend directory:
+
+    python benchmarks/bench_metrics.py
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import encoding  # noqa: E402
+import metrics  # noqa: E402
+
+EVENT = {
+    "type": "new_message",
+    "chat_id": "3",
+    "message": {
+        "id": "713231ef-46b1-4c08-9c4b-4a47fc8465ff",
+        "text": "Joining in 5 mins, can someone share the agenda?",
+        "sender": "charlie",
+        "senderName": "Charlie",
+        "time": "02:30 PM",
+        "timestamp": "2024-01-01T14:30:32.472215",
+        "seq": 1
+    }
+}
+
+
+def bare(event: dict) -> str:
+    if encoding.orjson is not None:
+        return encoding.orjson.dumps(event).decode()
+    return json.dumps(event, separators=(",", ":"))
+
+
+def measure(fn, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(EVENT)
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=200000)
+    args = parser.parse_args()
+
+    baseline = measure(bare, args.rounds)
+    metrics.set_enabled(False)
+    disabled = measure(encoding.dumps, args.rounds)
+    metrics.set_enabled(True)
+    enabled = measure(encoding.dumps, args.rounds)
+
+    print(f"JSON backend: {encoding.JSON_BACKEND}")
+    print(f"{'variant':>18} {'ns/call':>9} {'overhead ns':>12}")
+    print(f"{'bare backend':>18} {baseline * 1e9:>9.0f} {'':>12}")
+    print(f"{'metrics disabled':>18} {disabled * 1e9:>9.0f} {(disabled - baseline) * 1e9:>12.0f}")
+    print(f"{'metrics enabled':>18} {enabled * 1e9:>9.0f} {(enabled - baseline) * 1e9:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Cross-worker delivery and ordering through the Unix-socket backplane.
+
+Starts the shared chat service, a backplane broker and several uvicorn
+workers on one box, connects group members to different workers, sends a
+burst of messages and checks that every member receives all of them in send
+order with the same seq numbers. Exits non-zero if anything is missing, out
+of order or numbered differently. tests/test_multiworker.py covers
+reconnects and history across workers.
+
+Run from the backend directory:
+
+    python benchmarks/bench_multiworker.py --workers 3 --messages 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+GROUP_CHAT = "chat_2"
+MEMBERS = ["alice", "bob", "charlie", "diana"]
+
+
+async def wait_for_port(port: int, timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"worker on port {port} did not start")
+
+
+async def receive_messages(ws, expected: int, received: list, latencies: list):
+    while len(received) < expected:
+        event = json.loads(await ws.recv())
+        if event["type"] == "new_message" and event["chat_id"] == GROUP_CHAT:
+            text = event["message"]["text"]
+            received.append((text, event["message"]["seq"]))
+            sent_at = float(text.split("@", 1)[1])
+            latencies.append(time.perf_counter() - sent_at)
+
+
+async def run(ports: list, messages: int) -> bool:
+    for port in ports:
+        await wait_for_port(port)
+
+    # Spread the group across workers
+    sockets = {}
+    for i, user_id in enumerate(MEMBERS):
+        port = ports[i % len(ports)]
+        ws = await websockets.connect(f"ws://127.0.0.1:{port}/ws/{user_id}", max_size=None)
+        sockets[user_id] = ws
+        while json.loads(await ws.recv())["type"] != "initial_data":
+            pass
+
+    received = {user_id: [] for user_id in MEMBERS}
+    latencies = []
+    receivers = [
+        asyncio.create_task(receive_messages(ws, messages, received[user_id], latencies))
+        for user_id, ws in sockets.items()
+    ]
+
+    start = time.perf_counter()
+    sender = sockets["alice"]
+    for i in range(messages):
+        await sender.send(json.dumps({
+            "type": "send_message",
+            "chat_id": GROUP_CHAT,
+            "text": f"{i}@{time.perf_counter()}"
+        }))
+    await asyncio.wait_for(asyncio.gather(*receivers), timeout=60)
+    elapsed = time.perf_counter() - start
+
+    ok = True
+    for user_id, texts in received.items():
+        order = [int(text.split("@", 1)[0]) for text, _ in texts]
+        if order != list(range(messages)):
+            print(f"FAIL {user_id}: received {len(order)} messages out of order or incomplete")
+            ok = False
+        if [seq for _, seq in texts] != [seq for _, seq in received["alice"]]:
+            print(f"FAIL {user_id}: seq numbers differ from the sender's")
+            ok = False
+    latencies.sort()
+    print(f"workers={len(ports)} members={len(MEMBERS)} messages={messages}")
+    print(f"deliveries/sec: {messages * len(MEMBERS) / elapsed:.0f}")
+    print(f"latency p50: {latencies[len(latencies) // 2] * 1000:.2f}ms "
+          f"p99: {latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms")
+    for ws in sockets.values():
+        await ws.close()
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--base-port", type=int, default=8101)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        socket_path = os.path.join(tmp, "backplane.sock")
+        service_path = os.path.join(tmp, "chat-service.sock")
+        # Senders burst well past the default rate limits; measure delivery, not the limiter
+        env = dict(
+            os.environ,
+            BACKPLANE_URL=f"unix://{socket_path}",
+            CHAT_SERVICE_URL=f"unix://{service_path}",
+            DATA_FILE=os.path.join(tmp, "chat_data.json"),
+            RATE_LIMIT_USER_RATE="0",
+            RATE_LIMIT_CHAT_RATE="0"
+        )
+        processes = [
+            subprocess.Popen([sys.executable, "backplane.py", "--path", socket_path], cwd=BACKEND),
+            # Every worker stores and numbers messages through the one chat service
+            subprocess.Popen([sys.executable, "chat_rpc.py", "--path", service_path], cwd=BACKEND, env=env),
+        ]
+        ports = [args.base_port + i for i in range(args.workers)]
+        try:
+            time.sleep(0.5)
+            for port in ports:
+                processes.append(subprocess.Popen(
+                    [sys.executable, "-m", "uvicorn", "main:app",
+                     "--port", str(port), "--log-level", "warning"],
+                    cwd=BACKEND, env=env
+                ))
+            ok = asyncio.run(run(ports, args.messages))
+        finally:
+            # Workers first, while the chat service can still take their last calls
+            for process in reversed(processes):
+                process.terminate()
+                process.wait()
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Per-message write cost as chat history grows.
+
+Run from the backend directory:
+
+    python benchmarks/bench_persistence.py
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from chat_service import ChatService  # noqa: E402
+from storage import JsonStorage  # noqa: E402
+
+
+def time_sends(service: ChatService, count: int) -> float:
+    start = time.perf_counter()
+    for i in range(count):
+        service.add_message("chat_2", "alice", f"bench message {i}")
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="1000,10000,50000,100000")
+    parser.add_argument("--samples", type=int, default=500)
+    parser.add_argument("--fsync", default="interval", choices=["always", "interval", "never"])
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    with tempfile.TemporaryDirectory() as tmp:
+        data_file = os.path.join(tmp, "chat_data.json")
+        service = ChatService(
+            data_file,
+            storage=JsonStorage(data_file, fsync=args.fsync, compact_threshold=max(sizes))
+        )
+        history = 0
+        print(f"{'history':>10} {'us/message':>12}")
+        for size in sizes:
+            # Grow the history without timing it
+            while history < size:
+                service.add_message("chat_2", "bob", f"history {history}")
+                history += 1
+            per_message = time_sends(service, args.samples)
+            history += args.samples
+            print(f"{size:>10} {per_message * 1e6:>12.1f}")
+
+        start = time.perf_counter()
+        service.storage.wal.compact(wait=True)
+        print(f"background compaction of {history} messages: {time.perf_counter() - start:.3f}s")
+        service.close()
+
+        start = time.perf_counter()
+        reloaded = ChatService(data_file)
+        print(f"load_data after compaction: {time.perf_counter() - start:.3f}s "
+              f"({len(reloaded.chats['chat_2'].messages)} messages in chat_2)")
+
+
+if __name__ == "__main__":
+    main()
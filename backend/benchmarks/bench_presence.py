@@ -0,0 +1,78 @@
+"""Presence deliveries during a reconnect storm: broadcast-to-all vs digests.
+
+Every user reconnects once. The old behaviour sent ``user_online`` to every
+connected socket; ``PresenceService`` sends each change to the user's contacts
+only, in digests. Users are spread over group chats of ``--group-size`` members.
+
+Run from the backend directory:
+
+    python benchmarks/bench_presence.py --users 10000
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Dict, List, Set
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from presence import PresenceService  # noqa: E402
+
+
+def build_contacts(users: int, group_size: int, groups_per_user: int) -> Dict[str, Set[str]]:
+    contacts: Dict[str, Set[str]] = {f"user{i}": set() for i in range(users)}
+    for offset in range(groups_per_user):
+        # Shift the grouping so each user lands in different groups
+        shifted = [f"user{(i * (offset + 1) + offset) % users}" for i in range(users)]
+        for start in range(0, users, group_size):
+            members = shifted[start:start + group_size]
+            for member in members:
+                contacts[member].update(members)
+    for user_id, users_contacts in contacts.items():
+        users_contacts.discard(user_id)
+    return contacts
+
+
+def broadcast_storm(users: int) -> int:
+    # Each connect is handed to every socket already online
+    return users * (users - 1) // 2
+
+
+def digest_storm(contacts: Dict[str, Set[str]]) -> List[int]:
+    stats = [0, 0]
+
+    def publish(frame: str, user_ids: List[str], coalesce_key=None):
+        stats[0] += 1
+        stats[1] += len(user_ids)
+
+    presence = PresenceService(publish, contacts.__getitem__, debounce=0)
+    for user_id in contacts:
+        presence.connected(user_id, {"id": user_id, "online": True})
+    presence.flush()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--group-size", type=int, default=20)
+    parser.add_argument("--groups-per-user", type=int, default=3)
+    args = parser.parse_args()
+
+    contacts = build_contacts(args.users, args.group_size, args.groups_per_user)
+    avg_contacts = sum(len(c) for c in contacts.values()) / len(contacts)
+
+    broadcast_deliveries = broadcast_storm(args.users)
+    start = time.perf_counter()
+    frames, digest_deliveries = digest_storm(contacts)
+    digest_time = time.perf_counter() - start
+
+    print(f"users={args.users} avg contacts={avg_contacts:.1f}")
+    print(f"{'strategy':>10} {'encoded frames':>15} {'socket writes':>14}")
+    print(f"{'broadcast':>10} {args.users:>15} {broadcast_deliveries:>14}")
+    print(f"{'digest':>10} {frames:>15} {digest_deliveries:>14}")
+    print(f"digest built in {digest_time:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
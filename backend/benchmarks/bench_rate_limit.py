@@ -0,0 +1,89 @@
+"""Cost of the rate limiter on the receive path, and what it lets through.
+
+First times ``RateLimiter.reserve`` for ``--users`` senders spread over
+``--chats`` chats, which is what every inbound event pays. Then simulates
+``--seconds`` on a virtual clock: one client floods a chat at ``--flood``
+events a second while ``--quiet`` clients send one message a second into
+the same chat. Each client's receive loop sleeps whatever ``reserve``
+returns, as the server does. Reports how many events each kind of client
+got through, paused or refused with ``slow_down``.
+
+Run from the backend directory:
+
+    python benchmarks/bench_rate_limit.py --flood 1000 --quiet 20
+"""
+import argparse
+import heapq
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from rate_limit import RateLimiter, SlowDown  # noqa: E402
+
+
+def time_reserve(limiter: RateLimiter, users: int, chats: int, rounds: int) -> float:
+    rng = random.Random(1)
+    keys = [(f"user{rng.randrange(users)}", {f"chat{rng.randrange(chats)}": 1}) for _ in range(rounds)]
+    start = time.perf_counter()
+    for n, (user_id, chat_costs) in enumerate(keys):
+        try:
+            # Spread over a virtual minute so buckets refill as they would live
+            limiter.reserve(user_id, 1, chat_costs, now=n * 60.0 / rounds)
+        except SlowDown:
+            pass
+    return (time.perf_counter() - start) / rounds
+
+
+def simulate(limiter: RateLimiter, flood: float, quiet: int, seconds: float):
+    """Returns {client kind: [sent, admitted, paused, refused]}"""
+    stats = {"flood": [0, 0, 0, 0], "quiet": [0, 0, 0, 0]}
+    # (time the client next reads, client id, seconds between its events)
+    clients = [(0.0, "flooder", 1.0 / flood)]
+    clients += [(random.Random(i).random(), f"quiet{i}", 1.0) for i in range(quiet)]
+    heapq.heapify(clients)
+    while clients[0][0] < seconds:
+        now, user_id, interval = heapq.heappop(clients)
+        counts = stats["flood" if user_id == "flooder" else "quiet"]
+        counts[0] += 1
+        try:
+            delay = limiter.reserve(user_id, 1, {"chat_1": 1}, now=now)
+        except SlowDown as e:
+            counts[3] += 1
+            # A well-behaved client waits as told before sending again
+            heapq.heappush(clients, (now + e.retry_after, user_id, interval))
+            continue
+        counts[1] += 1
+        if delay > 0:
+            counts[2] += 1
+        # The next event is read once the pause is over
+        heapq.heappush(clients, (now + delay + interval, user_id, interval))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--chats", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=500000)
+    parser.add_argument("--flood", type=float, default=1000.0, help="events a second from the flooding client")
+    parser.add_argument("--quiet", type=int, default=20, help="clients sending one message a second")
+    parser.add_argument("--seconds", type=float, default=60.0)
+    args = parser.parse_args()
+
+    limiter = RateLimiter.from_env()
+    per_call = time_reserve(limiter, args.users, args.chats, args.rounds)
+    print(f"reserve: {per_call * 1e9:.0f}ns per event ({args.users} users, {args.chats} chats)")
+
+    limiter = RateLimiter.from_env()
+    stats = simulate(limiter, args.flood, args.quiet, args.seconds)
+    print(f"\n{args.seconds:g}s of one client at {args.flood:g}/s and {args.quiet} at 1/s in one chat")
+    print(f"{'client':>8} {'sent':>8} {'admitted':>9} {'per s':>7} {'paused':>8} {'refused':>8}")
+    for kind, (sent, admitted, paused, refused) in stats.items():
+        print(f"{kind:>8} {sent:>8} {admitted:>9} {admitted / args.seconds:>7.1f} {paused:>8} {refused:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Search index build rate, memory and query latency over millions of messages.
+
+Builds a ``SearchIndex`` over a synthetic corpus with a Zipf-distributed
+vocabulary spread across many chats, then times first-page queries of each
+kind for random users, who can only see their own chats. Exits non-zero if a
+query kind misses the p99 latency target.
+
+Run from the backend directory:
+
+    python benchmarks/bench_search.py --messages 2000000
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from search_index import SearchIndex, tokenize  # noqa: E402
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "de", "an", "is", "or", "ul", "pe", "go", "ba"]
+
+
+class Doc:
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+def make_vocabulary(size: int, rng: random.Random) -> List[str]:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words, key=lambda word: rng.random())
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--chats", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--chats-per-user", type=int, default=20)
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--target-ms", type=float, default=50.0, help="p99 latency target")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocabulary = make_vocabulary(args.vocabulary, rng)
+    weights = [1.0 / rank for rank in range(1, len(vocabulary) + 1)]
+    chat_ids = [f"chat{i}" for i in range(args.chats)]
+    user_chats = {
+        f"user{i}": rng.sample(chat_ids, args.chats_per_user) for i in range(args.users)
+    }
+
+    docs: Dict[str, List[Doc]] = {chat_id: [] for chat_id in chat_ids}
+    index = SearchIndex()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    build = 0.0
+    batch = 100000
+    for done in range(0, args.messages, batch):
+        count = min(batch, args.messages - done)
+        words = rng.choices(vocabulary, weights, k=count * 8)
+        lengths = [rng.randint(3, 13) for _ in range(count)]
+        chats = rng.choices(chat_ids, k=count)
+        texts = []
+        cursor = 0
+        for length in lengths:
+            texts.append(" ".join(words[cursor % len(words):cursor % len(words) + length]))
+            cursor += length
+        start = time.perf_counter()
+        for chat_id, text in zip(chats, texts):
+            messages = docs[chat_id]
+            index.add(chat_id, len(messages), text)
+            messages.append(Doc(text))
+        build += time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def fetch(chat_id: str, seq: int):
+        return docs[chat_id][seq]
+
+    print(f"messages={args.messages} chats={args.chats} users={args.users} terms={index.term_count}")
+    print(f"build: {args.messages / build:.0f} messages/sec, "
+          f"peak RSS grew {(rss_after - rss_before) / 1024:.0f} MB (index plus corpus)")
+
+    def sample_phrase() -> str:
+        while True:
+            messages = docs[rng.choice(chat_ids)]
+            tokens = tokenize(rng.choice(messages).text) if messages else []
+            if len(tokens) >= 2:
+                start = rng.randrange(len(tokens) - 1)
+                return f'"{tokens[start]} {tokens[start + 1]}"'
+
+    kinds = {
+        "common": lambda: vocabulary[rng.randrange(5)],
+        "rare": lambda: vocabulary[rng.randrange(len(vocabulary) // 2, len(vocabulary))],
+        "and": lambda: f"{vocabulary[rng.randrange(50)]} {vocabulary[rng.randrange(50, 500)]}",
+        "prefix": lambda: vocabulary[rng.randrange(100)][:3] + "*",
+        "phrase": sample_phrase,
+    }
+    users = list(user_chats)
+    ok = True
+    print(f"{'query':>8} {'p50 ms':>8} {'p99 ms':>8} {'avg hits':>9}")
+    for kind, make_query in kinds.items():
+        latencies = []
+        hits = 0
+        for _ in range(args.queries):
+            query = make_query()
+            user_id = rng.choice(users)
+            start = time.perf_counter()
+            results, _ = index.search(query, user_chats[user_id], args.limit, fetch=fetch)
+            latencies.append(time.perf_counter() - start)
+            hits += len(results)
+        p99 = percentile(latencies, 0.99) * 1000
+        if p99 > args.target_ms:
+            ok = False
+        print(f"{kind:>8} {percentile(latencies, 0.5) * 1000:>8.2f} {p99:>8.2f} "
+              f"{hits / args.queries:>9.1f}{'' if p99 <= args.target_ms else '  over target'}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
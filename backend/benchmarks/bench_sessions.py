@@ -0,0 +1,71 @@
+"""Fan-out cost per recipient session as the number of open sessions grows.
+
+Connects ``--users`` users with 1..N sessions each to a ConnectionManager
+over in-memory sockets, then times delivering a frame to a group of
+``--group`` users. Cost should track the recipients' sessions only, not how
+many sessions are open overall.
+
+Run from the backend directory:
+
+    python benchmarks/bench_sessions.py --users 1000,10000,50000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from connection_manager import ConnectionManager  # noqa: E402
+
+FRAME = '{"type":"new_message","chat_id":"3","message":{"text":"Joining in 5 mins"}}'
+
+
+class NullSocket:
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def measure(users: int, sessions: int, group: int, rounds: int) -> float:
+    manager = ConnectionManager(max_sessions=sessions)
+    for i in range(users):
+        for _ in range(sessions):
+            await manager.connect(NullSocket(), f"user{i}")
+    recipients = [f"user{i}" for i in range(0, users, max(users // group, 1))][:group]
+    elapsed = 0.0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        manager._deliver(recipients, FRAME, None)
+        elapsed += time.perf_counter() - start
+        # Let the writer tasks drain so queues never fill up
+        await asyncio.sleep(0)
+    for user_id in list(manager.active_connections):
+        manager.disconnect_user(user_id)
+    return elapsed / rounds / (len(recipients) * sessions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", default="1000,10000,50000")
+    parser.add_argument("--sessions", default="1,2,4")
+    parser.add_argument("--group", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    sessions_per_user = [int(count) for count in args.sessions.split(",")]
+    print(f"ns per delivered session, group of {args.group} users")
+    print(f"{'users':>8} " + " ".join(f"{f'{count} sess/user':>13}" for count in sessions_per_user))
+    for users in (int(users) for users in args.users.split(",")):
+        costs = [asyncio.run(measure(users, count, args.group, args.rounds)) for count in sessions_per_user]
+        print(f"{users:>8} " + " ".join(f"{cost * 1e9:>13.0f}" for cost in costs))
+
+
+if __name__ == "__main__":
+    main()
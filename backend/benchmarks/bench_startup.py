@@ -0,0 +1,64 @@
+"""ChatService startup time as the data file grows, eager vs lazy loading.
+
+Run from the backend directory:
+
+    python benchmarks/bench_startup.py --sizes 10000,100000,500000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from chat_service import ChatService  # noqa: E402
+from storage import JsonStorage, SqliteStorage  # noqa: E402
+
+ENGINES = {
+    "json": lambda tmp: JsonStorage(os.path.join(tmp, "chat_data.json")),
+    "sqlite": lambda tmp: SqliteStorage(os.path.join(tmp, "chat_data.db")),
+}
+CHATS = 100
+
+
+def populate(tmp: str, engine: str, messages: int):
+    service = ChatService(os.path.join(tmp, "chat_data.json"), storage=ENGINES[engine](tmp))
+    chat_ids = [
+        service.create_chat(f"group {i}", "group", ["alice", "bob", "charlie"]).chat_id
+        for i in range(CHATS)
+    ]
+    for i in range(messages):
+        service.add_message(chat_ids[i % CHATS], "alice", f"message {i}")
+    service.close()
+    if engine == "json":
+        # Fold the log into the snapshot so startup reads one file
+        service.storage.wal.compact(wait=True)
+
+
+def startup(tmp: str, engine: str, lazy: bool) -> float:
+    start = time.perf_counter()
+    service = ChatService(os.path.join(tmp, "chat_data.json"), storage=ENGINES[engine](tmp), lazy=lazy)
+    elapsed = time.perf_counter() - start
+    service.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10000,50000,200000")
+    parser.add_argument("--engines", default="json,sqlite")
+    args = parser.parse_args()
+
+    print(f"{'engine':>8} {'messages':>10} {'eager s':>10} {'lazy s':>10}")
+    for engine in args.engines.split(","):
+        for size in (int(size) for size in args.sizes.split(",")):
+            with tempfile.TemporaryDirectory() as tmp:
+                populate(tmp, engine, size)
+                eager = startup(tmp, engine, lazy=False)
+                lazy = startup(tmp, engine, lazy=True)
+            print(f"{engine:>8} {size:>10} {eager:>10.3f} {lazy:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
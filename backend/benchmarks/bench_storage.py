@@ -0,0 +1,67 @@
+"""Compare the JSON and SQLite storage engines.
+
+Reports startup (load_data) time, append throughput and history page-fetch
+latency for a chat with a long history.
+
+Run from the backend directory:
+
+    python benchmarks/bench_storage.py --messages 100000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from chat_service import ChatService  # noqa: E402
+from storage import JsonStorage, SqliteStorage  # noqa: E402
+
+ENGINES = {
+    "json": lambda tmp: JsonStorage(os.path.join(tmp, "chat_data.json")),
+    "sqlite": lambda tmp: SqliteStorage(os.path.join(tmp, "chat_data.db")),
+}
+
+
+def bench_engine(name: str, messages: int, pages: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        service = ChatService(os.path.join(tmp, "chat_data.json"), storage=ENGINES[name](tmp))
+        start = time.perf_counter()
+        for i in range(messages):
+            service.add_message("chat_2", "alice", f"bench message {i}")
+        service.writer.flush()
+        append_rate = messages / (time.perf_counter() - start)
+        service.close()
+
+        start = time.perf_counter()
+        service = ChatService(os.path.join(tmp, "chat_data.json"), storage=ENGINES[name](tmp))
+        load_seconds = time.perf_counter() - start
+
+        # Walk backwards through history, as a scrolling client would
+        start = time.perf_counter()
+        page = service.get_chat_history("chat_2", limit=50)
+        for _ in range(pages):
+            if not page["before"]:
+                break
+            page = service.get_chat_history("chat_2", before=page["before"], limit=50)
+        page_ms = (time.perf_counter() - start) / (pages + 1) * 1000
+        service.close()
+
+    print(f"{name:>8} {load_seconds:>10.3f} {append_rate:>14.0f} {page_ms:>12.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--engines", default="json,sqlite")
+    args = parser.parse_args()
+
+    print(f"{'engine':>8} {'load s':>10} {'appends/sec':>14} {'page ms':>12}")
+    for name in args.engines.split(","):
+        bench_engine(name, args.messages, args.pages)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Server work per keystroke for typing indicators as concurrent typers grow.
+
+Simulates ``--seconds`` of typing on a virtual clock: every typer sends a
+``typing`` event ``--rate`` times a second into a room of ``--room-size``
+connected participants, pauses for longer than the ttl every few seconds, and
+the timer wheel is advanced every tick. Reports CPU time and frames published
+per keystroke, which should stay flat as the number of typers grows.
+
+Run from the backend directory:
+
+    python benchmarks/bench_typing.py --typers 100,1000,3000,5000
+"""
+import argparse
+import os
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from timer_wheel import TimerWheel  # noqa: E402
+from typing_indicators import TypingTracker  # noqa: E402
+
+
+def simulate(typers: int, room_size: int, rate: int, seconds: int, ttl: float, throttle: float):
+    deliveries = [0]
+
+    def publish(frame: str, user_ids: List[str], coalesce_key=None):
+        deliveries[0] += len(user_ids)
+
+    tracker = TypingTracker(publish, ttl=ttl, throttle=throttle)
+    # Run the wheel on the virtual clock
+    tracker.wheel = TimerWheel(tick=tracker.wheel.tick, now=0.0)
+    users = [f"user{i}" for i in range(typers)]
+    for index, user_id in enumerate(users):
+        # Every room has room_size members, all typing
+        tracker.join(user_id, [f"room{index // room_size}"])
+
+    keystrokes = 0
+    step = 1.0 / rate
+    cpu_start = time.process_time()
+    now = 0.0
+    next_tick = tracker.wheel.tick
+    while now < seconds:
+        # Type for 4s, then pause long enough for indicators to expire
+        if now % (4 + ttl * 2) < 4:
+            for index, user_id in enumerate(users):
+                tracker.typing(f"room{index // room_size}", user_id, True, now=now)
+            keystrokes += typers
+        now += step
+        while next_tick <= now:
+            tracker.expire(now=next_tick)
+            next_tick += tracker.wheel.tick
+    cpu = time.process_time() - cpu_start
+    return keystrokes, cpu, tracker.published, deliveries[0], tracker.expired
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--typers", default="100,1000,3000,5000")
+    parser.add_argument("--room-size", type=int, default=10)
+    parser.add_argument("--rate", type=int, default=8, help="keystrokes per second per typer")
+    parser.add_argument("--seconds", type=int, default=20)
+    parser.add_argument("--ttl", type=float, default=5.0)
+    parser.add_argument("--throttle", type=float, default=2.0)
+    args = parser.parse_args()
+
+    print(f"room size={args.room_size} rate={args.rate}/s ttl={args.ttl}s throttle={args.throttle}s")
+    print(f"{'typers':>7} {'keystrokes':>11} {'us/keystroke':>13} {'frames/keystroke':>17} "
+          f"{'deliveries/keystroke':>21} {'expired':>8}")
+    for typers in (int(count) for count in args.typers.split(",")):
+        keystrokes, cpu, frames, deliveries, expired = simulate(
+            typers, args.room_size, args.rate, args.seconds, args.ttl, args.throttle
+        )
+        print(f"{typers:>7} {keystrokes:>11} {cpu / keystrokes * 1e6:>13.2f} "
+              f"{frames / keystrokes:>17.3f} {deliveries / keystrokes:>21.2f} {expired:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Cost of unread counts for a connecting user as chat history grows.
+
+Builds ``--chats`` chats with N messages each and times computing one
+user's unread count in every chat, as a sidebar needs on connect: once by
+scanning the messages after the user's last read one, and once from the
+chat's read watermark. The watermark cost should not move with N.
+
+Run from the backend directory:
+
+    python benchmarks/bench_unread.py --messages 100,1000,10000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from models import Chat, Message  # noqa: E402
+
+
+def build(chats: int, messages: int):
+    built = []
+    for i in range(chats):
+        chat = Chat(f"chat{i}", f"chat {i}", "group", ["alice", "bob", "charlie"])
+        for n in range(messages):
+            chat.add_message(Message(f"m{i}-{n}", chat.chat_id, "bob" if n % 3 else "charlie", "hello"))
+        # alice has read about half of every chat
+        chat.mark_read("alice", messages // 2)
+        built.append(chat)
+    return built
+
+
+def scan(chats, user_id: str) -> int:
+    total = 0
+    for chat in chats:
+        last_read = chat.read_seqs.get(user_id, -1)
+        total += sum(1 for message in chat.messages if message.seq > last_read)
+    return total
+
+
+def watermark(chats, user_id: str) -> int:
+    return sum(chat.unread_count(user_id) for chat in chats)
+
+
+def timed(fn, chats, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(chats, "alice")
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--messages", default="100,1000,10000")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"µs to count unread messages across {args.chats} chats")
+    print(f"{'messages':>9} {'scan':>12} {'watermark':>12}")
+    for messages in (int(count) for count in args.messages.split(",")):
+        chats = build(args.chats, messages)
+        assert scan(chats, "alice") == watermark(chats, "alice")
+        print(f"{messages:>9} {timed(scan, chats, args.rounds) * 1e6:>12.1f} "
+              f"{timed(watermark, chats, args.rounds) * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
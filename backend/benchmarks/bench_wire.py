@@ -0,0 +1,123 @@
+"""Bytes on the wire and encode/decode CPU for each frame encoding.
+
+Builds typical frames (a single ``new_message``, an ``events`` batch of
+``--batch`` messages and an ``initial_data`` with ``--chats`` chats) and
+reports, per message carried, the frame size and the time to encode and
+decode it with:
+
+- ``json``: the default text frames
+- ``json+deflate``: the same frames through permessage-deflate without
+  context takeover, which the transport can already negotiate
+- ``msgpack`` and ``msgpack+deflate``: the binary protocol (``?encoding=msgpack``)
+
+Encoding times the server's path: frames are built as JSON once and binary
+codecs transcode them (uncached here, so every frame pays).
+
+Run from the backend directory:
+
+    python benchmarks/bench_wire.py --rounds 2000
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from encoding import dumps, loads  # noqa: E402
+from wire import MsgpackCodec, msgpack  # noqa: E402
+
+SENDERS = [("alice", "Alice"), ("bob", "Bob"), ("charlie", "Charlie"), ("diana", "Diana")]
+TEXTS = ["Hey there!", "How are you doing?", "Meeting at 3?", "Let's start the call!",
+         "Joining in 5 mins", "Can you send me the slides from yesterday's review?"]
+
+
+def wire_message(n: int) -> dict:
+    sender, name = SENDERS[n % len(SENDERS)]
+    timestamp = datetime(2024, 1, 1, 9) + timedelta(seconds=37 * n)
+    return {
+        "id": str(uuid.UUID(int=n + 1)),
+        "text": TEXTS[n % len(TEXTS)],
+        "sender": sender,
+        "senderName": name,
+        "time": timestamp.strftime("%I:%M %p"),
+        "timestamp": timestamp.isoformat(),
+        "seq": n
+    }
+
+
+def frames(batch: int, chats: int):
+    """(name, frame as JSON text, messages it carries)"""
+    single = dumps({"type": "new_message", "chat_id": "chat_1", "message": wire_message(41)})
+    events = dumps({"type": "events", "events": [
+        {"type": "new_message", "chat_id": "chat_2", "message": wire_message(n)} for n in range(batch)
+    ]})
+    summaries = []
+    for c in range(chats):
+        messages = [wire_message(c * 20 + n) for n in range(20)]
+        summaries.append({
+            "id": f"chat_{c}", "chat_id": f"chat_{c}", "name": f"Chat {c}", "type": "group",
+            "participants": [sender for sender, _ in SENDERS],
+            "avatar": f"https://i.pravatar.cc/150?u=chat_{c}",
+            "created_at": "2024-01-01T09:00:00", "last_message_at": messages[-1]["timestamp"],
+            "messages": messages, "history_cursor": "Y2hhdF8xOjIw", "last_seq": 19,
+            "read_seqs": {"alice": 19, "bob": 17}, "unread_count": 2, "last_message": messages[-1]
+        })
+    initial = dumps({"type": "initial_data", "chats": summaries, "online_users": [],
+                     "user": {"id": "alice", "name": "alice", "online": True}})
+    return [("new_message", single, 1), (f"events x{batch}", events, batch), (f"initial {chats} chats", initial, chats * 21)]
+
+
+def deflate(data: bytes) -> bytes:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+def encoders():
+    yield "json", lambda frame: frame, loads
+    yield "json+deflate", lambda frame: deflate(frame.encode()), lambda data: loads(zlib.decompress(data, -15))
+    if msgpack is None:
+        return
+    for name, codec in (("msgpack", MsgpackCodec()), ("msgpack+deflate", MsgpackCodec(deflate=True))):
+        def encode(frame, codec=codec):
+            codec._encoded.clear()
+            return codec.encode(frame)
+        yield name, encode, codec.decode
+
+
+def timed(fn, arg, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(arg)
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", type=int, default=10)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=1000)
+    args = parser.parse_args()
+
+    if msgpack is None:
+        print("msgpack is not installed; only JSON is measured")
+    for name, frame, messages in frames(args.batch, args.chats):
+        print(f"\n{name}: per message carried")
+        print(f"{'encoding':>16} {'bytes':>8} {'vs json':>8} {'encode µs':>10} {'decode µs':>10}")
+        baseline = None
+        for encoding, encode, decode in encoders():
+            data = encode(frame)
+            size = len(data.encode() if isinstance(data, str) else data)
+            baseline = baseline or size
+            assert decode(data) == loads(frame)
+            encode_us = timed(encode, frame, max(args.rounds // messages, 10)) * 1e6 / messages
+            decode_us = timed(decode, data, max(args.rounds // messages, 10)) * 1e6 / messages
+            print(f"{encoding:>16} {size / messages:>8.0f} {size / baseline:>8.2f} "
+                  f"{encode_us:>10.2f} {decode_us:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""WebSocket load generator for the chat server.
+
+Seeds a store in which ``--clients`` users are paired into private chats or
+put into group chats of ``--group-size``, starts the app on it with uvicorn
+(or targets ``--url``), connects every user, then has each send ``--rate`` messages a
+second (Poisson arrivals) for ``--duration`` seconds. Reports connect time,
+messages and deliveries per second, p50/p99 delivery latency, server memory
+and CPU, and how long ``--reconnect`` clients take to resync with ``?since=``.
+Results are saved to ``benchmarks/results/`` and can be compared with an
+earlier run via ``--compare``.
+
+All clients run in this process, so at high client counts the generator's own
+event loop adds to the measured latency; watch its CPU next to the server's.
+A server given with ``--url`` needs the same chats in its store: seed it with
+``--seed-store`` and the same ``--clients``, ``--group-size`` and
+``--group-fraction`` before starting it.
+
+Run from the backend directory:
+
+    python benchmarks/loadgen.py --clients 2000 --rate 0.5 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import websockets
+
+import results
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND)
+
+from chat_service import ChatService  # noqa: E402
+from storage import create_storage  # noqa: E402
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+async def wait_for_port(host: str, port: int, timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def plan_chats(args) -> List[List[str]]:
+    """Members of each load chat: private pairs first, then groups"""
+    users = [f"load{i}" for i in range(args.clients)]
+    private_users = int(args.clients * (1 - args.group_fraction)) // 2 * 2
+    chats = [users[i:i + 2] for i in range(0, private_users, 2)]
+    chats += [
+        users[i:i + args.group_size]
+        for i in range(private_users, args.clients, args.group_size)
+        if len(users[i:i + args.group_size]) > 1
+    ]
+    return chats
+
+
+def seed_store(storage_url: str, chats: List[List[str]]):
+    """Create the load users and their chats in a store no server has open"""
+    service = ChatService(storage=create_storage(storage_url))
+    try:
+        for members in chats:
+            for user_id in members:
+                service.get_or_create_user(user_id)
+            service.create_chat(f"load {members[0]}", "private" if len(members) == 2 else "group", members)
+    finally:
+        service.close()
+
+
+class LoadClient:
+    def __init__(self, url: str, user_id: str, stats: dict):
+        self.url = url
+        self.user_id = user_id
+        self.stats = stats
+        self.ws = None
+        self.chats: List[str] = []
+        # chat id -> highest seq seen, sent back as ?since= on reconnect
+        self.last_seq: Dict[str, int] = {}
+        self.sent = 0
+        self._reader: Optional[asyncio.Task] = None
+        self._synced: Optional[asyncio.Future] = None
+
+    async def connect(self, since: bool = False):
+        url = f"{self.url}/ws/{self.user_id}"
+        if since:
+            url += "?since=" + json.dumps(self.last_seq, separators=(",", ":"))
+        loop = asyncio.get_event_loop()
+        self._synced = loop.create_future()
+        self.ws = await websockets.connect(url, max_size=None, open_timeout=60)
+        self._reader = loop.create_task(self._read())
+        await self._synced
+
+    async def close(self):
+        await self.ws.close()
+        if self._reader is not None:
+            self._reader.cancel()
+
+    async def _read(self):
+        try:
+            async for raw in self.ws:
+                self._handle(json.loads(raw), time.perf_counter())
+        except (websockets.ConnectionClosed, asyncio.CancelledError):
+            pass
+
+    def _handle(self, event: dict, now: float):
+        kind = event["type"]
+        if kind == "events":
+            for inner in event["events"]:
+                self._handle(inner, now)
+        elif kind in ("initial_data", "sync"):
+            if kind == "initial_data":
+                for chat in event["chats"]:
+                    if chat["id"] not in self.last_seq:
+                        self.chats.append(chat["id"])
+                    self.last_seq[chat["id"]] = chat["last_seq"]
+            if not self._synced.done():
+                self._synced.set_result(None)
+        elif kind == "new_message":
+            message = event["message"]
+            self.last_seq[event["chat_id"]] = message["seq"]
+            if message["sender"] != self.user_id:
+                self.stats["deliveries"] += 1
+                self.stats["latencies"].append(now - float(message["text"]))
+
+    async def drive(self, rate: float, until: float, rng: random.Random):
+        while True:
+            await asyncio.sleep(rng.expovariate(rate))
+            if time.perf_counter() >= until or not self.chats:
+                return
+            try:
+                await self.ws.send(json.dumps({
+                    "type": "send_message",
+                    "chat_id": rng.choice(self.chats),
+                    "text": repr(time.perf_counter())
+                }))
+            except websockets.ConnectionClosed:
+                self.stats["errors"] += 1
+                return
+            self.sent += 1
+
+
+async def run(args, url: str, pid: Optional[int]) -> Dict[str, Dict[str, float]]:
+    rng = random.Random(args.seed)
+    stats = {"deliveries": 0, "latencies": [], "errors": 0}
+    clients = [LoadClient(url, f"load{i}", stats) for i in range(args.clients)]
+
+    # Connect everyone, a bounded number at a time
+    semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+    async def connect(client: LoadClient):
+        async with semaphore:
+            await client.connect()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(connect(client) for client in clients))
+    connect_seconds = time.perf_counter() - start
+    print(f"connected {len(clients)} clients in {connect_seconds:.2f}s")
+
+    print(f"{sum(len(client.chats) > 0 for client in clients)} clients in seeded chats")
+
+    cpu_start = cpu_seconds(pid) if pid else 0.0
+    own_cpu_start = time.process_time()
+    stats["latencies"].clear()
+    stats["deliveries"] = 0
+    start = time.perf_counter()
+    until = start + args.duration
+    await asyncio.gather(*(
+        client.drive(args.rate, until, random.Random(rng.random())) for client in clients
+    ))
+    # Let in-flight deliveries land
+    await asyncio.sleep(args.drain)
+    elapsed = time.perf_counter() - start
+    server_cpu = cpu_seconds(pid) - cpu_start if pid else 0.0
+    own_cpu = time.process_time() - own_cpu_start
+
+    sent = sum(client.sent for client in clients)
+    latencies = stats["latencies"]
+    load = {
+        "clients": args.clients,
+        "messages_sent": sent,
+        "messages_per_sec": sent / args.duration,
+        "deliveries_per_sec": stats["deliveries"] / elapsed,
+        "latency_p50_ms": percentile(latencies, 0.5) * 1000,
+        "latency_p99_ms": percentile(latencies, 0.99) * 1000,
+        "latency_max_ms": max(latencies, default=0.0) * 1000,
+        "connect_seconds": connect_seconds,
+        "errors": stats["errors"],
+        "generator_cpu_percent": own_cpu / elapsed * 100,
+    }
+    if pid:
+        load["server_rss_mb"] = rss_mb(pid)
+        load["server_cpu_percent"] = server_cpu / elapsed * 100
+
+    # Reconnect a sample of clients with their last seen seqs
+    reconnect_times = []
+    for client in rng.sample(clients, min(args.reconnect, len(clients))):
+        await client.close()
+        start = time.perf_counter()
+        await client.connect(since=True)
+        reconnect_times.append(time.perf_counter() - start)
+    reconnect = {
+        "clients": len(reconnect_times),
+        "p50_ms": percentile(reconnect_times, 0.5) * 1000,
+        "p99_ms": percentile(reconnect_times, 0.99) * 1000,
+    }
+
+    for client in clients:
+        await client.close()
+    return {"load": load, "reconnect": reconnect}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--group-size", type=int, default=8)
+    parser.add_argument("--group-fraction", type=float, default=0.5, help="share of clients in group chats")
+    parser.add_argument("--rate", type=float, default=0.5, help="messages per second per client")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--drain", type=float, default=2.0)
+    parser.add_argument("--reconnect", type=int, default=100)
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--port", type=int, default=8121)
+    parser.add_argument("--url", help="target a running server instead, e.g. ws://127.0.0.1:8000")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="results file (default: a new file in benchmarks/results/)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--seed-store", metavar="STORAGE_URL",
+                        help="only create the load users and chats in this store, for a server run with --url")
+    args = parser.parse_args()
+
+    chats = plan_chats(args)
+    if args.seed_store:
+        seed_store(args.seed_store, chats)
+        print(f"seeded {len(chats)} chats for {args.clients} clients into {args.seed_store}")
+        return
+
+    server = None
+    url = args.url
+    data_dir = tempfile.TemporaryDirectory()
+    if url is None:
+        data_file = os.path.join(data_dir.name, "chat_data.json")
+        seed_store("json://" + data_file, chats)
+        print(f"seeded {len(chats)} chats ({sum(len(members) == 2 for members in chats)} private)")
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port),
+             "--log-level", "warning", "--ws-max-size", str(16 * 1024 * 1024)],
+            cwd=BACKEND, env=dict(
+                os.environ, DATA_FILE=data_file,
+                # High --rate runs would otherwise measure the rate limiter
+                RATE_LIMIT_USER_RATE="0", RATE_LIMIT_CHAT_RATE="0"
+            )
+        )
+        url = f"ws://127.0.0.1:{args.port}"
+    try:
+        if server is not None:
+            asyncio.run(wait_for_port("127.0.0.1", args.port))
+        measured = asyncio.run(run(args, url, server.pid if server else None))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        data_dir.cleanup()
+
+    load = measured["load"]
+    print(f"sent {load['messages_sent']} messages: {load['messages_per_sec']:.0f}/s, "
+          f"{load['deliveries_per_sec']:.0f} deliveries/s, {load['errors']} errors")
+    print(f"delivery latency p50 {load['latency_p50_ms']:.2f}ms p99 {load['latency_p99_ms']:.2f}ms "
+          f"max {load['latency_max_ms']:.2f}ms")
+    if "server_rss_mb" in load:
+        print(f"server RSS {load['server_rss_mb']:.0f}MB, CPU {load['server_cpu_percent']:.0f}%")
+    print(f"load generator CPU {load['generator_cpu_percent']:.0f}% (near 100% means it is the bottleneck)")
+    reconnect = measured["reconnect"]
+    print(f"reconnect with since ({reconnect['clients']} clients): "
+          f"p50 {reconnect['p50_ms']:.2f}ms p99 {reconnect['p99_ms']:.2f}ms")
+
+    path = results.save("loadgen", measured, args.output)
+    print(f"\nSaved {path}")
+    if args.compare:
+        results.compare(measured, args.compare)
+
+
+if __name__ == "__main__":
+    main()
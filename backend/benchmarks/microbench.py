@@ -0,0 +1,115 @@
+"""Microbenchmarks for ChatService and model hot spots, with stored results.
+
+Each benchmark runs a few warmup rounds, then is timed for ``--rounds``
+rounds; min, median, mean, standard deviation and operations per second are
+printed and written to ``benchmarks/results/`` so a later run can be compared
+with ``--compare``:
+
+    python benchmarks/microbench.py
+    python benchmarks/microbench.py --compare benchmarks/results/micro-....json
+
+Run from the backend directory.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import results  # noqa: E402
+from chat_service import ChatService  # noqa: E402
+from storage import JsonStorage  # noqa: E402
+
+
+def run(fn: Callable[[], object], rounds: int, warmup: int) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+    timings: List[float] = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    median = statistics.median(timings)
+    return {
+        "min_ms": min(timings) * 1000,
+        "median_ms": median * 1000,
+        "mean_ms": statistics.fmean(timings) * 1000,
+        "stddev_ms": statistics.pstdev(timings) * 1000,
+        "ops_per_sec": 1 / median if median else 0.0,
+    }
+
+
+def populate(service: ChatService, users: int, chats: int, messages: int):
+    user_ids = [f"user{i}" for i in range(users)]
+    for user_id in user_ids:
+        service.get_or_create_user(user_id)
+    chat_ids = []
+    for i in range(chats):
+        members = [user_ids[(i + offset) % users] for offset in range(5)]
+        chat_ids.append(service.create_chat(f"chat {i}", "group", members).chat_id)
+    for i in range(messages):
+        # Half the traffic goes to one busy chat, the rest is spread out
+        chat_id = chat_ids[0] if i % 2 else chat_ids[i % chats]
+        sender = service.chats[chat_id].participants[i % 5]
+        service.add_message(chat_id, sender, f"benchmark message {i} with some ordinary words in it")
+    service.writer.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--chats", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--output", help="results file (default: a new file in benchmarks/results/)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_file = os.path.join(tmp, "chat_data.json")
+        service = ChatService(data_file, storage=JsonStorage(data_file, compact_threshold=10 ** 9))
+        populate(service, args.users, args.chats, args.messages)
+        service.save_data()
+
+        chat = max(service.chats.values(), key=lambda chat: chat.message_count)
+        user_id = "user0"
+
+        # The service above holds data_file open; time loading a copy of its snapshot
+        load_file = os.path.join(tmp, "load_data.json")
+        shutil.copyfile(data_file, load_file)
+
+        def load_data():
+            ChatService(load_file).close()
+
+        benchmarks = {
+            "save_data": service.save_data,
+            "load_data": load_data,
+            "get_user_chats": lambda: service.get_user_chats(user_id),
+            "chat_to_dict": chat.to_dict,
+            "chat_to_summary_dict": chat.to_summary_dict,
+        }
+        print(f"users={args.users} chats={args.chats} messages={args.messages} "
+              f"(largest chat {chat.message_count} messages)")
+        print(f"{'benchmark':<22} {'min ms':>9} {'median ms':>10} {'mean ms':>9} {'stddev':>8} {'ops/s':>10}")
+        measured = {}
+        for name, fn in benchmarks.items():
+            stats = run(fn, args.rounds, args.warmup)
+            measured[name] = stats
+            print(f"{name:<22} {stats['min_ms']:>9.3f} {stats['median_ms']:>10.3f} {stats['mean_ms']:>9.3f} "
+                  f"{stats['stddev_ms']:>8.3f} {stats['ops_per_sec']:>10.1f}")
+        service.close()
+
+    path = results.save("micro", measured, args.output)
+    print(f"\nSaved {path}")
+    if args.compare:
+        results.compare(measured, args.compare)
+
+
+if __name__ == "__main__":
+    main()
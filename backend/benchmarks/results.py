@@ -0,0 +1,76 @@
+"""Saving benchmark results as JSON and comparing a run against an earlier one.
+
+Results are ``{benchmark: {metric: number}}``. Each file also records the git
+commit, Python version, platform and JSON backend so runs from different
+machines are not compared by accident.
+"""
+from typing import Dict, Optional
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+Results = Dict[str, Dict[str, float]]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_info() -> dict:
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    import encoding
+
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "json_backend": encoding.JSON_BACKEND,
+        "argv": sys.argv[1:],
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def save(kind: str, results: Results, path: Optional[str] = None) -> str:
+    """Write results to ``path`` or a timestamped file in ``results/``"""
+    info = run_info()
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(RESULTS_DIR, f"{kind}-{stamp}-{info['commit'] or 'nogit'}.json")
+    with open(path, "w") as f:
+        json.dump({"kind": kind, "info": info, "results": results}, f, indent=2)
+    return path
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(current: Results, baseline_path: str):
+    """Print every metric next to its value in the baseline file"""
+    baseline = load(baseline_path)
+    info = baseline["info"]
+    print(f"\nCompared with {os.path.basename(baseline_path)} "
+          f"(commit {info.get('commit')}, {info.get('json_backend')}, {info.get('time')})")
+    print(f"{'metric':<42} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, metrics in current.items():
+        before = baseline["results"].get(name, {})
+        for metric, value in metrics.items():
+            if metric not in before:
+                continue
+            old = before[metric]
+            change = f"{(value - old) / old * 100:+.1f}%" if old else "n/a"
+            print(f"{name + '.' + metric:<42} {old:>12.4g} {value:>12.4g} {change:>8}")
@@ -0,0 +1,254 @@
+from typing import Any, Dict, Optional
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+# Largest blob a single upload may produce
+MAX_BLOB_BYTES = 100 * 1024 * 1024
+# Uploads nobody has written to for this long are discarded
+UPLOAD_TTL = 3600.0
+# Blob metadata kept in memory, so resolving an attachment rarely touches disk
+METADATA_CACHE_SIZE = 4096
+
+_BLOB_ID = re.compile(r"^[0-9a-f]{64}$")
+
+
+class UploadError(Exception):
+    """A chunk or commit that does not fit the upload's state"""
+
+
+class OffsetMismatch(UploadError):
+    """A chunk that does not start where the upload currently ends"""
+    def __init__(self, expected: int):
+        super().__init__(f"Expected offset {expected}")
+        self.expected = expected
+
+
+class UploadTooLarge(UploadError):
+    pass
+
+
+class UploadSession:
+    __slots__ = ("upload_id", "user_id", "filename", "content_type", "path", "size", "hasher", "updated", "lock")
+
+    def __init__(self, upload_id: str, user_id: str, filename: str, content_type: str, path: str):
+        self.upload_id = upload_id
+        self.user_id = user_id
+        self.filename = filename
+        self.content_type = content_type
+        self.path = path
+        self.size = 0
+        self.hasher = hashlib.sha256()
+        self.updated = time.monotonic()
+        # Held from the offset check until size and digest are updated, and while committing
+        self.lock = threading.Lock()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "upload_id": self.upload_id,
+            "filename": self.filename,
+            "content_type": self.content_type,
+            "offset": self.size,
+        }
+
+
+class BlobStore:
+    """Local content-addressed store for media, deduplicated by SHA-256.
+
+    A blob's id is the hex digest of its content. It lives at
+    ``blobs/<first two hex digits>/<id>``, next to a ``.json`` sidecar with
+    its size, content type and extracted metadata. Blobs never change, so
+    they can be cached and served forever.
+
+    Uploads arrive in chunks, in order, into a temporary file under
+    ``uploads/`` while the digest is computed along the way. Committing
+    renames the file into place, or drops it when the same content is
+    already stored. Upload progress is held in memory, so uploads do not
+    survive a restart; blobs do.
+
+    Methods do blocking file I/O and are meant to be called from worker
+    threads (see ``media.MediaService``). Chunks and the commit of one upload
+    are serialized by the session's lock, so two requests for the same
+    offset cannot both be written.
+    """
+    def __init__(self, root: str = "media", max_blob_bytes: int = MAX_BLOB_BYTES):
+        self.root = root
+        self.max_blob_bytes = max_blob_bytes
+        self.blob_dir = os.path.join(root, "blobs")
+        self.upload_dir = os.path.join(root, "uploads")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.upload_dir, exist_ok=True)
+        self._uploads: Dict[str, UploadSession] = {}
+        self._metadata: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+        self.uploads_started = 0
+        self.blobs_stored = 0
+        self.deduplicated = 0
+        self.bytes_received = 0
+
+    @staticmethod
+    def valid_id(blob_id: str) -> bool:
+        return bool(_BLOB_ID.match(blob_id))
+
+    def path(self, blob_id: str) -> str:
+        if not self.valid_id(blob_id):
+            raise ValueError("Invalid blob id")
+        return os.path.join(self.blob_dir, blob_id[:2], blob_id)
+
+    # Uploads
+
+    def begin(self, user_id: str, filename: str, content_type: str) -> UploadSession:
+        """Start an upload, discarding any that went stale"""
+        self.expire()
+        upload_id = uuid.uuid4().hex
+        session = UploadSession(
+            upload_id,
+            user_id,
+            os.path.basename(filename or "file"),
+            content_type or "application/octet-stream",
+            os.path.join(self.upload_dir, upload_id)
+        )
+        open(session.path, "wb").close()
+        with self._lock:
+            self._uploads[upload_id] = session
+        self.uploads_started += 1
+        return session
+
+    def upload(self, upload_id: str) -> Optional[UploadSession]:
+        return self._uploads.get(upload_id)
+
+    def append(self, upload_id: str, offset: int, data: bytes) -> int:
+        """Write a chunk at ``offset``, which must be the upload's current size.
+
+        Returns the new size. Raises KeyError for an unknown upload,
+        OffsetMismatch for an out-of-order chunk and UploadTooLarge past
+        ``max_blob_bytes``.
+        """
+        session = self._uploads[upload_id]
+        with session.lock:
+            if self._uploads.get(upload_id) is not session:
+                # Committed or expired while this chunk waited
+                raise KeyError(upload_id)
+            if offset != session.size:
+                raise OffsetMismatch(session.size)
+            if session.size + len(data) > self.max_blob_bytes:
+                raise UploadTooLarge(f"Uploads are limited to {self.max_blob_bytes} bytes")
+            with open(session.path, "ab") as f:
+                f.write(data)
+            session.hasher.update(data)
+            session.size += len(data)
+            session.updated = time.monotonic()
+            self.bytes_received += len(data)
+            return session.size
+
+    def commit(self, upload_id: str) -> Dict[str, Any]:
+        """Move a finished upload into the store; returns the blob's metadata.
+
+        ``deduplicated`` is set when the content was already stored, in which
+        case the stored metadata is returned and the upload is dropped.
+        Raises KeyError for an unknown upload and UploadError for an empty one.
+        """
+        session = self._uploads[upload_id]
+        with session.lock, self._lock:
+            if self._uploads.get(upload_id) is not session:
+                raise KeyError(upload_id)
+            if session.size == 0:
+                raise UploadError("Nothing was uploaded")
+            # Later chunks find the upload gone, so the digest is final
+            del self._uploads[upload_id]
+        blob_id = session.hasher.hexdigest()
+        path = self.path(blob_id)
+        existing = self.describe(blob_id)
+        if existing is not None:
+            os.unlink(session.path)
+            self.deduplicated += 1
+            return dict(existing, deduplicated=True)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(session.path, path)
+        self.blobs_stored += 1
+        metadata = {
+            "blob_id": blob_id,
+            "size": session.size,
+            "content_type": session.content_type,
+            "filename": session.filename,
+        }
+        self.write_metadata(blob_id, metadata)
+        return dict(metadata, deduplicated=False)
+
+    def put(self, data: bytes, content_type: str) -> str:
+        """Store a small blob (e.g. a thumbnail) in one go; returns its id"""
+        blob_id = hashlib.sha256(data).hexdigest()
+        if self.describe(blob_id) is not None:
+            self.deduplicated += 1
+            return blob_id
+        path = self.path(blob_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = os.path.join(self.upload_dir, uuid.uuid4().hex)
+        with open(temporary, "wb") as f:
+            f.write(data)
+        os.replace(temporary, path)
+        self.blobs_stored += 1
+        self.write_metadata(blob_id, {"blob_id": blob_id, "size": len(data), "content_type": content_type})
+        return blob_id
+
+    def expire(self, now: Optional[float] = None):
+        """Drop uploads untouched for ``UPLOAD_TTL`` seconds"""
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            candidates = [session for session in self._uploads.values() if now - session.updated > UPLOAD_TTL]
+        stale = []
+        for session in candidates:
+            # Session lock first, as in commit; a chunk may have arrived meanwhile
+            with session.lock, self._lock:
+                if self._uploads.get(session.upload_id) is session and now - session.updated > UPLOAD_TTL:
+                    del self._uploads[session.upload_id]
+                    stale.append(session)
+        for session in stale:
+            try:
+                os.unlink(session.path)
+            except OSError:
+                pass
+
+    # Metadata
+
+    def describe(self, blob_id: str) -> Optional[Dict[str, Any]]:
+        """A stored blob's metadata, or None if there is no such blob"""
+        metadata = self._metadata.get(blob_id)
+        if metadata is not None:
+            return metadata
+        try:
+            with open(self.path(blob_id) + ".json") as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._remember(blob_id, metadata)
+        return metadata
+
+    def write_metadata(self, blob_id: str, metadata: Dict[str, Any]):
+        """Replace a blob's sidecar atomically"""
+        path = self.path(blob_id) + ".json"
+        temporary = path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(metadata, f)
+        os.replace(temporary, path)
+        self._remember(blob_id, metadata)
+
+    def _remember(self, blob_id: str, metadata: Dict[str, Any]):
+        with self._lock:
+            if len(self._metadata) >= METADATA_CACHE_SIZE:
+                self._metadata.clear()
+            self._metadata[blob_id] = metadata
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "uploads_in_progress": len(self._uploads),
+            "uploads_started": self.uploads_started,
+            "blobs_stored": self.blobs_stored,
+            "deduplicated": self.deduplicated,
+            "bytes_received": self.bytes_received,
+        }
@@ -0,0 +1,47 @@
+from typing import Dict, Iterable, List
+from collections import OrderedDict
+
+
+class UserChatIndex:
+    """Inverted index from user id to the chats they participate in.
+
+    Each user's chats are kept in an ordered dict from least to most recently
+    active. A new message moves its chat to the end for every participant,
+    which is O(participants) and already paid for by the fan-out, so a user's
+    chat list comes out sorted without scanning or sorting anything.
+    """
+    def __init__(self):
+        self._by_user: Dict[str, "OrderedDict[str, None]"] = {}
+    
+    def add(self, user_id: str, chat_id: str):
+        """Record membership; a newly added chat counts as most recent"""
+        chats = self._by_user.setdefault(user_id, OrderedDict())
+        if chat_id not in chats:
+            chats[chat_id] = None
+    
+    def remove(self, user_id: str, chat_id: str):
+        chats = self._by_user.get(user_id)
+        if chats is not None:
+            chats.pop(chat_id, None)
+            if not chats:
+                del self._by_user[user_id]
+    
+    def add_chat(self, chat_id: str, participants: Iterable[str]):
+        for user_id in participants:
+            self.add(user_id, chat_id)
+    
+    def touch(self, chat_id: str, participants: Iterable[str]):
+        """Mark a chat as the most recently active for all its participants"""
+        for user_id in participants:
+            chats = self._by_user.get(user_id)
+            if chats is not None and chat_id in chats:
+                chats.move_to_end(chat_id)
+    
+    def is_member(self, user_id: str, chat_id: str) -> bool:
+        chats = self._by_user.get(user_id)
+        return chats is not None and chat_id in chats
+    
+    def chat_ids(self, user_id: str) -> List[str]:
+        """A user's chat ids, most recently active first"""
+        chats = self._by_user.get(user_id)
+        return list(reversed(chats)) if chats else []
@@ -0,0 +1,311 @@
+"""One chat service shared by every worker of a multi-worker deployment.
+
+Chats, history, sequence numbers and read watermarks must have a single
+owner, or workers holding members of the same chat would each number and
+store its messages on their own. ``ChatServiceServer`` is that owner: a
+process that opens the store, runs an ``AsyncChatService`` and answers the
+workers' calls over a Unix socket. Each worker talks to it through a
+``RemoteChatService``, which has the same async API as the in-process
+facade, so the server code does not change. Deliveries still go through the
+backplane.
+
+Calls are newline-delimited JSON, ``{"id": 1, "method": "history", "args": [...]}``,
+answered with ``{"id": 1, "result": ...}`` or ``{"id": 1, "error": "ValueError",
+"message": "..."}``. Calls without an id get no answer. The server hands calls
+to the service thread in the order they arrive, so one worker's sends are
+stored in the order it made them.
+
+Run it, with the store settings the workers would otherwise use, before the workers:
+
+    STORAGE_URL=sqlite:///var/lib/chat/chat_data.db python chat_rpc.py --path /tmp/chat-service.sock
+"""
+from typing import Any, Dict, List, Optional, Set, Tuple
+import argparse
+import asyncio
+import os
+import signal
+from async_chat_service import AsyncChatService, Outgoing
+from backplane import MAX_FRAME_BYTES
+from chat_service import SearchNotReady
+from group_commit import CommitFailed
+from encoding import dumps, loads
+from pagination import DEFAULT_PAGE_SIZE
+
+# Facade methods a worker may call, and the ones it only notifies
+REMOTE_CALLS = (
+    "join", "chat_ids", "chat_summaries", "sync_delta", "send_messages",
+    "mark_read", "history", "search", "get_stats",
+)
+REMOTE_NOTIFICATIONS = ("record_presence",)
+# Errors raised again on the worker as the same type
+REMOTE_ERRORS = {
+    "ValueError": ValueError,
+    "PermissionError": PermissionError,
+    "SearchNotReady": SearchNotReady,
+    "CommitFailed": CommitFailed,
+}
+
+
+class ChatServiceServer:
+    """Serves one ``AsyncChatService`` to every worker connected to ``path``"""
+    def __init__(self, path: str, facade: AsyncChatService):
+        self.path = path
+        self.facade = facade
+        self._server = None
+        # Open worker connections, and calls still being answered
+        self._clients: Set[asyncio.StreamWriter] = set()
+        self._handlers: Set[asyncio.Task] = set()
+        self._answers: Set[asyncio.Task] = set()
+        self.calls = 0
+        self.errors = 0
+
+    async def start(self):
+        await self.facade.start()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path, limit=MAX_FRAME_BYTES)
+
+    async def stop(self):
+        """Stop accepting calls, finish the ones in flight, then close the store"""
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        for writer in list(self._clients):
+            writer.close()
+        await asyncio.gather(*self._handlers, *self._answers, return_exceptions=True)
+        await self.facade.close()
+
+    async def serve_forever(self):
+        """Serve until SIGINT or SIGTERM, then close the store cleanly"""
+        stopping = asyncio.Event()
+        loop = asyncio.get_event_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopping.set)
+        await self.start()
+        await stopping.wait()
+        await self.stop()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        loop = asyncio.get_event_loop()
+        handler = asyncio.current_task()
+        self._handlers.add(handler)
+        self._clients.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = loads(line)
+                if request.get("id") is None:
+                    self._notify(request["method"], request["args"])
+                else:
+                    # Started in arrival order, so calls reach the service thread in that order
+                    answer = loop.create_task(self._answer(request, writer))
+                    self._answers.add(answer)
+                    answer.add_done_callback(self._answers.discard)
+        except (ConnectionError, ValueError) as e:
+            print(f"Dropping chat service client: {e}")
+        finally:
+            self._clients.discard(writer)
+            self._handlers.discard(handler)
+            writer.close()
+
+    def _notify(self, method: str, args: List[Any]):
+        if method not in REMOTE_NOTIFICATIONS:
+            print(f"Unknown chat service notification {method}")
+            return
+        getattr(self.facade, method)(*args)
+
+    async def _answer(self, request: Dict[str, Any], writer: asyncio.StreamWriter):
+        self.calls += 1
+        method = request["method"]
+        try:
+            if method not in REMOTE_CALLS:
+                raise ValueError(f"Unknown chat service call {method}")
+            result = await getattr(self.facade, method)(*request["args"])
+            if method == "join":
+                chat_ids, contacts = result
+                result = [chat_ids, sorted(contacts)]
+            reply = {"id": request["id"], "result": result}
+        except Exception as e:
+            self.errors += 1
+            reply = {"id": request["id"], "error": type(e).__name__, "message": str(e)}
+        if not writer.is_closing():
+            writer.write((dumps(reply) + "\n").encode())
+
+
+class RemoteChatService:
+    """``AsyncChatService`` API for a worker whose chats live in a ``ChatServiceServer``.
+
+    Calls made while the chat service is unreachable raise ConnectionError,
+    as do calls still waiting when the connection drops; the connection is
+    retried every ``reconnect_delay`` seconds. Contacts are kept on the loop
+    side as the in-process facade does.
+    """
+    def __init__(self, path: str, reconnect_delay: float = 0.5):
+        self.path = path
+        self.reconnect_delay = reconnect_delay
+        # Nothing of the service lives in this process
+        self.service = None
+        self._contacts: Dict[str, Set[str]] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._next_id = 0
+        self._task: Optional[asyncio.Task] = None
+        self._connected = asyncio.Event()
+
+    async def start(self):
+        self._task = asyncio.get_event_loop().create_task(self._run())
+        await self._connected.wait()
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._fail_pending("Chat service client closed")
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=MAX_FRAME_BYTES)
+            except OSError as e:
+                print(f"Chat service unavailable at {self.path}: {e}")
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+
+            self._writer = writer
+            self._connected.set()
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    self._resolve(loads(line))
+            except (ConnectionError, ValueError) as e:
+                print(f"Lost chat service connection: {e}")
+            finally:
+                self._writer = None
+                writer.close()
+                self._fail_pending("Lost chat service connection")
+            await asyncio.sleep(self.reconnect_delay)
+
+    def _resolve(self, reply: Dict[str, Any]):
+        future = self._pending.pop(reply["id"], None)
+        if future is None or future.done():
+            return
+        if "error" in reply:
+            error = REMOTE_ERRORS.get(reply["error"])
+            if error is None:
+                future.set_exception(RuntimeError(f"{reply['error']}: {reply['message']}"))
+            else:
+                future.set_exception(error(reply["message"]))
+        else:
+            future.set_result(reply["result"])
+
+    def _fail_pending(self, reason: str):
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(reason))
+
+    async def _request(self, method: str, *args) -> Any:
+        if self._writer is None:
+            raise ConnectionError("Chat service is not connected")
+        self._next_id += 1
+        future = asyncio.get_event_loop().create_future()
+        self._pending[self._next_id] = future
+        self._writer.write((dumps({"id": self._next_id, "method": method, "args": args}) + "\n").encode())
+        return await future
+
+    def _notify(self, method: str, *args):
+        if self._writer is None:
+            print(f"Chat service is not connected, dropping {method}")
+            return
+        self._writer.write((dumps({"id": None, "method": method, "args": args}) + "\n").encode())
+
+    def contacts(self, user_id: str) -> Set[str]:
+        """Everyone who shares a chat with a user that connected to this worker"""
+        return self._contacts.get(user_id, set())
+
+    async def join(self, user_id: str) -> Tuple[List[str], Set[str]]:
+        chat_ids, contacts = await self._request("join", user_id)
+        return chat_ids, set(contacts)
+
+    async def join_user(self, user_id: str) -> List[str]:
+        chat_ids, contacts = await self.join(user_id)
+        self._contacts[user_id] = contacts
+        return chat_ids
+
+    def leave_user(self, user_id: str):
+        self._contacts.pop(user_id, None)
+
+    async def chat_ids(self, user_id: str) -> List[str]:
+        return await self._request("chat_ids", user_id)
+
+    async def chat_summaries(self, user_id: str) -> List[Dict[str, Any]]:
+        return await self._request("chat_summaries", user_id)
+
+    async def sync_delta(self, user_id: str, since: Dict[str, int]) -> Dict[str, Any]:
+        return await self._request("sync_delta", user_id, since)
+
+    async def send_message(
+        self,
+        user_id: str,
+        chat_id: str,
+        text: str,
+        attachment: Optional[Dict[str, Any]] = None
+    ) -> Optional[Tuple[dict, List[str]]]:
+        sent = await self.send_messages(user_id, {chat_id: [(text, attachment)]})
+        if not sent:
+            return None
+        _, messages, participants = sent[0]
+        return messages[0], participants
+
+    async def send_messages(self, user_id: str, by_chat: Dict[str, List[Outgoing]]) -> List[Tuple[str, List[dict], List[str]]]:
+        return await self._request("send_messages", user_id, by_chat)
+
+    async def mark_read(self, user_id: str, chat_id: str, seq: int) -> Optional[Tuple[int, List[str]]]:
+        return await self._request("mark_read", user_id, chat_id, seq)
+
+    async def history(
+        self,
+        user_id: str,
+        chat_id: str,
+        before: Optional[str] = None,
+        after: Optional[str] = None,
+        limit: int = DEFAULT_PAGE_SIZE
+    ) -> Optional[Dict[str, Any]]:
+        return await self._request("history", user_id, chat_id, before, after, limit)
+
+    async def search(self, user_id: str, query: str, cursor: Optional[str], limit: int) -> Dict[str, Any]:
+        return await self._request("search", user_id, query, cursor, limit)
+
+    def record_presence(self, user_id: str, is_online: bool, last_seen_us: int):
+        self._notify("record_presence", user_id, is_online, last_seen_us)
+
+    async def get_stats(self) -> Dict[str, Any]:
+        return await self._request("get_stats")
+
+
+def create_chat_service(url: Optional[str]):
+    """Build the server's chat service from ``CHAT_SERVICE_URL``.
+
+    Empty for a service in this process, set up from the environment, or
+    ``unix:///path/to.sock`` for a shared ``ChatServiceServer``.
+    """
+    if not url:
+        return AsyncChatService.from_env()
+    if url.startswith("unix://"):
+        return RemoteChatService(url[len("unix://"):])
+    raise ValueError(f"Unsupported chat service URL: {url}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the chat service shared by every worker")
+    parser.add_argument("--path", default="/tmp/chat-service.sock")
+    args = parser.parse_args()
+    print(f"Chat service listening on {args.path}")
+    asyncio.run(ChatServiceServer(args.path, AsyncChatService.from_env()).serve_forever())
@@ -1,18 +1,93 @@
-from typing import Dict, List, Optional
-import json
-import os
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Set, Tuple
+from collections import deque
 from datetime import datetime
+from itertools import islice
+import heapq
 import uuid
-from models import User, Chat, Message, MessageType, ChatRoom
+from models import User, Chat, Message, MessageType, ChatRoom, number_messages, to_epoch_us
+from storage import StorageEngine, JsonStorage
+from group_commit import GroupCommitWriter, ACK_ON_WRITE
+from concurrent.futures import Future
+from chat_index import UserChatIndex
+from hot_window import HotWindow, WindowLoader
+from search_index import CURSOR_SCOPE, SearchIndex
+import metrics
+from pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_SYNC_DELTA,
+    SYNC_DELTA,
+    SYNC_RESYNC,
+    clamp_limit,
+    decode_cursor,
+    encode_cursor,
+    sync_action,
+)
+
+# Messages read from storage, and indexed, at a time while building the search index
+SEARCH_BUILD_CHUNK = 500
+
+class SearchNotReady(RuntimeError):
+    """A search made before the index holds the stored history"""
 
 class ChatService:
-    def __init__(self, data_file: str = "chat_data.json"):
+    def __init__(
+        self,
+        data_file: str = "chat_data.json",
+        storage: Optional[StorageEngine] = None,
+        preload_messages: int = 200,
+        durability: str = ACK_ON_WRITE,
+        commit_delay: float = 0.002,
+        commit_batch: int = 1000,
+        lazy: bool = False,
+        hot_window_age: Optional[float] = None,
+        memory_budget: Optional[int] = None
+    ):
         self.data_file = data_file
         self.chats: Dict[str, Chat] = {}
         self.users: Dict[str, User] = {}
         self.chat_rooms: Dict[str, ChatRoom] = {}
+        self.chat_index = UserChatIndex()
+        self.search_index = SearchIndex()
+        self._search_ready = False
+        # Stored history still to be indexed, and messages sent meanwhile
+        self._search_build: Optional[Iterator[Tuple[int, str, int, str]]] = None
+        self._search_backlog: List[Tuple[str, int, str]] = []
+        # How messages are serialized in history pages, sync deltas and search results
+        self.message_format: Callable[[Message], Dict[str, Any]] = Message.to_dict
+        self.storage = storage or JsonStorage(data_file)
+        self.writer = GroupCommitWriter(
+            self.storage,
+            durability=durability,
+            max_delay=commit_delay,
+            max_batch=commit_batch
+        )
+        # Messages per chat held in memory after startup, for engines that page from disk
+        self.preload_messages = preload_messages
+        # Only load chat metadata at startup; build messages on first access
+        self.lazy = lazy
+        # Message positions handed to the writer but not yet in storage, as
+        # (writer ticket, chat_id, position), and the lowest one per chat
+        self._unwritten: Deque[Tuple[int, str, int]] = deque()
+        self._unwritten_from: Dict[str, int] = {}
+        # Engines that page from disk keep only a bounded window in memory;
+        # with the JSON engine the whole history stays resident
+        pages = self.storage.pages_messages
+        self.hot_window = HotWindow(
+            self._written,
+            self._window_loader,
+            max_messages=preload_messages if pages else None,
+            max_age=hot_window_age if pages else None,
+            budget_bytes=memory_budget if pages else None
+        )
         self.load_data()
         self._initialize_default_data()
+        if pages:
+            for chat in self.chats.values():
+                self._page_from_storage(chat)
+        self._rebuild_index()
+        # Nothing is read yet; build_search_index does the work a chunk at a time
+        self.start_search_index()
+        self.hot_window.enforce()
     
     def _initialize_default_data(self):
         """Initialize with some default chats and users if none exist"""
@@ -30,6 +105,7 @@ class ChatService:
             
             # Create default chats
             self._create_default_chats()
+            self.save_data()
     
     def _create_default_chats(self):
         """Create some default chats for demonstration"""
@@ -111,67 +187,221 @@ class ChatService:
         chat3.add_message(msg5)
         self.chats["chat_3"] = chat3
     
+    def _rebuild_index(self):
+        """Index every chat by participant, oldest activity first"""
+        self.chat_index = UserChatIndex()
+        for chat in sorted(self.chats.values(), key=lambda x: x.last_message_us):
+            self.chat_index.add_chat(chat.chat_id, chat.participants)
+    
+    def _searchable(self, chat: Chat, count: int) -> Iterator[Tuple[int, str, int, str]]:
+        """(timestamp_us, chat_id, position, text) for a chat's first ``count`` messages, oldest first.
+
+        Each chunk is read only when the merge reaches it, from the chat's
+        window if it holds those positions by then and from storage otherwise.
+        """
+        for start in range(0, count, SEARCH_BUILD_CHUNK):
+            end = min(start + SEARCH_BUILD_CHUNK, count)
+            if chat.messages_loaded or not self.storage.pages_messages:
+                in_memory = chat.messages
+                offset = chat.message_offset
+            else:
+                # Read an evicted chat straight from storage instead of faulting it in
+                in_memory = []
+                offset = end
+            stored = min(max(offset, start), end)
+            chunk = [
+                (to_epoch_us(datetime.fromisoformat(msg_data['timestamp'])), chat.chat_id, position, msg_data['text'])
+                for position, msg_data in enumerate(self.storage.fetch_messages(chat.chat_id, start, stored), start)
+            ] if start < stored else []
+            # Copied out now: the window may be trimmed before the merge comes back
+            chunk.extend(
+                (message.timestamp_us, chat.chat_id, position, message.text)
+                for position, message in enumerate(in_memory[stored - offset:end - offset], stored)
+            )
+            yield from chunk
+    
+    def start_search_index(self):
+        """Start a fresh index over every message stored so far, merged into time order"""
+        self.search_index = SearchIndex()
+        self._search_ready = False
+        self._search_backlog = []
+        streams = [self._searchable(chat, chat.message_count) for chat in self.chats.values()]
+        self._search_build = heapq.merge(*streams)
+    
+    def build_search_index(self, limit: Optional[int] = SEARCH_BUILD_CHUNK) -> bool:
+        """Index up to ``limit`` more stored messages, or all of them with None.
+
+        Returns True once the index is complete. Messages sent during the
+        build wait in a backlog and are indexed after the stored ones, so
+        document order stays time order.
+        """
+        if self._search_build is None:
+            return self._search_ready
+        indexed = 0
+        for _, chat_id, position, text in islice(self._search_build, limit):
+            self.search_index.add(chat_id, position, text)
+            indexed += 1
+        if limit is not None and indexed == limit:
+            return False
+        for chat_id, position, text in self._search_backlog:
+            self.search_index.add(chat_id, position, text)
+        self._search_backlog = []
+        self._search_build = None
+        self._search_ready = True
+        return True
+    
+    @staticmethod
+    def _message_from_dict(msg_data: Dict[str, Any]) -> Message:
+        return Message(
+            msg_data['message_id'],
+            msg_data['chat_id'],
+            msg_data['sender_id'],
+            msg_data['text'],
+            MessageType(msg_data.get('message_type', 'text')),
+            datetime.fromisoformat(msg_data['timestamp']),
+            msg_data.get('attachment')
+        )
+    
+    def _load_messages(self, chat_id: str, start: int, end: int) -> List[Message]:
+        """Fetch messages that are no longer held in memory from storage"""
+        return [
+            self._message_from_dict(msg_data)
+            for msg_data in self.storage.fetch_messages(chat_id, start, end)
+        ]
+    
+    def _window_loader(self, chat: Chat) -> WindowLoader:
+        """Loader that faults an evicted chat's recent messages back in"""
+        def load_window():
+            count = chat.message_count
+            start = max(count - self.preload_messages, 0)
+            return start, self._load_messages(chat.chat_id, start, count)
+        
+        return load_window
+    
+    def _page_from_storage(self, chat: Chat):
+        chat_id = chat.chat_id
+        chat.history_loader = lambda start, end: self._load_messages(chat_id, start, end)
+    
+    def _drain_written(self):
+        written = self.writer.records
+        pending = self._unwritten
+        while pending and pending[0][0] <= written:
+            _, chat_id, position = pending.popleft()
+            if position + 1 < self.chats[chat_id].message_count:
+                self._unwritten_from[chat_id] = position + 1
+            else:
+                del self._unwritten_from[chat_id]
+    
+    def _written(self, chat: Chat) -> int:
+        """Position below which the chat's messages can be read back from storage"""
+        self._drain_written()
+        return self._unwritten_from.get(chat.chat_id, chat.message_count)
+    
+    def _read_page(self, chat: Chat, **bounds) -> Dict[str, Any]:
+        """A page of a chat's messages, counted as a hot window hit or miss"""
+        hit = chat.messages_loaded
+        page = chat.get_messages_page(
+            loader=lambda start, end: self._load_messages(chat.chat_id, start, end),
+            **bounds
+        )
+        messages = page["messages"]
+        if messages and messages[0].seq < chat.message_offset:
+            hit = False
+        self.hot_window.record_read(hit)
+        self.hot_window.touch(chat)
+        return page
+    
+    def _defer_messages(self, chat: Chat, chat_data: Dict[str, Any]):
+        """Set up a chat to build its message window on first access"""
+        raw = chat_data.get('messages', [])
+        offset = chat_data.get('message_offset', 0)
+        count = offset + len(raw)
+        last_message_us = None
+        if raw:
+            last_message_us = to_epoch_us(datetime.fromisoformat(raw[-1]['timestamp']))
+        
+        def load_window():
+            if offset == 0:
+                # The engine handed over the whole history already
+                return 0, [self._message_from_dict(msg_data) for msg_data in raw]
+            start = min(max(count - self.preload_messages, 0), offset)
+            older = self.storage.fetch_messages(chat.chat_id, start, offset)
+            return start, [self._message_from_dict(msg_data) for msg_data in older + raw]
+        
+        self.hot_window.defer(chat, count, last_message_us, load_window)
+    
     def load_data(self):
-        """Load chat data from JSON file"""
-        if os.path.exists(self.data_file):
-            try:
-                with open(self.data_file, 'r') as f:
-                    data = json.load(f)
-                    
-                # Load users
-                for user_data in data.get('users', []):
-                    user = User(
-                        user_data['user_id'],
-                        user_data['username'],
-                        user_data.get('avatar')
-                    )
-                    self.users[user.user_id] = user
+        """Load users, chats and recent messages from the storage engine"""
+        try:
+            data = self.storage.load(recent=1 if self.lazy else self.preload_messages)
+            
+            # Load users
+            for user_data in data['users'].values():
+                user = User(
+                    user_data['user_id'],
+                    user_data['username'],
+                    user_data.get('avatar')
+                )
+                if user_data.get('last_seen_us') is not None:
+                    user.last_seen_us = user_data['last_seen_us']
+                elif user_data.get('last_seen'):
+                    user.last_seen = datetime.fromisoformat(user_data['last_seen'])
+                self.users[user.user_id] = user
+            
+            # Load chats
+            for chat_data in data['chats'].values():
+                chat = Chat(
+                    chat_data['chat_id'],
+                    chat_data['name'],
+                    chat_data['chat_type'],
+                    chat_data['participants'],
+                    chat_data.get('avatar')
+                )
                 
-                # Load chats
-                for chat_data in data.get('chats', []):
-                    chat = Chat(
-                        chat_data['chat_id'],
-                        chat_data['name'],
-                        chat_data['chat_type'],
-                        chat_data['participants'],
-                        chat_data.get('avatar')
-                    )
-                    
-                    # Load messages
+                # Load messages
+                if self.lazy:
+                    self._defer_messages(chat, chat_data)
+                else:
+                    chat.message_offset = chat_data.get('message_offset', 0)
                     for msg_data in chat_data.get('messages', []):
-                        message = Message(
-                            msg_data['message_id'],
-                            msg_data['chat_id'],
-                            msg_data['sender_id'],
-                            msg_data['text'],
-                            MessageType(msg_data.get('message_type', 'text')),
-                            datetime.fromisoformat(msg_data['timestamp'])
-                        )
-                        chat.add_message(message)
-                    
-                    self.chats[chat.chat_id] = chat
-                    
-            except Exception as e:
-                print(f"Error loading data: {e}")
+                        chat.add_message(self._message_from_dict(msg_data))
+                    self.hot_window.track(chat)
+                for user_id, seq in chat_data.get('read_seqs', {}).items():
+                    chat.mark_read(user_id, seq)
+                
+                self.chats[chat.chat_id] = chat
+                
+        except Exception as e:
+            print(f"Error loading data: {e}")
     
     def save_data(self):
-        """Save chat data to JSON file"""
+        """Write a full snapshot of the current state.
+
+        Regular mutations are appended to the storage engine instead; this
+        is only needed for the initial seed or an explicit checkpoint.
+        """
+        started = metrics.start()
         try:
-            data = {
-                'users': [user.to_dict() for user in self.users.values()],
-                'chats': []
-            }
-            
-            for chat in self.chats.values():
-                chat_data = chat.to_dict()
-                data['chats'].append(chat_data)
-            
-            with open(self.data_file, 'w') as f:
-                json.dump(data, f, indent=2, default=str)
-                
+            self.writer.flush()
+            self.storage.write_snapshot(self.users.values(), self.chats.values())
+            metrics.SNAPSHOT.observe_since(started)
         except Exception as e:
             print(f"Error saving data: {e}")
     
+    def _log(self, op: str, **fields):
+        """Queue one mutation for the next group commit"""
+        self.writer.submit(op, **fields)
+    
+    def committed(self) -> Future:
+        """Future that resolves once every mutation so far is committed at the
+        configured durability level; await it with ``asyncio.wrap_future``"""
+        return self.writer.committed()
+    
+    def close(self):
+        """Flush pending writes and release the storage engine"""
+        self.writer.close()
+        self.storage.close()
+    
     def create_chat(self, name: str, chat_type: str, participants: List[str]) -> Optional[Chat]:
         """Create a new chat"""
         chat_id = str(uuid.uuid4())
@@ -183,9 +413,19 @@ class ChatService:
             participants=participants
         )
         
+        if self.storage.pages_messages:
+            self._page_from_storage(chat)
         self.chats[chat_id] = chat
         self.chat_rooms[chat_id] = ChatRoom(chat_id)
-        self.save_data()
+        self.chat_index.add_chat(chat_id, chat.participants)
+        self._log(
+            "chat",
+            chat_id=chat_id,
+            name=name,
+            chat_type=chat_type,
+            participants=chat.participants,
+            avatar=chat.avatar
+        )
         
         return chat
     
@@ -194,18 +434,18 @@ class ChatService:
         return self.chats.get(chat_id)
     
     def get_user_chats(self, user_id: str) -> List[Chat]:
-        """Get all chats that a user is part of"""
-        user_chats = []
-        for chat in self.chats.values():
-            if user_id in chat.participants:
-                user_chats.append(chat)
-        
-        # Sort by last message time
-        user_chats.sort(key=lambda x: x.last_message_at, reverse=True)
-        return user_chats
+        """Get all chats that a user is part of, most recently active first"""
+        return [self.chats[chat_id] for chat_id in self.chat_index.chat_ids(user_id)]
     
-    def add_message(self, chat_id: str, sender_id: str, text: str) -> Optional[Message]:
-        """Add a message to a chat"""
+    def add_message(
+        self,
+        chat_id: str,
+        sender_id: str,
+        text: str,
+        message_type: MessageType = MessageType.TEXT,
+        attachment: Optional[Dict[str, Any]] = None
+    ) -> Optional[Message]:
+        """Add a message to a chat; media messages reference a blob through ``attachment``"""
         chat = self.get_chat(chat_id)
         if not chat:
             return None
@@ -214,22 +454,172 @@ class ChatService:
             message_id=str(uuid.uuid4()),
             chat_id=chat_id,
             sender_id=sender_id,
-            text=text
+            text=text,
+            message_type=message_type,
+            attachment=attachment
         )
+        position = chat.message_count
         
+        started = metrics.start()
+        if self.storage.pages_messages and not chat.messages_loaded:
+            # Appending needs none of the history; leave it in storage
+            chat.start_window()
         chat.add_message(message)
-        self.save_data()
+        if self.storage.pages_messages:
+            # The message record below gets the writer's next ticket
+            self._drain_written()
+            self._unwritten.append((self.writer.submitted + 1, chat.chat_id, position))
+            self._unwritten_from.setdefault(chat.chat_id, position)
+        self.hot_window.added(chat, message)
+        self.chat_index.touch(chat_id, chat.participants)
+        if self._search_ready:
+            self.search_index.add(chat_id, position, text)
+        elif self._search_build is not None:
+            self._search_backlog.append((chat_id, position, text))
+        metrics.INGEST["store"].observe_since(started)
+        
+        started = metrics.start()
+        # Text messages leave the field out rather than logging a null
+        extra = {"attachment": attachment} if attachment is not None else {}
+        self._log(
+            "message",
+            message_id=message.message_id,
+            chat_id=chat_id,
+            sender_id=sender_id,
+            text=text,
+            message_type=message.message_type.value,
+            timestamp=message.timestamp.isoformat(),
+            position=position,
+            **extra
+        )
+        # Handing the record to the group-commit writer; the commit itself is chat_commit_seconds
+        metrics.INGEST["persist"].observe_since(started)
         
         return message
     
     def get_chat_messages(self, chat_id: str, limit: int = 50) -> List[Message]:
-        """Get messages for a chat"""
+        """Get the latest messages for a chat"""
         chat = self.get_chat(chat_id)
         if not chat:
             return []
         
-        # Return last 'limit' messages
-        return chat.messages[-limit:] if len(chat.messages) > limit else chat.messages
+        return self._read_page(chat, limit=clamp_limit(limit))["messages"]
+    
+    def get_chat_history(
+        self,
+        chat_id: str,
+        before: Optional[str] = None,
+        after: Optional[str] = None,
+        limit: int = DEFAULT_PAGE_SIZE
+    ) -> Optional[Dict]:
+        """Get a page of messages before or after an opaque cursor.
+
+        Raises ValueError for a cursor that does not belong to this chat.
+        """
+        chat = self.get_chat(chat_id)
+        if not chat:
+            return None
+        
+        page = self._read_page(
+            chat,
+            before=decode_cursor(before, chat_id) if before else None,
+            after=decode_cursor(after, chat_id) if after else None,
+            limit=clamp_limit(limit)
+        )
+        page["messages"] = [self.message_format(msg) for msg in page["messages"]]
+        page["chat_id"] = chat_id
+        return page
+    
+    def _message_at(self, chat_id: str, position: int) -> Optional[Message]:
+        chat = self.get_chat(chat_id)
+        if chat is None:
+            return None
+        if chat.messages_loaded or not self.storage.pages_messages:
+            in_memory = chat.messages
+        else:
+            # Don't fault a whole window in for one search hit
+            in_memory = []
+        if in_memory and position >= chat.message_offset:
+            index = position - chat.message_offset
+            return in_memory[index] if index < len(in_memory) else None
+        loaded = number_messages(self._load_messages(chat_id, position, position + 1), position)
+        return loaded[0] if loaded else None
+    
+    def search_messages(
+        self,
+        user_id: str,
+        query: str,
+        cursor: Optional[str] = None,
+        limit: int = DEFAULT_PAGE_SIZE
+    ) -> Dict[str, Any]:
+        """Newest messages matching a query in the chats the user belongs to.
+
+        Raises ValueError for a query without words or an invalid cursor,
+        and SearchNotReady while ``build_search_index`` has work left.
+        """
+        if not self._search_ready:
+            raise SearchNotReady("Search index is still being built")
+        hits, next_doc = self.search_index.search(
+            query,
+            self.chat_index.chat_ids(user_id),
+            clamp_limit(limit),
+            before=decode_cursor(cursor, CURSOR_SCOPE) if cursor else None,
+            fetch=self._message_at
+        )
+        return {
+            "query": query,
+            "results": [
+                {"chat_id": chat_id, "message": self.message_format(message)} for chat_id, _, message in hits
+            ],
+            "cursor": encode_cursor(CURSOR_SCOPE, next_doc) if next_doc is not None else None
+        }
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Hot window occupancy, hit rate and evictions"""
+        return self.hot_window.get_stats()
+    
+    def get_sync_delta(self, user_id: str, since: Dict[str, int]) -> Dict[str, Any]:
+        """What a reconnecting client is missing, given its last seen seq per chat.
+
+        Chats it is slightly behind on get just the missing messages; chats it
+        does not know or is too far behind on get a fresh summary to resync.
+        """
+        deltas = []
+        resync = []
+        for chat in self.get_user_chats(user_id):
+            action = sync_action(since.get(chat.chat_id), chat.message_count)
+            if action == SYNC_RESYNC:
+                resync.append(chat.to_summary_dict(message_format=self.message_format, user_id=user_id))
+                self.hot_window.touch(chat)
+            elif action == SYNC_DELTA:
+                page = self._read_page(chat, after=since[chat.chat_id], limit=MAX_SYNC_DELTA)
+                deltas.append({
+                    "chat_id": chat.chat_id,
+                    "messages": [self.message_format(msg) for msg in page["messages"]],
+                    "last_seq": chat.message_count - 1,
+                    "read_seqs": dict(chat.read_seqs),
+                    "unread_count": chat.unread_count(user_id)
+                })
+        removed = [
+            chat_id for chat_id in since
+            if not self.chat_index.is_member(user_id, chat_id)
+        ]
+        return {"deltas": deltas, "resync": resync, "removed": removed}
+    
+    def mark_read(self, chat_id: str, user_id: str, seq: int) -> Optional[int]:
+        """Move a participant's read watermark forward.
+
+        Returns the new watermark, or None if the chat is unknown, the user
+        is not a participant or the watermark was already at or past ``seq``.
+        """
+        chat = self.get_chat(chat_id)
+        if chat is None or not chat.has_participant(user_id):
+            return None
+        if not chat.mark_read(user_id, seq):
+            return None
+        seq = chat.read_seqs[user_id]
+        self._log("read", chat_id=chat_id, user_id=user_id, seq=seq)
+        return seq
     
     def add_user_to_chat(self, chat_id: str, user_id: str) -> bool:
         """Add a user to a chat"""
@@ -237,9 +627,9 @@ class ChatService:
         if not chat:
             return False
         
-        if user_id not in chat.participants:
-            chat.participants.append(user_id)
-            self.save_data()
+        if chat.add_participant(user_id):
+            self.chat_index.add(user_id, chat_id)
+            self._log("join", chat_id=chat_id, user_id=user_id)
         
         # Add to active chat room
         if chat_id not in self.chat_rooms:
@@ -254,9 +644,9 @@ class ChatService:
         if not chat:
             return False
         
-        if user_id in chat.participants:
-            chat.participants.remove(user_id)
-            self.save_data()
+        if chat.remove_participant(user_id):
+            self.chat_index.remove(user_id, chat_id)
+            self._log("leave", chat_id=chat_id, user_id=user_id)
         
         # Remove from active chat room
         if chat_id in self.chat_rooms:
@@ -272,6 +662,27 @@ class ChatService:
                 username=username or user_id,
                 avatar=f"https://i.pravatar.cc/150?u={user_id}"
             )
-            self.save_data()
+            user = self.users[user_id]
+            self._log("user", user_id=user_id, username=user.username, avatar=user.avatar)
         
-        return self.users[user_id]
\ No newline at end of file
+        return self.users[user_id]
+    
+    def get_contacts(self, user_id: str) -> Set[str]:
+        """Everyone who shares a chat with the user"""
+        contacts: Set[str] = set()
+        for chat_id in self.chat_index.chat_ids(user_id):
+            contacts.update(self.chats[chat_id].participants)
+        contacts.discard(user_id)
+        return contacts
+    
+    def update_presence(self, user_id: str, is_online: bool, last_seen_us: int):
+        """Record presence and log the new last_seen.
+
+        Presence changes arrive already debounced, one per connect or final
+        disconnect, and share group commits with everything else.
+        """
+        user = self.users.get(user_id)
+        if user is not None:
+            user.is_online = is_online
+            user.last_seen_us = last_seen_us
+            self._log("presence", user_id=user_id, last_seen_us=last_seen_us)
@@ -1,88 +1,403 @@
 from fastapi import WebSocket
-from typing import Dict, List
+from typing import Deque, Dict, List, Optional, Callable, Tuple
+from collections import deque
 import json
 import asyncio
+from backplane import Backplane, InProcessBackplane
+from fanout import ShardedFanout
+from wire import JSON_CODEC, WireCodec
+import metrics
 
-class ConnectionManager:
+# What a connection does when its outbound queue is full
+DROP_OLDEST = "drop_oldest"
+COALESCE_PRESENCE = "coalesce_presence"
+DISCONNECT = "disconnect"
+OVERFLOW_POLICIES = (DROP_OLDEST, COALESCE_PRESENCE, DISCONNECT)
+
+DEFAULT_QUEUE_SIZE = 256
+# Upper bound on the outbound coalescing window a client may ask for
+MAX_COALESCE_WINDOW = 0.05
+# Concurrent sessions (devices, tabs) kept per user
+MAX_SESSIONS_PER_USER = 8
+
+
+_EVENTS_PREFIX = '{"type":"events","events":['
+_EVENTS_SUFFIX = "]}"
+
+
+def events_frame(payloads: List[str]) -> str:
+    """Wrap already encoded events in one ``events`` frame without re-encoding them.
+
+    Payloads that are ``events`` frames themselves are spliced in, so clients
+    never see nested batches.
+    """
+    parts = []
+    for payload in payloads:
+        if payload.startswith(_EVENTS_PREFIX):
+            payload = payload[len(_EVENTS_PREFIX):-len(_EVENTS_SUFFIX)]
+        parts.append(payload)
+    return _EVENTS_PREFIX + ",".join(parts) + _EVENTS_SUFFIX
+
+
+class SendMetrics:
+    """Counters shared by every connection's writer task"""
     def __init__(self):
-        # Store active WebSocket connections: user_id -> WebSocket
-        self.active_connections: Dict[str, WebSocket] = {}
-        # Store user information
-        self.connected_users: Dict[str, dict] = {}
+        self.enqueued = 0
+        self.sent = 0
+        self.frames = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.slow_disconnects = 0
+        self.send_count = 0
+        self.send_seconds_total = 0.0
+        self.send_seconds_max = 0.0
+        self.queue_seconds_total = 0.0
+        self.queue_seconds_max = 0.0
     
-    async def connect(self, websocket: WebSocket, user_id: str):
-        """Accept a new WebSocket connection"""
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
-        self.connected_users[user_id] = {
-            "user_id": user_id,
-            "username": user_id,  # Using user_id as username for simplicity
-            "connected_at": asyncio.get_event_loop().time()
+    def observe_send(self, send_seconds: float, queue_seconds: float, events: int = 1):
+        self.sent += events
+        self.frames += 1
+        self.send_count += 1
+        self.send_seconds_total += send_seconds
+        self.queue_seconds_total += queue_seconds
+        if send_seconds > self.send_seconds_max:
+            self.send_seconds_max = send_seconds
+        if queue_seconds > self.queue_seconds_max:
+            self.queue_seconds_max = queue_seconds
+        metrics.SEND.observe(send_seconds)
+        metrics.QUEUE_WAIT.observe(queue_seconds)
+    
+    def to_dict(self) -> dict:
+        count = self.send_count or 1
+        return {
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "slow_disconnects": self.slow_disconnects,
+            "send_latency_avg_ms": self.send_seconds_total / count * 1000,
+            "send_latency_max_ms": self.send_seconds_max * 1000,
+            "queue_latency_avg_ms": self.queue_seconds_total / count * 1000,
+            "queue_latency_max_ms": self.queue_seconds_max * 1000,
         }
-        print(f"User {user_id} connected. Total connections: {len(self.active_connections)}")
-    
-    def disconnect(self, user_id: str):
-        """Remove a WebSocket connection"""
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
-        if user_id in self.connected_users:
-            del self.connected_users[user_id]
-        print(f"User {user_id} disconnected. Total connections: {len(self.active_connections)}")
-    
-    async def send_personal_message(self, message: str, user_id: str):
-        """Send a message to a specific user"""
-        if user_id in self.active_connections:
-            try:
-                websocket = self.active_connections[user_id]
-                await websocket.send_text(message)
-            except Exception as e:
-                print(f"Error sending message to {user_id}: {e}")
-                # Remove broken connection
-                self.disconnect(user_id)
-    
-    async def broadcast(self, message: str, exclude_user: str = None):
-        """Broadcast a message to all connected users"""
-        disconnected_users = []
+
+
+class ClientConnection:
+    """A WebSocket with a bounded outbound queue drained by its own writer task.
+
+    ``send`` never awaits the socket, so one slow client only ever backs up
+    its own queue. Entries enqueued with a ``coalesce_key`` replace any
+    still-queued entry with the same key, which keeps presence updates from
+    piling up behind a slow reader.
+
+    With a ``coalesce_window`` the writer waits that long after the first
+    queued event and sends everything queued by then as a single ``events``
+    frame, trading a few milliseconds of latency for far fewer frames.
+
+    Frames are queued as JSON text; ``codec`` turns them into the encoding
+    the client negotiated as they are written.
+    """
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: str,
+        max_queue: int = DEFAULT_QUEUE_SIZE,
+        overflow_policy: str = DROP_OLDEST,
+        metrics: Optional[SendMetrics] = None,
+        on_close: Optional[Callable[["ClientConnection"], None]] = None,
+        coalesce_window: float = 0.0,
+        codec: WireCodec = JSON_CODEC
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.websocket = websocket
+        self.user_id = user_id
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.metrics = metrics or SendMetrics()
+        self.on_close = on_close
+        self.coalesce_window = min(max(coalesce_window, 0.0), MAX_COALESCE_WINDOW)
+        self.codec = codec
+        # Entries are [payload, enqueued_at, coalesce_key]
+        self._queue: Deque[list] = deque()
+        self._keyed: Dict[str, list] = {}
+        self._wakeup = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self.closed = False
+    
+    def start(self):
+        """Start the writer task"""
+        self._writer = asyncio.get_event_loop().create_task(self._drain())
+    
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+    
+    def send(self, message: str, coalesce_key: Optional[str] = None) -> bool:
+        """Queue a message for this client without waiting on the socket"""
+        if self.closed:
+            return False
         
-        for user_id, websocket in self.active_connections.items():
-            if exclude_user and user_id == exclude_user:
-                continue
-            
-            try:
-                await websocket.send_text(message)
-            except Exception as e:
-                print(f"Error broadcasting to {user_id}: {e}")
-                disconnected_users.append(user_id)
+        if coalesce_key is not None and coalesce_key in self._keyed:
+            self._keyed[coalesce_key][0] = message
+            self.metrics.coalesced += 1
+            return True
         
-        # Clean up disconnected users
-        for user_id in disconnected_users:
-            self.disconnect(user_id)
+        if len(self._queue) >= self.max_queue and not self._make_room():
+            return False
+        
+        entry = [message, asyncio.get_event_loop().time(), coalesce_key]
+        self._queue.append(entry)
+        if coalesce_key is not None:
+            self._keyed[coalesce_key] = entry
+        self.metrics.enqueued += 1
+        self._wakeup.set()
+        return True
     
-    async def broadcast_to_users(self, message: str, user_ids: List[str]):
-        """Broadcast a message to specific users"""
-        disconnected_users = []
+    def _make_room(self) -> bool:
+        """Apply the overflow policy; returns False if nothing can be queued"""
+        if self.overflow_policy == DISCONNECT:
+            self.metrics.slow_disconnects += 1
+            print(f"Disconnecting slow consumer {self.user_id} ({len(self._queue)} queued)")
+            self.close(code=1013)
+            return False
         
+        victim = None
+        if self.overflow_policy == COALESCE_PRESENCE:
+            # Presence is superseded by later updates, so it goes first
+            for entry in self._queue:
+                if entry[2] is not None:
+                    victim = entry
+                    break
+        if victim is None:
+            victim = self._queue[0]
+        self._queue.remove(victim)
+        if victim[2] is not None:
+            self._keyed.pop(victim[2], None)
+        self.metrics.dropped += 1
+        return True
+    
+    async def _drain(self):
+        loop = asyncio.get_event_loop()
+        try:
+            while True:
+                while not self._queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                
+                if self.coalesce_window and len(self._queue) < self.max_queue:
+                    await asyncio.sleep(self.coalesce_window)
+                    if not self._queue:
+                        continue
+                
+                entries = [self._queue.popleft()]
+                if self.coalesce_window:
+                    entries.extend(self._queue)
+                    self._queue.clear()
+                for entry in entries:
+                    if entry[2] is not None:
+                        self._keyed.pop(entry[2], None)
+                
+                if len(entries) == 1:
+                    frame = entries[0][0]
+                else:
+                    frame = events_frame([entry[0] for entry in entries])
+                
+                started = loop.time()
+                if self.codec.binary:
+                    await self.websocket.send_bytes(self.codec.encode(frame))
+                else:
+                    await self.websocket.send_text(frame)
+                finished = loop.time()
+                self.metrics.observe_send(finished - started, finished - entries[0][1], len(entries))
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Error sending message to {self.user_id}: {e}")
+        finally:
+            self.closed = True
+            if self.on_close:
+                self.on_close(self)
+    
+    def close(self, code: Optional[int] = None):
+        """Stop the writer; with ``code`` also close the socket itself"""
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.clear()
+        self._keyed.clear()
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        if code is not None:
+            asyncio.get_event_loop().create_task(self._close_socket(code))
+    
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+class ConnectionManager:
+    """Registry of every open WebSocket session on this worker, by user.
+
+    A user may be connected from several devices or tabs at once; each
+    session has its own ``ClientConnection`` and every frame for the user
+    goes to all of them. Sessions are kept as a tuple per user, so fan-out
+    is one dict lookup per recipient and iteration never races a session
+    closing. At most ``max_sessions`` sessions are kept per user; a new one
+    past that closes the oldest.
+    """
+    def __init__(
+        self,
+        max_queue: int = DEFAULT_QUEUE_SIZE,
+        overflow_policy: str = DROP_OLDEST,
+        backplane: Optional[Backplane] = None,
+        max_sessions: int = MAX_SESSIONS_PER_USER,
+        fanout: Optional[ShardedFanout] = None
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        # user_id -> open sessions, oldest first
+        self.active_connections: Dict[str, Tuple[ClientConnection, ...]] = {}
+        # Profile of every user seen on this worker, sent as the "user" payload
+        self.users: Dict[str, dict] = {}
+        self.connection_count = 0
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.max_sessions = max_sessions
+        self.metrics = SendMetrics()
+        # Fan-out goes through the backplane so it reaches every worker
+        self.backplane = backplane or InProcessBackplane()
+        self.backplane.attach(self._deliver)
+        # Large groups are served by sharded delivery workers, not inline
+        self.fanout = fanout or ShardedFanout()
+        self.fanout.attach(self._send_local)
+    
+    async def connect(
+        self,
+        websocket: WebSocket,
+        user_id: str,
+        coalesce_window: float = 0.0,
+        codec: WireCodec = JSON_CODEC
+    ) -> ClientConnection:
+        """Accept a WebSocket as one more session for the user"""
+        await websocket.accept()
+        connection = ClientConnection(
+            websocket,
+            user_id,
+            max_queue=self.max_queue,
+            overflow_policy=self.overflow_policy,
+            metrics=self.metrics,
+            on_close=self.disconnect,
+            coalesce_window=coalesce_window,
+            codec=codec
+        )
+        connection.start()
+        sessions = self.active_connections.get(user_id, ()) + (connection,)
+        self.active_connections[user_id] = sessions
+        self.connection_count += 1
+        if len(sessions) > self.max_sessions:
+            print(f"User {user_id} has {len(sessions)} sessions, closing the oldest")
+            sessions[0].close(code=1008)
+            self.disconnect(sessions[0])
+        user = self.users.setdefault(user_id, {
+            "id": user_id,
+            "name": user_id,
+            "avatar": f"https://i.pravatar.cc/150?u={user_id}",
+            "online": True
+        })
+        user["online"] = True
+        return connection
+    
+    def disconnect(self, connection: ClientConnection):
+        """Remove one session; the user stays online while any other remains"""
+        connection.close()
+        sessions = self.active_connections.get(connection.user_id, ())
+        if connection not in sessions:
+            return
+        remaining = tuple(session for session in sessions if session is not connection)
+        self.connection_count -= 1
+        if remaining:
+            self.active_connections[connection.user_id] = remaining
+        else:
+            del self.active_connections[connection.user_id]
+            self.users[connection.user_id]["online"] = False
+    
+    def disconnect_user(self, user_id: str, code: Optional[int] = None):
+        """Close every session a user has on this worker"""
+        for connection in self.active_connections.get(user_id, ()):
+            connection.close(code)
+            self.disconnect(connection)
+    
+    def _deliver(
+        self,
+        user_ids: Optional[List[str]],
+        message: str,
+        coalesce_key: Optional[str],
+        exclude_user: Optional[str] = None
+    ):
+        """Hand a published frame to every session of the recipients connected to this worker"""
+        if user_ids is None:
+            user_ids = list(self.active_connections)
+        elif self.fanout.accepts(user_ids):
+            self.fanout.submit(user_ids, message, coalesce_key, exclude_user, self.is_user_online)
+            return
+        self._send_local(user_ids, message, coalesce_key, exclude_user)
+    
+    def _send_local(
+        self,
+        user_ids: List[str],
+        message: str,
+        coalesce_key: Optional[str],
+        exclude_user: Optional[str] = None
+    ):
+        sessions = self.active_connections
         for user_id in user_ids:
-            if user_id in self.active_connections:
-                try:
-                    websocket = self.active_connections[user_id]
-                    await websocket.send_text(message)
-                except Exception as e:
-                    print(f"Error sending to {user_id}: {e}")
-                    disconnected_users.append(user_id)
-        
-        # Clean up disconnected users
-        for user_id in disconnected_users:
-            self.disconnect(user_id)
+            if user_id == exclude_user:
+                continue
+            for connection in sessions.get(user_id, ()):
+                connection.send(message, coalesce_key)
+    
+    def send_personal_message(self, message: str, user_id: str, coalesce_key: Optional[str] = None):
+        """Queue a message for every session of a specific user"""
+        self.backplane.publish([user_id], message, coalesce_key)
+    
+    def broadcast(self, message: str, exclude_user: str = None, coalesce_key: Optional[str] = None):
+        """Queue a message for all connected users"""
+        self.backplane.publish(None, message, coalesce_key, exclude_user)
+    
+    def broadcast_to_users(self, message: str, user_ids: List[str], coalesce_key: Optional[str] = None):
+        """Queue a message for specific users"""
+        self.backplane.publish(list(user_ids), message, coalesce_key)
     
     def get_online_users(self) -> List[dict]:
         """Get list of all online users"""
-        return list(self.connected_users.values())
+        return [self.users[user_id] for user_id in self.active_connections]
     
     def is_user_online(self, user_id: str) -> bool:
-        """Check if a user is currently online"""
+        """Check if a user has at least one open session"""
         return user_id in self.active_connections
     
+    def get_sessions(self, user_id: str) -> Tuple[ClientConnection, ...]:
+        return self.active_connections.get(user_id, ())
+    
     def get_connection_count(self) -> int:
-        """Get total number of active connections"""
-        return len(self.active_connections)
\ No newline at end of file
+        """Get total number of open sessions"""
+        return self.connection_count
+    
+    def get_metrics(self) -> dict:
+        """Send counters plus current outbound queue depths"""
+        depths = [
+            connection.queue_depth
+            for sessions in self.active_connections.values()
+            for connection in sessions
+        ]
+        metrics = self.metrics.to_dict()
+        metrics.update({
+            "users": len(self.active_connections),
+            "connections": len(depths),
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+        })
+        return metrics
@@ -0,0 +1,33 @@
+from typing import Any
+import json
+import metrics
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+# Name of the JSON backend in use, for diagnostics
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+
+def _default(obj: Any) -> str:
+    return str(obj)
+
+
+def dumps(obj: Any) -> str:
+    """Encode ``obj`` as compact JSON text using the fastest backend available"""
+    started = metrics.start()
+    if orjson is not None:
+        text = orjson.dumps(obj, default=_default).decode()
+    else:
+        text = json.dumps(obj, separators=(",", ":"), default=_default)
+    metrics.ENCODE.observe_since(started)
+    return text
+
+
+def loads(data: str) -> Any:
+    """Decode JSON text using the fastest backend available"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
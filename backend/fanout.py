@@ -0,0 +1,146 @@
+from typing import Callable, Deque, List, Optional, Tuple
+from collections import deque
+import asyncio
+import metrics
+
+# Recipient lists at least this long are handed to the delivery workers
+LARGE_GROUP_SIZE = 500
+# Recipients a worker serves before letting other tasks run
+SLICE_SIZE = 64
+
+# send(user_ids, payload, coalesce_key, exclude_user), e.g. ConnectionManager._send_local
+Send = Callable[[List[str], str, Optional[str], Optional[str]], None]
+
+
+class _Delivery:
+    """One large delivery, finished when every shard has served its part"""
+    __slots__ = ("payload", "coalesce_key", "started", "pending")
+
+    def __init__(self, payload: str, coalesce_key: Optional[str], started: float, pending: int):
+        self.payload = payload
+        self.coalesce_key = coalesce_key
+        self.started = started
+        self.pending = pending
+
+
+class ShardedFanout:
+    """Delivery workers for frames addressed to large groups.
+
+    A frame for ``threshold`` or more recipients is not delivered inline by
+    whoever published it. Recipients without a session on this worker are
+    skipped through the connection registry, the rest are split into
+    ``shards`` by a hash of their user id, and each shard's worker task
+    queues the frame for its recipients ``SLICE_SIZE`` at a time, yielding
+    to the event loop in between. Publishing into a 10k member group costs
+    the sender a registry lookup per member; handlers for small chats keep
+    running while the group is being served.
+
+    A recipient always lands on the same shard and each shard serves its
+    deliveries in order, so frames for one recipient keep the order they
+    were published in. Workers are tasks on the event loop, since client
+    queues belong to it; while they are not running deliveries go inline.
+    """
+    def __init__(self, shards: int = 4, threshold: int = LARGE_GROUP_SIZE, slice_size: int = SLICE_SIZE):
+        self.shards = max(shards, 1)
+        self.threshold = threshold
+        self.slice_size = slice_size
+        self._send: Optional[Send] = None
+        self._queues: List[Deque[Tuple[_Delivery, List[str]]]] = [deque() for _ in range(self.shards)]
+        self._wakeups: List[asyncio.Event] = []
+        self._tasks: List[asyncio.Task] = []
+
+        self.deliveries = 0
+        self.recipients = 0
+        self.skipped_offline = 0
+        self.completed = 0
+
+    def attach(self, send: Send):
+        """Register the callback that queues a frame for local recipients"""
+        self._send = send
+
+    def start(self):
+        loop = asyncio.get_event_loop()
+        self._wakeups = [asyncio.Event() for _ in range(self.shards)]
+        self._tasks = [loop.create_task(self._run(shard)) for shard in range(self.shards)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        for queue in self._queues:
+            queue.clear()
+
+    def accepts(self, user_ids: List[str]) -> bool:
+        return bool(self._tasks) and len(user_ids) >= self.threshold
+
+    def submit(
+        self,
+        user_ids: List[str],
+        payload: str,
+        coalesce_key: Optional[str],
+        exclude_user: Optional[str],
+        online: Callable[[str], bool]
+    ):
+        """Split a delivery across the shards; returns once it is queued"""
+        started = metrics.start()
+        parts: List[List[str]] = [[] for _ in range(self.shards)]
+        skipped = 0
+        for user_id in user_ids:
+            if user_id == exclude_user:
+                continue
+            if not online(user_id):
+                skipped += 1
+                continue
+            parts[hash(user_id) % self.shards].append(user_id)
+        self.deliveries += 1
+        self.skipped_offline += skipped
+        busy = [(shard, part) for shard, part in enumerate(parts) if part]
+        delivery = _Delivery(payload, coalesce_key, started, len(busy))
+        if not busy:
+            self._finish(delivery)
+            return
+        for shard, part in busy:
+            self._queues[shard].append((delivery, part))
+            self._wakeups[shard].set()
+
+    async def _run(self, shard: int):
+        queue = self._queues[shard]
+        wakeup = self._wakeups[shard]
+        while True:
+            if not queue:
+                wakeup.clear()
+                await wakeup.wait()
+                continue
+            delivery, user_ids = queue.popleft()
+            try:
+                for start in range(0, len(user_ids), self.slice_size):
+                    if start:
+                        await asyncio.sleep(0)
+                    self._send(user_ids[start:start + self.slice_size], delivery.payload, delivery.coalesce_key, None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error in fan-out shard {shard}: {e}")
+            self.recipients += len(user_ids)
+            delivery.pending -= 1
+            if delivery.pending == 0:
+                self._finish(delivery)
+
+    def _finish(self, delivery: _Delivery):
+        self.completed += 1
+        metrics.FANOUT.observe_since(delivery.started)
+
+    def backlog(self) -> int:
+        """Recipients still waiting across all shards"""
+        return sum(len(user_ids) for queue in self._queues for _, user_ids in queue)
+
+    def get_metrics(self) -> dict:
+        return {
+            "shards": self.shards,
+            "running": bool(self._tasks),
+            "deliveries": self.deliveries,
+            "completed": self.completed,
+            "recipients": self.recipients,
+            "skipped_offline": self.skipped_offline,
+            "backlog": self.backlog(),
+        }
@@ -0,0 +1,169 @@
+from typing import Any, Dict, List, Optional
+from concurrent.futures import Future
+import queue
+import threading
+import time
+import metrics
+
+# When a mutation counts as committed
+ACK_ON_ENQUEUE = "enqueue"  # as soon as it is queued
+ACK_ON_WRITE = "write"      # once its batch has been handed to the storage engine
+ACK_ON_FSYNC = "fsync"      # once its batch has been synced to stable storage
+DURABILITY_LEVELS = (ACK_ON_ENQUEUE, ACK_ON_WRITE, ACK_ON_FSYNC)
+
+_STOP = object()
+
+
+class CommitFailed(Exception):
+    """A mutation whose batch could not be committed"""
+
+
+class GroupCommitWriter:
+    """Collects storage mutations and commits them in batches on a background thread.
+
+    The writer thread takes the first queued mutation, then keeps collecting
+    for up to ``max_delay`` seconds or ``max_batch`` records and writes them
+    with one ``StorageEngine.write_batch`` call. Every mutation gets a future
+    that resolves once it is committed at the configured durability level.
+
+    A batch that fails is retried ``retries`` times, waiting ``retry_delay``
+    seconds and doubling the wait each time, so batches are never reordered
+    and a passing fault leaves no gap in storage. A batch that still fails
+    is given up: its futures fail with ``CommitFailed`` and it is counted
+    in ``failed``.
+    """
+    def __init__(
+        self,
+        storage,
+        durability: str = ACK_ON_WRITE,
+        max_delay: float = 0.002,
+        max_batch: int = 1000,
+        retries: int = 3,
+        retry_delay: float = 0.05
+    ):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"Unknown durability level: {durability}")
+        self.storage = storage
+        self.durability = durability
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.batches = 0
+        # Records submitted, and records the writer is done with; a record
+        # numbered n by ``submitted`` is settled once ``records >= n``, and
+        # readable from storage unless its batch was given up
+        self.submitted = 0
+        self.records = 0
+        # Records in batches given up after every retry failed
+        self.failed = 0
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._last: Future = self._done()
+        self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _done() -> Future:
+        future = Future()
+        future.set_result(None)
+        return future
+
+    def submit(self, op: str, **fields) -> Future:
+        """Queue a mutation; the future resolves when it is committed"""
+        fields["op"] = op
+        self.submitted += 1
+        if self.durability == ACK_ON_ENQUEUE:
+            future = self._done()
+            self._queue.put((fields, None))
+        else:
+            future = Future()
+            self._queue.put((fields, future))
+        self._last = future
+        return future
+
+    def committed(self) -> Future:
+        """Future for the most recent mutation; batches commit in order, so
+        it resolving means everything submitted before it is committed too"""
+        return self._last
+
+    def flush(self):
+        """Block until everything submitted so far is written and synced"""
+        future = Future()
+        self._queue.put((None, future))
+        future.result()
+
+    def close(self):
+        self.flush()
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _collect(self) -> List:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch and batch[-1] is not _STOP:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            stop = batch[-1] is _STOP
+            if stop:
+                batch.pop()
+
+            records: List[Dict[str, Any]] = []
+            futures: List[Future] = []
+            sync = self.durability == ACK_ON_FSYNC
+            for record, future in batch:
+                if record is None:
+                    # flush() barrier
+                    sync = True
+                else:
+                    records.append(record)
+                if future is not None:
+                    futures.append(future)
+
+            error = self._commit(records, sync)
+            for future in futures:
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(CommitFailed(f"Batch not committed: {error}"))
+            if stop:
+                return
+
+    def _commit(self, records: List[Dict[str, Any]], sync: bool) -> Optional[Exception]:
+        """Write and sync one batch, retrying on failure; returns the error if it was given up"""
+        written = not records
+        error: Optional[Exception] = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+            started = metrics.start()
+            try:
+                if not written:
+                    self.storage.write_batch(records)
+                    written = True
+                    self.batches += 1
+                    self.records += len(records)
+                    metrics.COMMIT_RECORDS.observe(len(records))
+                if sync:
+                    self.storage.sync()
+                metrics.COMMIT.observe_since(started)
+                return None
+            except Exception as e:
+                print(f"Error committing batch (attempt {attempt + 1} of {self.retries + 1}): {e}")
+                error = e
+        if not written:
+            # Still counted, or every later record would wait on these forever
+            self.records += len(records)
+            self.failed += len(records)
+        return error
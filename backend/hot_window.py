@@ -0,0 +1,177 @@
+from typing import Callable, Dict, List, Optional, Tuple
+from collections import OrderedDict
+import sys
+from models import Chat, Message, now_us
+
+# Estimated bytes a resident message costs besides its text: the slotted
+# object, its packed id and timestamp, and its slot in the window list
+# (benchmarks/bench_memory.py measures the real figure)
+MESSAGE_OVERHEAD = 200
+
+WindowLoader = Callable[[], Tuple[int, List[Message]]]
+
+
+def message_bytes(message: Message) -> int:
+    return MESSAGE_OVERHEAD + sys.getsizeof(message.text)
+
+
+class HotWindow:
+    """Bounds how many messages stay in memory, per chat and overall.
+
+    Each chat keeps at most ``max_messages`` recent messages and, with
+    ``max_age`` set, none older than that many seconds (the newest message
+    always stays); older ones are dropped from the front of the window and
+    read back from storage by history requests. Resident windows are kept
+    in LRU order, and once their estimated size passes ``budget_bytes`` the
+    least recently used chats are evicted whole; the next access faults the
+    window back in through ``window_loader``.
+
+    ``written(chat)`` is the position below which the chat's messages are
+    already in storage. Nothing at or past it leaves memory.
+    """
+    def __init__(
+        self,
+        written: Callable[[Chat], int],
+        window_loader: Callable[[Chat], WindowLoader],
+        max_messages: Optional[int] = 200,
+        max_age: Optional[float] = None,
+        budget_bytes: Optional[int] = None
+    ):
+        self.written = written
+        self.window_loader = window_loader
+        self.max_messages = max_messages
+        self.max_age = max_age
+        self.budget_bytes = budget_bytes
+        # chat_id -> chat with messages in memory, least recently used first
+        self._resident: "OrderedDict[str, Chat]" = OrderedDict()
+        self._bytes: Dict[str, int] = {}
+        self.resident_bytes = 0
+        self.resident_messages = 0
+        self.reads = 0
+        self.hits = 0
+        self.faults = 0
+        self.trimmed = 0
+        self.evicted_chats = 0
+        self.evicted_messages = 0
+
+    def _account(self, chat: Chat, messages: List[Message], sign: int):
+        size = sign * sum(message_bytes(message) for message in messages)
+        self._bytes[chat.chat_id] = self._bytes.get(chat.chat_id, 0) + size
+        self.resident_bytes += size
+        self.resident_messages += sign * len(messages)
+
+    def track(self, chat: Chat):
+        """Start accounting for a chat whose window is already in memory"""
+        if chat.messages_loaded and chat.chat_id not in self._resident:
+            self._resident[chat.chat_id] = chat
+            self._account(chat, chat.messages, 1)
+
+    def defer(self, chat: Chat, count: int, last_message_us: Optional[int], loader: WindowLoader):
+        """Leave a chat unloaded, counting its window once it is faulted in"""
+        def fault():
+            offset, messages = loader()
+            self.faults += 1
+            self._resident[chat.chat_id] = chat
+            self._account(chat, messages, 1)
+            self.enforce()
+            return offset, messages
+
+        chat.defer_messages(count, last_message_us, fault)
+
+    def touch(self, chat: Chat):
+        """Mark a chat most recently used and trim it to its window"""
+        if not chat.messages_loaded:
+            return
+        self.track(chat)
+        self._resident.move_to_end(chat.chat_id)
+        self.trim(chat)
+        self.enforce()
+
+    def added(self, chat: Chat, message: Message):
+        """Account for a message just appended to a chat"""
+        if chat.chat_id in self._resident:
+            self._account(chat, [message], 1)
+        else:
+            self.track(chat)
+        self.touch(chat)
+
+    def record_read(self, hit: bool):
+        self.reads += 1
+        if hit:
+            self.hits += 1
+
+    def trim(self, chat: Chat, now: Optional[int] = None):
+        """Drop messages past the chat's window that storage already holds"""
+        messages = chat.messages
+        drop = 0
+        if self.max_messages is not None:
+            drop = len(messages) - self.max_messages
+        if self.max_age is not None and len(messages) > 1:
+            cutoff = (now if now is not None else now_us()) - int(self.max_age * 1_000_000)
+            old = 0
+            while old < len(messages) - 1 and messages[old].timestamp_us < cutoff:
+                old += 1
+            drop = max(drop, old)
+        if drop <= 0:
+            return
+        position = min(chat.message_offset + drop, self.written(chat))
+        dropped = chat.evict_before(position)
+        if dropped:
+            self._account(chat, dropped, -1)
+            self.trimmed += len(dropped)
+
+    def sweep(self, now: Optional[int] = None):
+        """Apply ``max_age`` to every resident chat, including idle ones"""
+        if self.max_age is None:
+            return
+        now = now if now is not None else now_us()
+        for chat in list(self._resident.values()):
+            self.trim(chat, now)
+
+    def evict(self, chat: Chat) -> bool:
+        """Drop a chat's whole window; False while some of it is not in storage"""
+        if not chat.messages_loaded or self.written(chat) < chat.message_count:
+            return False
+        self.evicted_chats += 1
+        self.evicted_messages += len(chat.messages)
+        self._resident.pop(chat.chat_id, None)
+        size = self._bytes.pop(chat.chat_id, 0)
+        self.resident_bytes -= size
+        self.resident_messages -= len(chat.messages)
+        self.defer(chat, chat.message_count, chat.last_message_us, self.window_loader(chat))
+        return True
+
+    def enforce(self):
+        """Evict least recently used chats until the budget holds again.
+
+        The most recently used chat is never evicted, and chats with
+        messages still waiting for the writer are skipped.
+        """
+        if self.budget_bytes is None or self.resident_bytes <= self.budget_bytes:
+            return
+        victims = []
+        excess = self.resident_bytes - self.budget_bytes
+        newest = next(reversed(self._resident))
+        for chat_id, chat in self._resident.items():
+            if excess <= 0 or chat_id == newest:
+                break
+            if self.written(chat) >= chat.message_count:
+                victims.append(chat)
+                excess -= self._bytes.get(chat_id, 0)
+        for chat in victims:
+            self.evict(chat)
+
+    def get_stats(self) -> Dict[str, float]:
+        return {
+            "resident_chats": len(self._resident),
+            "resident_messages": self.resident_messages,
+            "resident_bytes": self.resident_bytes,
+            "budget_bytes": self.budget_bytes,
+            "reads": self.reads,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.reads if self.reads else 1.0,
+            "faults": self.faults,
+            "trimmed_messages": self.trimmed,
+            "evicted_chats": self.evicted_chats,
+            "evicted_messages": self.evicted_messages,
+        }
@@ -1,10 +1,30 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Dict, List
-import json
+from fastapi.responses import PlainTextResponse
+from typing import Dict, List, Optional, Tuple
 import asyncio
-from datetime import datetime
-import uuid
+import os
+import threading
+import metrics
+from metrics import INGEST, REGISTRY
+from profiler import SamplingProfiler
+from encoding import dumps
+from connection_manager import DEFAULT_QUEUE_SIZE, DROP_OLDEST, ConnectionManager
+from fanout import LARGE_GROUP_SIZE, ShardedFanout
+from backplane import create_backplane
+from async_chat_service import AsyncChatService, Outgoing
+from blob_store import BlobStore, OffsetMismatch, UploadError, UploadTooLarge
+from media import BlobResponse, MediaService
+from chat_service import SearchNotReady
+from group_commit import CommitFailed
+from chat_rpc import create_chat_service
+from models import from_epoch_us
+from presence import PresenceService
+from read_receipts import ReadReceipts
+from typing_indicators import TypingTracker
+from pagination import DEFAULT_PAGE_SIZE, parse_since
+from rate_limit import RateLimiter, SlowDown
+from wire import negotiate
 
 app = FastAPI()
 
@@ -17,185 +37,577 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Store active connections
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-        self.users: Dict[str, dict] = {}
-
-    async def connect(self, websocket: WebSocket, user_id: str):
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
-        self.users[user_id] = {
-            "id": user_id,
-            "name": user_id,
-            "avatar": f"https://i.pravatar.cc/150?u={user_id}",
-            "online": True
-        }
-
-    def disconnect(self, user_id: str):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
-        if user_id in self.users:
-            self.users[user_id]["online"] = False
-
-    async def send_personal_message(self, message: str, user_id: str):
-        if user_id in self.active_connections:
-            try:
-                await self.active_connections[user_id].send_text(message)
-            except:
-                self.disconnect(user_id)
+# Groups of LARGE_GROUP_SIZE or more members are delivered by sharded workers
+fanout = ShardedFanout(
+    shards=int(os.environ.get("FANOUT_SHARDS", 4)),
+    threshold=int(os.environ.get("LARGE_GROUP_SIZE", LARGE_GROUP_SIZE))
+)
+# Each connection's outbound queue, and what happens when a slow client fills it
+manager = ConnectionManager(
+    max_queue=int(os.environ.get("OUTBOUND_QUEUE_SIZE", DEFAULT_QUEUE_SIZE)),
+    overflow_policy=os.environ.get("OUTBOUND_OVERFLOW_POLICY", DROP_OLDEST).lower(),
+    backplane=create_backplane(os.environ.get("BACKPLANE_URL")),
+    fanout=fanout
+)
 
-    async def broadcast(self, message: str):
-        disconnected = []
-        for user_id, connection in self.active_connections.items():
-            try:
-                await connection.send_text(message)
-            except:
-                disconnected.append(user_id)
-        
-        for user_id in disconnected:
-            self.disconnect(user_id)
-
-manager = ConnectionManager()
-
-# Simple in-memory storage
-chats = {
-    "1": {
-        "id": "1",
-        "name": "Alice",
-        "type": "private",
-        "avatar": "https://i.pravatar.cc/150?img=1",
-        "participants": ["alice", "bob"],
-        "messages": [
-            {
-                "id": str(uuid.uuid4()),
-                "text": "Hey there!",
-                "sender": "alice",
-                "senderName": "Alice",
-                "time": "10:00 AM",
-                "timestamp": datetime.now().isoformat()
-            },
-            {
-                "id": str(uuid.uuid4()),
-                "text": "How are you doing?",
-                "sender": "bob",
-                "senderName": "Bob",
-                "time": "10:01 AM",
-                "timestamp": datetime.now().isoformat()
-            }
-        ]
-    },
-    "2": {
-        "id": "2",
-        "name": "Bob",
-        "type": "private",
-        "avatar": "https://i.pravatar.cc/150?img=2",
-        "participants": ["alice", "bob"],
-        "messages": [
-            {
-                "id": str(uuid.uuid4()),
-                "text": "Meeting at 3?",
-                "sender": "bob",
-                "senderName": "Bob",
-                "time": "10:02 AM",
-                "timestamp": datetime.now().isoformat()
-            }
-        ]
-    },
-    "3": {
-        "id": "3",
-        "name": "Team Project",
-        "type": "group",
-        "avatar": "https://i.pravatar.cc/150?img=5",
-        "participants": ["alice", "bob", "charlie", "diana"],
-        "messages": [
-            {
-                "id": str(uuid.uuid4()),
-                "text": "Let's start the call!",
-                "sender": "alice",
-                "senderName": "Alice",
-                "time": "09:00 AM",
-                "timestamp": datetime.now().isoformat()
-            },
-            {
-                "id": str(uuid.uuid4()),
-                "text": "Joining in 5 mins",
-                "sender": "charlie",
-                "senderName": "Charlie",
-                "time": "09:01 AM",
-                "timestamp": datetime.now().isoformat()
-            }
-        ]
-    }
+# Most messages accepted in one send_messages frame
+MAX_BATCH_MESSAGES = 100
+
+# Fields each inbound event must carry, and their types
+EVENT_FIELDS = {
+    "send_message": {"chat_id": str},
+    "send_messages": {"messages": list},
+    "typing": {"chat_id": str},
+    "mark_read": {"chat_id": str},
+    "load_history": {"chat_id": str},
 }
 
+def validate_event(message_data) -> Optional[str]:
+    """Why an inbound frame cannot be handled, or None if it can"""
+    if not isinstance(message_data, dict) or not isinstance(message_data.get("type"), str):
+        return "Frames must be objects with a string type"
+    for name, kind in EVENT_FIELDS.get(message_data["type"], {}).items():
+        if not isinstance(message_data.get(name), kind):
+            return f"{message_data['type']} needs a {kind.__name__} {name}"
+    if not isinstance(message_data.get("text", ""), str):
+        return "text must be a string"
+    if message_data["type"] == "load_history":
+        limit = message_data.get("limit", DEFAULT_PAGE_SIZE)
+        if not isinstance(limit, int) or isinstance(limit, bool):
+            return "load_history needs an int limit"
+        for name in ("before", "after"):
+            if message_data.get(name) is not None and not isinstance(message_data[name], str):
+                return f"load_history needs a str {name}"
+    return None
+
+# Token buckets per user and per chat, checked before each inbound event is handled
+rate_limiter = RateLimiter.from_env()
+
+def event_cost(message_data: dict) -> Tuple[int, Dict[str, int]]:
+    """Tokens an inbound event costs its sender, and messages it adds per chat"""
+    if message_data.get("type") == "send_message":
+        chat_id = message_data.get("chat_id")
+        return 1, {chat_id: 1} if chat_id else {}
+    if message_data.get("type") == "send_messages":
+        chats: Dict[str, int] = {}
+        items = message_data.get("messages", [])[:MAX_BATCH_MESSAGES]
+        for item in items:
+            if isinstance(item, dict) and isinstance(item.get("chat_id"), str):
+                chats[item["chat_id"]] = chats.get(item["chat_id"], 0) + 1
+        return max(len(items), 1), chats
+    return 1, {}
+
+# Chats, users and messages, persisted by the storage engine. The service runs
+# on its own thread, or with CHAT_SERVICE_URL in a chat service process every
+# worker shares; handlers reach it only through the async facade.
+chat_service = create_chat_service(os.environ.get("CHAT_SERVICE_URL"))
+
+# Uploaded media, content-addressed on local disk; messages only reference it
+media = MediaService(BlobStore(os.environ.get("MEDIA_ROOT", "media")))
+# Bytes buffered from an upload request before each write to disk
+UPLOAD_WRITE_BYTES = 1024 * 1024
+
+def record_last_seen(user_id: str, online: bool, last_seen_us: int):
+    user = manager.users.get(user_id)
+    if user is not None:
+        user["last_seen"] = from_epoch_us(last_seen_us).isoformat()
+    chat_service.record_presence(user_id, online, last_seen_us)
+
+def forget_contacts(user_id: str):
+    # A user who reconnected meanwhile has joined again and keeps them
+    if not manager.is_user_online(user_id):
+        chat_service.leave_user(user_id)
+
+# Presence goes only to contacts, debounced and batched into periodic digests
+presence = PresenceService(
+    manager.broadcast_to_users,
+    chat_service.contacts,
+    on_change=record_last_seen,
+    on_offline=forget_contacts
+)
+
+# Typing indicators for the connected participants of each chat
+typing_tracker = TypingTracker(manager.broadcast_to_users)
+
+# Read watermarks fan out as one coalesced frame per chat per interval
+read_receipts = ReadReceipts(manager.broadcast_to_users)
+
+# Sampling profiler for the event loop, toggled through the debug endpoints
+profiler = SamplingProfiler()
+DEBUG_ENDPOINTS = os.environ.get("ENABLE_DEBUG_ENDPOINTS", "").lower() in ("1", "true", "yes")
+
+# Values other components already keep, read when /metrics is scraped
+OUTBOUND_COUNTERS = {
+    "enqueued": "Frames handed to outbound queues",
+    "sent": "Events written to client sockets",
+    "frames": "Frames written to client sockets",
+    "dropped": "Frames dropped by the overflow policy",
+    "coalesced": "Queued frames replaced by a newer one with the same key",
+    "slow_disconnects": "Connections closed for falling behind",
+}
+for name, help_text in OUTBOUND_COUNTERS.items():
+    REGISTRY.callback(
+        "counter", f"chat_outbound_{name}_total", help_text,
+        lambda name=name: getattr(manager.metrics, name)
+    )
+REGISTRY.callback(
+    "counter", "chat_backplane_dropped_total", "Deliveries dropped because the backplane was unreachable or behind",
+    lambda: manager.backplane.dropped
+)
+REGISTRY.callback(
+    "gauge", "chat_connections", "Open websocket sessions on this worker",
+    lambda: manager.get_connection_count()
+)
+REGISTRY.callback(
+    "gauge", "chat_connected_users", "Users with at least one open session on this worker",
+    lambda: len(manager.active_connections)
+)
+REGISTRY.callback(
+    "gauge", "chat_queue_depth", "Frames waiting across all outbound queues",
+    lambda: manager.get_metrics()["queue_depth_total"]
+)
+REGISTRY.callback(
+    "gauge", "chat_queue_depth_max", "Frames waiting in the fullest outbound queue",
+    lambda: manager.get_metrics()["queue_depth_max"]
+)
+REGISTRY.callback(
+    "gauge", "chat_presence_online", "Users online on this worker",
+    lambda: presence.get_metrics()["online"]
+)
+REGISTRY.callback(
+    "gauge", "chat_typing_timers", "Typing indicators waiting to expire",
+    lambda: len(typing_tracker.wheel)
+)
+REGISTRY.callback(
+    "counter", "chat_fanout_deliveries_total", "Large-group frames handed to the delivery workers",
+    lambda: fanout.deliveries
+)
+REGISTRY.callback(
+    "counter", "chat_fanout_skipped_offline_total", "Large-group recipients skipped for having no session here",
+    lambda: fanout.skipped_offline
+)
+REGISTRY.callback(
+    "gauge", "chat_fanout_backlog", "Recipients waiting in the delivery workers' queues",
+    lambda: fanout.backlog()
+)
+REGISTRY.callback(
+    "counter", "chat_read_receipts_total", "Read watermarks moved by mark_read",
+    lambda: read_receipts.received
+)
+REGISTRY.callback(
+    "counter", "chat_read_receipt_frames_total", "Coalesced read_receipts frames published",
+    lambda: read_receipts.published
+)
+REGISTRY.callback(
+    "counter", "chat_rate_limit_admitted_total", "Inbound events that passed the rate limiter",
+    lambda: rate_limiter.admitted
+)
+REGISTRY.callback(
+    "counter", "chat_rate_limit_paused_total", "Inbound events delayed by pausing reads",
+    lambda: rate_limiter.paused
+)
+REGISTRY.callback(
+    "counter", "chat_rate_limit_pause_seconds_total", "Time receive loops spent paused for the rate limiter",
+    lambda: rate_limiter.paused_seconds
+)
+for scope in ("user", "chat"):
+    REGISTRY.callback(
+        "counter", "chat_rate_limit_rejected_total", "Inbound events refused with slow_down",
+        lambda scope=scope: rate_limiter.rejected[scope], {"scope": scope}
+    )
+# Service internals are only readable when the service runs in this process
+if isinstance(chat_service, AsyncChatService):
+    REGISTRY.callback(
+        "gauge", "chat_search_documents", "Messages in the search index",
+        lambda: len(chat_service.service.search_index)
+    )
+    REGISTRY.callback(
+        "gauge", "chat_hot_window_bytes", "Estimated bytes of messages held in memory",
+        lambda: chat_service.service.hot_window.resident_bytes
+    )
+    REGISTRY.callback(
+        "counter", "chat_hot_window_faults_total", "Evicted chat windows read back from storage",
+        lambda: chat_service.service.hot_window.faults
+    )
+    REGISTRY.callback(
+        "counter", "chat_hot_window_evictions_total", "Chat windows evicted to stay within the memory budget",
+        lambda: chat_service.service.hot_window.evicted_chats
+    )
+
+loop_lag_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_backplane():
+    global loop_lag_task
+    await chat_service.start()
+    await manager.backplane.start()
+    fanout.start()
+    presence.start()
+    typing_tracker.start()
+    read_receipts.start()
+    loop_lag_task = asyncio.get_event_loop().create_task(metrics.watch_loop_lag())
+
+@app.on_event("shutdown")
+async def stop_backplane():
+    profiler.stop()
+    if loop_lag_task is not None:
+        loop_lag_task.cancel()
+    await presence.stop()
+    await typing_tracker.stop()
+    await read_receipts.stop()
+    # Stopped first, so the final flush is delivered inline
+    await fanout.stop()
+    read_receipts.flush()
+    await manager.backplane.stop()
+    await chat_service.close()
+    media.close()
+
 @app.get("/")
 async def root():
     return {"message": "Chat Backend Running"}
 
+@app.get("/api/health")
+async def health():
+    return {
+        "status": "ok",
+        "connections": manager.get_metrics(),
+        "fanout": fanout.get_metrics(),
+        "presence": presence.get_metrics(),
+        "typing": typing_tracker.get_metrics(),
+        "read_receipts": read_receipts.get_metrics(),
+        "rate_limit": rate_limiter.get_metrics(),
+        "storage": await chat_service.get_stats(),
+        "media": media.get_stats(),
+        "loop_lag_ms": metrics.last_loop_lag * 1000
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+def require_debug_endpoints():
+    if not DEBUG_ENDPOINTS:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+@app.post("/api/debug/metrics")
+async def toggle_metrics(enabled: bool):
+    require_debug_endpoints()
+    metrics.set_enabled(enabled)
+    return {"enabled": metrics.enabled()}
+
+@app.post("/api/debug/profiler")
+async def toggle_profiler(enabled: bool, interval_ms: float = 5.0):
+    require_debug_endpoints()
+    if enabled:
+        # Handlers run on the event loop thread, which is the one to sample
+        profiler.start(max(interval_ms, 1.0) / 1000, thread_id=threading.get_ident())
+    else:
+        profiler.stop()
+    return profiler.status()
+
+@app.get("/api/debug/profiler")
+async def profiler_report(limit: int = 200):
+    require_debug_endpoints()
+    return PlainTextResponse(profiler.report(limit))
+
+@app.get("/api/chats/{chat_id}/messages")
+async def get_chat_messages(
+    chat_id: str,
+    user_id: str,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE
+):
+    try:
+        page = await chat_service.history(user_id, chat_id, before, after, limit)
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page is None:
+        raise HTTPException(status_code=404, detail="Chat not found")
+    return page
+
+@app.get("/api/search")
+async def search(
+    user_id: str,
+    q: str,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE
+):
+    try:
+        return await chat_service.search(user_id, q, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SearchNotReady as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+@app.post("/api/uploads")
+async def begin_upload(user_id: str, filename: str = "file", content_type: str = "application/octet-stream"):
+    session = await media.begin(user_id, filename, content_type)
+    return session.to_dict()
+
+def find_upload(upload_id: str, user_id: str):
+    try:
+        return media.upload(upload_id, user_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+
+@app.get("/api/uploads/{upload_id}")
+async def upload_status(upload_id: str, user_id: str):
+    """Where an interrupted upload should resume"""
+    return find_upload(upload_id, user_id).to_dict()
+
+@app.put("/api/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, user_id: str, offset: int, request: Request):
+    """Append the request body at ``offset``, streamed to disk as it arrives"""
+    session = find_upload(upload_id, user_id)
+    buffer = bytearray()
+    try:
+        async for chunk in request.stream():
+            buffer += chunk
+            if len(buffer) >= UPLOAD_WRITE_BYTES:
+                offset = await media.append(upload_id, offset, bytes(buffer))
+                buffer.clear()
+        if buffer:
+            offset = await media.append(upload_id, offset, bytes(buffer))
+    except OffsetMismatch as e:
+        # The client resumes from the offset in the message
+        raise HTTPException(status_code=409, detail=str(e))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return session.to_dict()
+
+@app.post("/api/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str, user_id: str):
+    """Store the upload as a blob; the returned blob_id goes into a message's attachment"""
+    find_upload(upload_id, user_id)
+    try:
+        return await media.complete(upload_id)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+@app.api_route("/api/media/{blob_id}", methods=["GET", "HEAD"])
+async def download_media(blob_id: str, request: Request):
+    metadata = await media.describe(blob_id)
+    if metadata is None:
+        raise HTTPException(status_code=404, detail="Media not found")
+    return BlobResponse(
+        media.store.path(blob_id),
+        metadata,
+        request.headers.get("range"),
+        request.headers.get("if-none-match")
+    )
+
 @app.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
-    await manager.connect(websocket, user_id)
+    # Clients that understand "events" frames may opt in to outbound coalescing
+    try:
+        coalesce_window = float(websocket.query_params.get("coalesce_ms", 0)) / 1000
+    except ValueError:
+        coalesce_window = 0.0
+    # JSON text frames unless the client asks for ?encoding=msgpack
+    try:
+        codec = negotiate(
+            websocket.query_params.get("encoding"),
+            websocket.query_params.get("deflate", "").lower() in ("1", "true", "yes")
+        )
+    except ValueError as e:
+        print(f"Error negotiating encoding for {user_id}: {e}")
+        await websocket.close(code=1003)
+        return
+    # Further devices and tabs join as extra sessions of an online user
+    first_session = not manager.is_user_online(user_id)
+    connection = await manager.connect(websocket, user_id, coalesce_window, codec)
     
     try:
-        # Send initial data
-        user_chats = []
-        for chat_id, chat in chats.items():
-            if user_id in chat["participants"]:
-                user_chats.append(chat)
-        
-        await websocket.send_text(json.dumps({
-            "type": "initial_data",
-            "chats": user_chats,
-            "user": manager.users[user_id]
-        }))
+        chat_ids = await chat_service.join_user(user_id)
+        since = parse_since(websocket.query_params.get("since"))
+        if since is not None:
+            # Reconnect: only send what the client missed
+            sync = await chat_service.sync_delta(user_id, since)
+            sync.update({
+                "type": "sync",
+                "user": manager.users[user_id],
+                "online_users": presence.online_contacts(user_id)
+            })
+            connection.send(dumps(sync))
+        else:
+            # Send initial data
+            connection.send(dumps({
+                "type": "initial_data",
+                "chats": await chat_service.chat_summaries(user_id),
+                "online_users": presence.online_contacts(user_id),
+                "user": manager.users[user_id]
+            }))
         
-        # Broadcast user online status
-        await manager.broadcast(json.dumps({
-            "type": "user_online",
-            "user": manager.users[user_id]
-        }))
+        if first_session:
+            # Contacts hear about it in the next presence digest
+            presence.connected(user_id, manager.users[user_id])
+            typing_tracker.join(user_id, chat_ids)
         
         while True:
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
+            data = await websocket.receive()
+            received = metrics.start()
+            if data["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(data.get("code", 1000))
+            try:
+                message_data = codec.decode(data["bytes"] if data.get("bytes") is not None else data["text"])
+            except Exception as e:
+                # JSON, MessagePack or deflate errors; the connection stays usable
+                connection.send(dumps({"type": "error", "message": f"Malformed frame: {e}"}))
+                continue
+            INGEST["decode"].observe_since(received)
+            problem = validate_event(message_data)
+            if problem is not None:
+                connection.send(dumps({"type": "error", "message": problem}))
+                continue
+            
+            # Typing frames, starts and stops included, are throttled per (chat, user)
+            # by the tracker and a keystroke costs one dict write
+            if message_data["type"] != "typing":
+                cost, chats = event_cost(message_data)
+                try:
+                    delay = rate_limiter.reserve(user_id, cost, chats)
+                except SlowDown as e:
+                    # Refused, not dropped: the client hears when to send it again
+                    connection.send(dumps({
+                        "type": "slow_down",
+                        "scope": e.scope,
+                        "chat_id": e.chat_id,
+                        "event": message_data["type"],
+                        "retry_after_ms": int(e.retry_after * 1000) + 1
+                    }))
+                    continue
+                if delay > 0:
+                    # Stop reading this socket until the buckets catch up
+                    await asyncio.sleep(delay)
+                    received = metrics.start()
             
             if message_data["type"] == "send_message":
                 chat_id = message_data["chat_id"]
-                text = message_data["text"]
+                attachment = None
+                if message_data.get("attachment") is not None:
+                    try:
+                        attachment = await media.attachment(message_data["attachment"])
+                    except ValueError as e:
+                        connection.send(dumps({"type": "error", "message": str(e)}))
+                        continue
                 
-                if chat_id in chats:
-                    # Create new message
-                    new_message = {
-                        "id": str(uuid.uuid4()),
-                        "text": text,
-                        "sender": user_id,
-                        "senderName": manager.users[user_id]["name"],
-                        "time": datetime.now().strftime("%I:%M %p"),
-                        "timestamp": datetime.now().isoformat()
-                    }
+                # Stored on the service thread, which times the store and persist stages
+                try:
+                    sent = await chat_service.send_message(
+                        user_id, chat_id, message_data.get("text", ""), attachment
+                    )
+                except (PermissionError, CommitFailed) as e:
+                    connection.send(dumps({"type": "error", "message": str(e)}))
+                    continue
+                if sent is not None:
+                    message, participants = sent
+                    typing_tracker.clear(chat_id, user_id)
                     
-                    # Add to chat
-                    chats[chat_id]["messages"].append(new_message)
-                    
-                    # Broadcast to all participants
-                    for participant in chats[chat_id]["participants"]:
-                        await manager.send_personal_message(
-                            json.dumps({
-                                "type": "new_message",
-                                "chat_id": chat_id,
-                                "message": new_message
-                            }),
-                            participant
+                    # Encode once, then hand the same frame to every participant
+                    started = metrics.start()
+                    payload = dumps({
+                        "type": "new_message",
+                        "chat_id": chat_id,
+                        "message": message
+                    })
+                    INGEST["encode"].observe_since(started)
+                    started = metrics.start()
+                    manager.broadcast_to_users(payload, participants)
+                    INGEST["fanout"].observe_since(started)
+                    INGEST["total"].observe_since(received)
+            
+            elif message_data["type"] == "send_messages":
+                # Batch of messages, e.g. pasted multi-line input or a bot burst
+                by_chat: Dict[str, List[Outgoing]] = {}
+                for item in message_data["messages"][:MAX_BATCH_MESSAGES]:
+                    if (
+                        not isinstance(item, dict)
+                        or not isinstance(item.get("chat_id"), str)
+                        or not isinstance(item.get("text", ""), str)
+                        or ("text" not in item and "attachment" not in item)
+                    ):
+                        continue
+                    attachment = None
+                    if item.get("attachment") is not None:
+                        try:
+                            attachment = await media.attachment(item["attachment"])
+                        except ValueError:
+                            continue
+                    by_chat.setdefault(item["chat_id"], []).append((item.get("text", ""), attachment))
+                
+                try:
+                    sent_batch = await chat_service.send_messages(user_id, by_chat)
+                except (PermissionError, CommitFailed) as e:
+                    connection.send(dumps({"type": "error", "message": str(e)}))
+                    continue
+                for chat_id, messages, participants in sent_batch:
+                    typing_tracker.clear(chat_id, user_id)
+                    # One frame per message; connections that opted in batch them
+                    for message in messages:
+                        manager.broadcast_to_users(
+                            dumps({"type": "new_message", "chat_id": chat_id, "message": message}),
+                            participants
                         )
+                INGEST["total"].observe_since(received)
+            
+            elif message_data["type"] == "typing":
+                typing_tracker.typing(
+                    message_data["chat_id"],
+                    user_id,
+                    bool(message_data.get("is_typing", True))
+                )
+            
+            elif message_data["type"] == "mark_read":
+                try:
+                    seq = int(message_data["seq"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                moved = await chat_service.mark_read(user_id, message_data["chat_id"], seq)
+                if moved is not None:
+                    read_receipts.record(message_data["chat_id"], user_id, *moved)
+            
+            elif message_data["type"] == "load_history":
+                try:
+                    page = await chat_service.history(
+                        user_id,
+                        message_data["chat_id"],
+                        before=message_data.get("before"),
+                        after=message_data.get("after"),
+                        limit=message_data.get("limit", DEFAULT_PAGE_SIZE)
+                    )
+                except (PermissionError, ValueError) as e:
+                    connection.send(dumps({
+                        "type": "error",
+                        "message": str(e)
+                    }))
+                else:
+                    if page is None:
+                        connection.send(dumps({"type": "error", "message": "Unknown chat"}))
+                    else:
+                        page["type"] = "history"
+                        connection.send(dumps(page))
             
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
-        await manager.broadcast(json.dumps({
-            "type": "user_offline",
-            "user_id": user_id
-        }))
+        pass
+    except Exception as e:
+        print(f"Error handling websocket for {user_id}: {e}")
+        connection.close(code=1011)
+    finally:
+        # Runs however the session ends, or the user would stay online forever
+        manager.disconnect(connection)
+        # Offline only once the user's last session is gone
+        if not manager.is_user_online(user_id) and presence.is_online(user_id):
+            presence.disconnected(user_id)
+            typing_tracker.leave(user_id, await chat_service.chat_ids(user_id))
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,318 @@
+from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import asyncio
+import io
+import multiprocessing
+import os
+import struct
+from blob_store import BlobStore, UploadSession
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - optional thumbnails
+    Image = None
+
+# Longest side of generated thumbnails
+THUMBNAIL_SIZE = 320
+# Bytes read to sniff a file's type and image dimensions
+SNIFF_BYTES = 64 * 1024
+# Chunk size when a download cannot use zero-copy sends
+READ_CHUNK = 256 * 1024
+
+# Content types browsers may render inline; everything else is an attachment
+INLINE_TYPES = ("image/png", "image/jpeg", "image/gif", "image/webp", "video/", "audio/")
+
+
+def _jpeg_size(head: bytes) -> Optional[Tuple[int, int]]:
+    position = 2
+    while position + 9 < len(head):
+        if head[position] != 0xFF:
+            return None
+        marker = head[position + 1]
+        length = struct.unpack(">H", head[position + 2:position + 4])[0]
+        # Start-of-frame markers, excluding DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", head[position + 5:position + 9])
+            return width, height
+        position += 2 + length
+    return None
+
+
+def _webp_size(head: bytes) -> Optional[Tuple[int, int]]:
+    chunk = head[12:16]
+    if chunk == b"VP8 " and len(head) >= 30:
+        width, height = struct.unpack("<HH", head[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and len(head) >= 25:
+        bits = int.from_bytes(head[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X" and len(head) >= 30:
+        return int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1
+    return None
+
+
+def sniff_image(head: bytes) -> Tuple[Optional[str], Optional[Tuple[int, int]]]:
+    """The image type and (width, height) from a file's first bytes, if it is one we know"""
+    if head.startswith(b"\x89PNG\r\n\x1a\n") and len(head) >= 24:
+        return "image/png", struct.unpack(">II", head[16:24])
+    if head.startswith((b"GIF87a", b"GIF89a")) and len(head) >= 10:
+        return "image/gif", struct.unpack("<HH", head[6:10])
+    if head.startswith(b"\xff\xd8"):
+        return "image/jpeg", _jpeg_size(head)
+    if head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+        return "image/webp", _webp_size(head)
+    return None, None
+
+
+def extract_metadata(path: str, content_type: str) -> Dict[str, Any]:
+    """Sniff an uploaded file and build a thumbnail for images.
+
+    Runs in a worker process. Returns the detected content type, image
+    dimensions, and JPEG thumbnail bytes when Pillow is installed.
+    """
+    with open(path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+    image_type, size = sniff_image(head)
+    metadata: Dict[str, Any] = {}
+    if image_type is None:
+        # Never trust a client claiming an image we cannot recognise
+        if content_type.startswith("image/"):
+            metadata["content_type"] = "application/octet-stream"
+        return metadata
+    metadata["content_type"] = image_type
+    if size is not None:
+        metadata["width"], metadata["height"] = size
+    if Image is not None:
+        try:
+            with Image.open(path) as image:
+                image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+                out = io.BytesIO()
+                image.convert("RGB").save(out, "JPEG", quality=80)
+                metadata["thumbnail"] = out.getvalue()
+        except Exception as e:
+            print(f"Error building thumbnail for {path}: {e}")
+    return metadata
+
+
+def attachment_from(metadata: Dict[str, Any], name: Optional[str]) -> Dict[str, Any]:
+    """What a message stores about its blob"""
+    attachment = {
+        "blob_id": metadata["blob_id"],
+        "name": os.path.basename(name or metadata.get("filename") or "file"),
+        "size": metadata["size"],
+        "content_type": metadata["content_type"],
+    }
+    for key in ("width", "height", "thumbnail_id"):
+        if key in metadata:
+            attachment[key] = metadata[key]
+    return attachment
+
+
+class MediaService:
+    """Async facade over the blob store for the server.
+
+    File reads and writes run on a small thread pool so the event loop
+    never waits on disk. Metadata extraction and thumbnailing are CPU work
+    and run in a process pool, started with ``spawn`` because the server
+    process already has threads running.
+    """
+    def __init__(self, store: BlobStore, io_threads: int = 4, processes: int = 2):
+        self.store = store
+        self._io = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix="media-io")
+        self._processes = processes
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.extracted = 0
+        self.thumbnails = 0
+
+    async def _io_call(self, fn, *args):
+        return await asyncio.get_event_loop().run_in_executor(self._io, fn, *args)
+
+    def _process_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self._processes,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._io.shutdown(wait=False)
+
+    async def begin(self, user_id: str, filename: str, content_type: str) -> UploadSession:
+        return await self._io_call(self.store.begin, user_id, filename, content_type)
+
+    def upload(self, upload_id: str, user_id: str) -> UploadSession:
+        """A user's upload in progress; KeyError if unknown, PermissionError if someone else's"""
+        session = self.store.upload(upload_id)
+        if session is None:
+            raise KeyError(upload_id)
+        if session.user_id != user_id:
+            raise PermissionError("Not your upload")
+        return session
+
+    async def append(self, upload_id: str, offset: int, data: bytes) -> int:
+        return await self._io_call(self.store.append, upload_id, offset, data)
+
+    async def complete(self, upload_id: str) -> Dict[str, Any]:
+        """Commit an upload, then extract metadata for content not seen before"""
+        metadata = await self._io_call(self.store.commit, upload_id)
+        if metadata["deduplicated"]:
+            return metadata
+        path = self.store.path(metadata["blob_id"])
+        extracted = await asyncio.get_event_loop().run_in_executor(
+            self._process_pool(), extract_metadata, path, metadata["content_type"]
+        )
+        self.extracted += 1
+        thumbnail = extracted.pop("thumbnail", None)
+        if thumbnail is not None:
+            extracted["thumbnail_id"] = await self._io_call(self.store.put, thumbnail, "image/jpeg")
+            self.thumbnails += 1
+        if extracted:
+            deduplicated = metadata.pop("deduplicated")
+            metadata.update(extracted)
+            await self._io_call(self.store.write_metadata, metadata["blob_id"], metadata)
+            metadata["deduplicated"] = deduplicated
+        return metadata
+
+    async def describe(self, blob_id: str) -> Optional[Dict[str, Any]]:
+        if not self.store.valid_id(blob_id):
+            return None
+        return await self._io_call(self.store.describe, blob_id)
+
+    async def attachment(self, reference: Any) -> Dict[str, Any]:
+        """Resolve a client's ``{"blob_id", "name"}`` to a message attachment.
+
+        Raises ValueError for a malformed reference or an unknown blob.
+        """
+        if not isinstance(reference, dict) or not isinstance(reference.get("blob_id"), str):
+            raise ValueError("Attachments need a blob_id")
+        metadata = await self.describe(reference["blob_id"])
+        if metadata is None:
+            raise ValueError("Unknown blob")
+        return attachment_from(metadata, reference.get("name"))
+
+    def get_stats(self) -> Dict[str, int]:
+        stats = self.store.get_stats()
+        stats.update({"extracted": self.extracted, "thumbnails": self.thumbnails})
+        return stats
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """The inclusive byte range a single-range ``Range`` header asks for.
+
+    Returns None to serve the whole file (no header, or one we do not
+    support such as multiple ranges) and raises ValueError when the range
+    cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(size - int(end_text), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+class BlobResponse(Response):
+    """Serve a stored blob with range request support.
+
+    When the ASGI server offers the ``http.response.zerocopysend``
+    extension, file contents go to the socket without passing through
+    Python; otherwise they are read in ``READ_CHUNK`` pieces on a worker
+    thread. Blobs are immutable, so the blob id is a strong ETag and
+    responses may be cached forever.
+    """
+    def __init__(self, path: str, metadata: Dict[str, Any], range_header: Optional[str], etag_match: Optional[str]):
+        # Status and headers depend on the request; they are sent from __call__
+        super().__init__()
+        self.path = path
+        self.metadata = metadata
+        self.range_header = range_header
+        self.etag_match = etag_match
+
+    def _headers(self, status: int, length: int, extra: List[Tuple[str, str]]) -> List[Tuple[bytes, bytes]]:
+        content_type = self.metadata["content_type"]
+        inline = content_type.startswith(INLINE_TYPES)
+        headers = [
+            ("content-type", content_type if inline else "application/octet-stream"),
+            ("content-length", str(length)),
+            ("accept-ranges", "bytes"),
+            ("etag", f'"{self.metadata["blob_id"]}"'),
+            ("cache-control", "public, max-age=31536000, immutable"),
+            ("x-content-type-options", "nosniff"),
+        ]
+        if not inline:
+            headers.append(("content-disposition", "attachment"))
+        headers.extend(extra)
+        return [(name.encode(), value.encode()) for name, value in headers]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await self._send_blob(scope, send)
+        if self.background is not None:
+            await self.background()
+
+    async def _send_blob(self, scope: Scope, send: Send):
+        size = self.metadata["size"]
+        if self.etag_match and self.etag_match.strip('"') == self.metadata["blob_id"]:
+            await send({"type": "http.response.start", "status": 304, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+            return
+        try:
+            byte_range = parse_range(self.range_header, size)
+        except ValueError:
+            await send({
+                "type": "http.response.start",
+                "status": 416,
+                "headers": [(b"content-range", f"bytes */{size}".encode())],
+            })
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if byte_range is None:
+            start, end, status, extra = 0, size - 1, 200, []
+        else:
+            start, end = byte_range
+            status, extra = 206, [("content-range", f"bytes {start}-{end}/{size}")]
+        length = end - start + 1
+        await send({"type": "http.response.start", "status": status, "headers": self._headers(status, length, extra)})
+        if scope["method"] == "HEAD" or length <= 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        loop = asyncio.get_event_loop()
+        fd = await loop.run_in_executor(None, os.open, self.path, os.O_RDONLY)
+        try:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                with os.fdopen(fd, "rb", closefd=False) as file:
+                    await send({
+                        "type": "http.response.zerocopysend",
+                        "file": file,
+                        "offset": start,
+                        "count": length,
+                    })
+                return
+            position = start
+            while position <= end:
+                chunk = await loop.run_in_executor(None, os.pread, fd, min(READ_CHUNK, end - position + 1), position)
+                if not chunk:
+                    break
+                position += len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": position <= end})
+            if position <= end:
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            os.close(fd)
@@ -0,0 +1,226 @@
+"""Built-in instrumentation rendered in the Prometheus text format.
+
+Hot paths time themselves with ``started = metrics.start()`` and
+``HISTOGRAM.observe_since(started)``. While metrics are disabled ``start``
+returns 0 and ``observe_since`` returns immediately, so the cost is one call
+and one comparison. Counters and gauges that already live elsewhere (queue
+depths, drop counts) are registered as callbacks and read only when
+``/metrics`` is scraped.
+
+Set ``METRICS_ENABLED=0`` to switch timing off; ``set_enabled`` flips it at
+runtime.
+"""
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import bisect
+import os
+import time
+
+# Seconds; from 50us to 5s
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+_enabled = os.environ.get("METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def set_enabled(value: bool):
+    global _enabled
+    _enabled = value
+
+
+def start() -> float:
+    """Start a timing; 0.0 while metrics are disabled"""
+    return time.perf_counter() if _enabled else 0.0
+
+
+def _format_labels(labels: Dict[str, str], extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels.items())
+    if extra is not None:
+        items.append(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Histogram:
+    """Cumulative-bucket histogram for one label set"""
+    def __init__(self, name: str, labels: Dict[str, str], buckets: Sequence[float]):
+        self.name = name
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        if not _enabled:
+            return
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def observe_since(self, started: float):
+        """Record the time since ``start()``; a no-op for timings started while disabled"""
+        if started:
+            self.observe(time.perf_counter() - started)
+
+    def render(self) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            lines.append(
+                f"{self.name}_bucket{_format_labels(self.labels, ('le', _format_value(bound)))} {cumulative}"
+            )
+        lines.append(f"{self.name}_sum{_format_labels(self.labels)} {_format_value(self.sum)}")
+        lines.append(f"{self.name}_count{_format_labels(self.labels)} {self.count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, labels: Dict[str, str]):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        if _enabled:
+            self.value += amount
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels)} {_format_value(self.value)}"]
+
+
+class _Callback:
+    """A counter or gauge whose value is read from elsewhere at scrape time"""
+    def __init__(self, name: str, labels: Dict[str, str], read: Callable[[], float]):
+        self.name = name
+        self.labels = labels
+        self.read = read
+
+    def render(self) -> List[str]:
+        try:
+            value = self.read()
+        except Exception as e:
+            print(f"Error reading metric {self.name}: {e}")
+            return []
+        return [f"{self.name}{_format_labels(self.labels)} {_format_value(value)}"]
+
+
+class Registry:
+    def __init__(self):
+        # name -> (type, help, {label tuple: metric})
+        self._families: Dict[str, Tuple[str, str, Dict[tuple, object]]] = {}
+
+    def _register(self, kind: str, name: str, help_text: str, labels: Dict[str, str], make):
+        family = self._families.setdefault(name, (kind, help_text, {}))
+        if family[0] != kind:
+            raise ValueError(f"Metric {name} already registered as a {family[0]}")
+        key = tuple(sorted(labels.items()))
+        metric = family[2].get(key)
+        if metric is None:
+            metric = family[2][key] = make()
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labels: Optional[Dict[str, str]] = None,
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        labels = labels or {}
+        return self._register("histogram", name, help_text, labels, lambda: Histogram(name, labels, buckets))
+
+    def counter(self, name: str, help_text: str, labels: Optional[Dict[str, str]] = None) -> Counter:
+        labels = labels or {}
+        return self._register("counter", name, help_text, labels, lambda: Counter(name, labels))
+
+    def callback(
+        self,
+        kind: str,
+        name: str,
+        help_text: str,
+        read: Callable[[], float],
+        labels: Optional[Dict[str, str]] = None
+    ):
+        """Register a ``counter`` or ``gauge`` read from ``read()``; re-registering replaces it"""
+        labels = labels or {}
+        metric = self._register(kind, name, help_text, labels, lambda: _Callback(name, labels, read))
+        metric.read = read
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help_text, metrics) in self._families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for metric in metrics.values():
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Pipeline of an inbound chat message, from the socket to every recipient's queue
+INGEST_STAGES = ("decode", "store", "persist", "encode", "fanout", "total")
+
+
+INGEST = {
+    stage: REGISTRY.histogram(
+        "chat_ingest_seconds",
+        "Time an inbound message spends in each stage, receive to fan-out",
+        {"stage": stage}
+    )
+    for stage in INGEST_STAGES
+}
+ENCODE = REGISTRY.histogram("chat_json_encode_seconds", "Time spent encoding one JSON frame or record")
+TRANSCODE = REGISTRY.histogram(
+    "chat_binary_encode_seconds", "Time spent turning one JSON frame into a binary frame"
+)
+FANOUT = REGISTRY.histogram(
+    "chat_fanout_seconds", "Time from publishing a large-group frame to queueing it for every online member"
+)
+SEND = REGISTRY.histogram("chat_send_seconds", "Time to write one frame to a client socket")
+QUEUE_WAIT = REGISTRY.histogram("chat_queue_wait_seconds", "Time a frame waited in a connection's outbound queue")
+SNAPSHOT = REGISTRY.histogram("chat_snapshot_seconds", "Duration of save_data snapshots")
+COMMIT = REGISTRY.histogram("chat_commit_seconds", "Duration of one group commit, write plus sync")
+COMMIT_RECORDS = REGISTRY.histogram(
+    "chat_commit_records", "Records written per group commit", buckets=SIZE_BUCKETS
+)
+COMPACTION = REGISTRY.histogram("chat_wal_compaction_seconds", "Duration of folding a sealed log into the snapshot")
+LOOP_LAG = REGISTRY.histogram(
+    "chat_event_loop_lag_seconds", "How late the event loop woke a task sleeping for a fixed interval"
+)
+
+# Most recent event loop lag, for the health endpoint
+last_loop_lag = 0.0
+
+
+async def watch_loop_lag(interval: float = 0.1):
+    """Sample event loop lag until cancelled.
+
+    Anything holding the loop (blocking I/O, long CPU work in a handler)
+    delays the wakeup, so the overshoot is how long other tasks waited.
+    """
+    global last_loop_lag
+    loop = asyncio.get_event_loop()
+    while True:
+        due = loop.time() + interval
+        await asyncio.sleep(interval)
+        last_loop_lag = max(loop.time() - due, 0.0)
+        LOOP_LAG.observe(last_loop_lag)
@@ -1,7 +1,44 @@
-from typing import List, Optional, Dict, Any
-from datetime import datetime
+from typing import Callable, List, Optional, Dict, Any, Set, Tuple, Union
+from datetime import datetime, timedelta
 from enum import Enum
+from sys import intern
 import uuid
+from pagination import INITIAL_MESSAGES, page_bounds, page_cursors
+
+# Timestamps are stored as integer microseconds since the epoch of the naive
+# local wall clock, so converting back reproduces the original datetime exactly.
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def to_epoch_us(value: datetime) -> int:
+    return (value - _EPOCH) // _MICROSECOND
+
+
+def from_epoch_us(value: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=value)
+
+
+def now_us() -> int:
+    return to_epoch_us(datetime.now())
+
+
+def pack_id(value: str) -> Union[bytes, str]:
+    """Store canonical uuid strings as their 16 raw bytes"""
+    if len(value) == 36:
+        try:
+            packed = uuid.UUID(value)
+        except ValueError:
+            return value
+        if str(packed) == value:
+            return packed.bytes
+    return value
+
+
+def unpack_id(value: Union[bytes, str]) -> str:
+    if isinstance(value, bytes):
+        return str(uuid.UUID(bytes=value))
+    return value
 
 class MessageType(Enum):
     TEXT = "text"
@@ -9,13 +46,31 @@ class MessageType(Enum):
     FILE = "file"
     SYSTEM = "system"
 
+def message_type_for(attachment: Optional[Dict[str, Any]]) -> MessageType:
+    """TEXT without an attachment, IMAGE for image blobs and FILE for anything else"""
+    if attachment is None:
+        return MessageType.TEXT
+    if attachment.get("content_type", "").startswith("image/"):
+        return MessageType.IMAGE
+    return MessageType.FILE
+
 class User:
+    __slots__ = ("user_id", "username", "avatar", "is_online", "last_seen_us")
+    
     def __init__(self, user_id: str, username: str, avatar: Optional[str] = None):
-        self.user_id = user_id
+        self.user_id = intern(user_id)
         self.username = username
         self.avatar = avatar or f"https://i.pravatar.cc/150?u={user_id}"
         self.is_online = False
-        self.last_seen = datetime.now()
+        self.last_seen_us = now_us()
+    
+    @property
+    def last_seen(self) -> datetime:
+        return from_epoch_us(self.last_seen_us)
+    
+    @last_seen.setter
+    def last_seen(self, value: datetime):
+        self.last_seen_us = to_epoch_us(value)
     
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -27,6 +82,19 @@ class User:
         }
 
 class Message:
+    """A chat message.
+
+    Ids that are uuids are held as raw bytes, chat and sender ids are
+    interned so every message from the same sender shares one string, and
+    the timestamp is an integer. The display ``time`` string is only built
+    in ``to_dict``. Read state lives in the chat's per-user watermarks, not
+    on the message. Image and file messages carry an ``attachment`` that
+    references a blob by id; the content itself stays in the blob store.
+    """
+    __slots__ = (
+        "_message_id", "chat_id", "sender_id", "text", "message_type", "timestamp_us", "seq", "attachment"
+    )
+    
     def __init__(
         self, 
         message_id: str, 
@@ -34,30 +102,63 @@ class Message:
         sender_id: str, 
         text: str, 
         message_type: MessageType = MessageType.TEXT,
-        timestamp: Optional[datetime] = None
+        timestamp: Optional[datetime] = None,
+        attachment: Optional[Dict[str, Any]] = None
     ):
-        self.message_id = message_id
-        self.chat_id = chat_id
-        self.sender_id = sender_id
+        self._message_id = pack_id(message_id)
+        self.chat_id = intern(chat_id)
+        self.sender_id = intern(sender_id)
         self.text = text
         self.message_type = message_type
-        self.timestamp = timestamp or datetime.now()
-        self.is_read = False
+        self.timestamp_us = to_epoch_us(timestamp) if timestamp else now_us()
+        # Position in the chat, assigned by Chat; monotonic per chat
+        self.seq = 0
+        self.attachment = attachment
+    
+    @property
+    def message_id(self) -> str:
+        return unpack_id(self._message_id)
+    
+    @property
+    def timestamp(self) -> datetime:
+        return from_epoch_us(self.timestamp_us)
     
     def to_dict(self) -> Dict[str, Any]:
-        return {
+        timestamp = self.timestamp
+        data = {
             "message_id": self.message_id,
             "chat_id": self.chat_id,
             "sender_id": self.sender_id,
             "text": self.text,
             "message_type": self.message_type.value,
-            "timestamp": self.timestamp.isoformat(),
-            "time": self.timestamp.strftime("%I:%M %p"),  # For frontend compatibility
+            "timestamp": timestamp.isoformat(),
+            "time": timestamp.strftime("%I:%M %p"),  # For frontend compatibility
             "sender": self.sender_id,  # For frontend compatibility
-            "is_read": self.is_read
+            "seq": self.seq
         }
+        if self.attachment is not None:
+            data["attachment"] = self.attachment
+        return data
+
+def number_messages(messages: List[Message], start: int) -> List[Message]:
+    """Give messages loaded from storage their sequence numbers"""
+    for seq, message in enumerate(messages, start):
+        message.seq = seq
+    return messages
 
 class Chat:
+    """A chat and the window of its messages held in memory.
+
+    ``read_seqs`` maps each participant to the seq of the last message they
+    have read, so unread counts are a subtraction rather than a scan. Sending
+    a message marks everything up to it read for the sender.
+    """
+    __slots__ = (
+        "chat_id", "name", "chat_type", "participants", "_participant_set", "avatar",
+        "created_at", "last_message_us", "_messages", "message_offset",
+        "_message_loader", "_deferred_count", "history_loader", "read_seqs"
+    )
+    
     def __init__(
         self, 
         chat_id: str, 
@@ -66,24 +167,186 @@ class Chat:
         participants: Optional[List[str]] = None,
         avatar: Optional[str] = None
     ):
-        self.chat_id = chat_id
+        self.chat_id = intern(chat_id)
         self.name = name
         self.chat_type = chat_type
-        self.participants = participants or []
+        self.participants = [intern(user_id) for user_id in participants or []]
+        self._participant_set: Set[str] = set(self.participants)
         self.avatar = avatar or f"https://i.pravatar.cc/150?u={chat_id}"
         self.created_at = datetime.now()
-        self.last_message_at = datetime.now()
-        self.messages: List[Message] = []
+        self.last_message_us = now_us()
+        self._messages: Optional[List[Message]] = []
+        # Position of messages[0]; older messages live only in storage
+        self.message_offset = 0
+        self._message_loader: Optional[Callable[[], Tuple[int, List[Message]]]] = None
+        self._deferred_count = 0
+        # Fetches positions [start, end) older than the window from storage
+        self.history_loader: Optional[Callable[[int, int], List[Message]]] = None
+        # user_id -> seq of the last message they have read
+        self.read_seqs: Dict[str, int] = {}
+    
+    def defer_messages(
+        self,
+        count: int,
+        last_message_us: Optional[int],
+        loader: Callable[[], Tuple[int, List[Message]]]
+    ):
+        """Leave messages unloaded until first accessed.
+
+        ``loader()`` returns ``(message_offset, messages)`` for the window to
+        materialize; ``count`` and ``last_message_us`` answer cheap metadata
+        queries until then.
+        """
+        self._messages = None
+        self._message_loader = loader
+        self._deferred_count = count
+        if last_message_us is not None:
+            self.last_message_us = last_message_us
+    
+    @property
+    def messages_loaded(self) -> bool:
+        return self._messages is not None
+    
+    @property
+    def messages(self) -> List[Message]:
+        if self._messages is None:
+            self.message_offset, self._messages = self._message_loader()
+            self._message_loader = None
+            number_messages(self._messages, self.message_offset)
+        return self._messages
+    
+    @messages.setter
+    def messages(self, value: List[Message]):
+        self._messages = value
+        self._message_loader = None
+    
+    def start_window(self):
+        """Begin an empty window after the last message, leaving history in storage"""
+        self.message_offset = self.message_count
+        self.messages = []
+    
+    def evict_before(self, position: int) -> List[Message]:
+        """Drop in-memory messages older than ``position``; storage must hold them"""
+        count = position - self.message_offset
+        if count <= 0:
+            return []
+        dropped = self._messages[:count]
+        del self._messages[:count]
+        self.message_offset = position
+        return dropped
+    
+    def has_participant(self, user_id: str) -> bool:
+        """O(1) membership check"""
+        return user_id in self._participant_set
+    
+    def add_participant(self, user_id: str) -> bool:
+        """Add a participant; returns False if already present"""
+        if user_id in self._participant_set:
+            return False
+        user_id = intern(user_id)
+        self._participant_set.add(user_id)
+        self.participants.append(user_id)
+        return True
+    
+    def remove_participant(self, user_id: str) -> bool:
+        """Remove a participant; returns False if not present"""
+        if user_id not in self._participant_set:
+            return False
+        self._participant_set.discard(user_id)
+        self.participants.remove(user_id)
+        return True
     
     def add_message(self, message: Message):
         """Add a message to this chat"""
+        message.seq = self.message_count
         self.messages.append(message)
-        self.last_message_at = message.timestamp
+        self.last_message_us = message.timestamp_us
+        self.read_seqs[message.sender_id] = message.seq
+    
+    def mark_read(self, user_id: str, seq: int) -> bool:
+        """Move a user's read watermark forward to ``seq``; returns False if it did not move"""
+        seq = min(seq, self.message_count - 1)
+        if seq <= self.read_seqs.get(user_id, -1):
+            return False
+        self.read_seqs[intern(user_id)] = seq
+        return True
+    
+    def unread_count(self, user_id: str) -> int:
+        """Messages after the user's read watermark"""
+        return max(self.message_count - 1 - self.read_seqs.get(user_id, -1), 0)
     
     def get_last_message(self) -> Optional[Message]:
         """Get the last message in this chat"""
         return self.messages[-1] if self.messages else None
     
+    @property
+    def last_message_at(self) -> datetime:
+        return from_epoch_us(self.last_message_us)
+    
+    @property
+    def message_count(self) -> int:
+        """Total messages in this chat, including ones not held in memory"""
+        if self._messages is None:
+            return self._deferred_count
+        return self.message_offset + len(self._messages)
+    
+    def get_messages_page(
+        self,
+        before: Optional[int] = None,
+        after: Optional[int] = None,
+        limit: int = 50,
+        loader: Optional[Callable[[int, int], List["Message"]]] = None
+    ) -> Dict[str, Any]:
+        """Get one page of messages around a position, with cursors.
+
+        ``loader(start, end)`` fetches positions older than the in-memory
+        window, defaulting to ``history_loader``.
+        """
+        loader = loader or self.history_loader
+        in_memory = self.messages
+        total = self.message_count
+        start, end = page_bounds(total, before, after, limit)
+        offset = self.message_offset
+        messages = []
+        if start < offset and loader is not None:
+            messages = number_messages(loader(start, min(end, offset)), start)
+        messages += in_memory[max(start - offset, 0):max(end - offset, 0)]
+        page = {"messages": messages}
+        page.update(page_cursors(self.chat_id, start, end, total))
+        return page
+    
+    def to_summary_dict(
+        self,
+        recent: int = INITIAL_MESSAGES,
+        message_format: Optional[Callable[["Message"], Dict[str, Any]]] = None,
+        user_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Chat metadata plus only the most recent messages.
+
+        With ``user_id`` the summary also carries that user's unread count.
+        """
+        message_format = message_format or Message.to_dict
+        page = self.get_messages_page(limit=recent)
+        last_message = self.get_last_message()
+        summary = {
+            "id": self.chat_id,
+            "chat_id": self.chat_id,
+            "name": self.name,
+            "type": self.chat_type,
+            "participants": self.participants,
+            "avatar": self.avatar,
+            "created_at": self.created_at.isoformat(),
+            "last_message_at": self.last_message_at.isoformat(),
+            "messages": [message_format(msg) for msg in page["messages"]],
+            "history_cursor": page["before"],
+            "last_seq": self.message_count - 1,
+            "read_seqs": dict(self.read_seqs),
+            "last_message": message_format(last_message) if last_message else None
+        }
+        if user_id is not None:
+            summary["unread_count"] = self.unread_count(user_id)
+        return summary
+    
     def to_dict(self) -> Dict[str, Any]:
         last_message = self.get_last_message()
         return {
@@ -96,28 +359,40 @@ class Chat:
             "created_at": self.created_at.isoformat(),
             "last_message_at": self.last_message_at.isoformat(),
             "messages": [msg.to_dict() for msg in self.messages],
+            "read_seqs": dict(self.read_seqs),
             "last_message": last_message.to_dict() if last_message else None
         }
 
 class ChatRoom:
-    """Represents an active chat room with real-time participants"""
+    """Represents an active chat room with real-time participants.
+
+    Typing state maps each typing user to the monotonic time their indicator
+    expires, so refreshing it on a keystroke is a single dict write.
+    """
+    __slots__ = ("chat_id", "active_participants", "typing_users")
+    
     def __init__(self, chat_id: str):
         self.chat_id = chat_id
-        self.active_participants: List[str] = []
-        self.typing_users: List[str] = []
+        self.active_participants: Set[str] = set()
+        self.typing_users: Dict[str, float] = {}
     
     def add_participant(self, user_id: str):
-        if user_id not in self.active_participants:
-            self.active_participants.append(user_id)
+        self.active_participants.add(user_id)
     
     def remove_participant(self, user_id: str):
-        if user_id in self.active_participants:
-            self.active_participants.remove(user_id)
-        if user_id in self.typing_users:
-            self.typing_users.remove(user_id)
-    
-    def set_typing(self, user_id: str, is_typing: bool):
-        if is_typing and user_id not in self.typing_users:
-            self.typing_users.append(user_id)
-        elif not is_typing and user_id in self.typing_users:
-            self.typing_users.remove(user_id)
\ No newline at end of file
+        self.active_participants.discard(user_id)
+        self.typing_users.pop(user_id, None)
+    
+    def set_typing(self, user_id: str, is_typing: bool, expires_at: float = 0.0) -> bool:
+        """Start, refresh or stop a typing indicator; returns True if it started or stopped"""
+        if is_typing:
+            started = user_id not in self.typing_users
+            self.typing_users[user_id] = expires_at
+            return started
+        return self.typing_users.pop(user_id, None) is not None
+    
+    def is_typing(self, user_id: str) -> bool:
+        return user_id in self.typing_users
+    
+    def typing_expires_at(self, user_id: str) -> Optional[float]:
+        return self.typing_users.get(user_id)
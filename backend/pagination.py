@@ -0,0 +1,103 @@
+from typing import Optional, Tuple
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Messages per chat included in initial_data; older ones come from load_history
+INITIAL_MESSAGES = 20
+
+
+def encode_cursor(chat_id: str, position: int) -> str:
+    """Build an opaque cursor pointing at a message position in a chat"""
+    raw = f"{chat_id}:{position}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, chat_id: str) -> int:
+    """Return the message position a cursor points at.
+
+    Raises ValueError for malformed cursors or cursors minted for another chat.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        cursor_chat, position = raw.rsplit(":", 1)
+        position = int(position)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if cursor_chat != chat_id or position < 0:
+        raise ValueError("Invalid cursor")
+    return position
+
+
+def clamp_limit(limit: Optional[int]) -> int:
+    if not limit or limit < 1:
+        return DEFAULT_PAGE_SIZE
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def page_bounds(
+    total: int,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[int, int]:
+    """Work out the [start, end) slice of a page.
+
+    ``before`` returns the ``limit`` messages preceding that position,
+    ``after`` the ones following it, and neither returns the latest page.
+    """
+    if after is not None:
+        start = min(after + 1, total)
+        end = min(start + limit, total)
+    else:
+        end = total if before is None else min(before, total)
+        start = max(end - limit, 0)
+    return start, end
+
+
+def page_cursors(chat_id: str, start: int, end: int, total: int) -> dict:
+    """Cursors for fetching the pages on either side of [start, end)"""
+    return {
+        "before": encode_cursor(chat_id, start) if start > 0 else None,
+        "after": encode_cursor(chat_id, end - 1) if end > 0 else None,
+        "has_more_before": start > 0,
+        "has_more_after": end < total,
+    }
+
+
+# Missed messages per chat that a reconnecting client may be sent as a delta;
+# beyond this it is told to resync that chat from a fresh summary instead
+MAX_SYNC_DELTA = MAX_PAGE_SIZE
+
+SYNC_CURRENT = "current"
+SYNC_DELTA = "delta"
+SYNC_RESYNC = "resync"
+
+
+def sync_action(last_seen: Optional[int], total: int) -> str:
+    """Decide how to bring a client that has seen up to seq ``last_seen`` up to date"""
+    if last_seen is None or not -1 <= last_seen < total or total - 1 - last_seen > MAX_SYNC_DELTA:
+        # Unknown chat, a sequence we never issued, or too far behind
+        return SYNC_RESYNC
+    if last_seen == total - 1:
+        return SYNC_CURRENT
+    return SYNC_DELTA
+
+
+def parse_since(value: Optional[str]) -> Optional[dict]:
+    """Parse the ``since`` connect parameter: a JSON object of chat id -> last seen seq"""
+    if not value:
+        return None
+    try:
+        since = json.loads(value)
+    except ValueError:
+        return None
+    if not isinstance(since, dict):
+        return None
+    return {
+        str(chat_id): seq
+        for chat_id, seq in since.items()
+        if isinstance(seq, int) and not isinstance(seq, bool) and seq >= -1
+    }
@@ -0,0 +1,330 @@
+from typing import Any, Dict, List, Optional
+import json
+import os
+import threading
+import time
+from encoding import dumps
+import metrics
+
+FSYNC_ALWAYS = "always"
+FSYNC_INTERVAL = "interval"
+FSYNC_NEVER = "never"
+
+
+def empty_state() -> Dict[str, Any]:
+    """Return an empty replay state: users and chats keyed by id"""
+    return {"users": {}, "chats": {}, "wal_seq": 0}
+
+
+def state_from_snapshot(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert the on-disk snapshot layout into a replay state"""
+    state = empty_state()
+    state["wal_seq"] = data.get("wal_seq", 0)
+    for user_data in data.get("users", []):
+        state["users"][user_data["user_id"]] = user_data
+    for chat_data in data.get("chats", []):
+        chat_data.setdefault("messages", [])
+        chat_data.setdefault("read_seqs", {})
+        # Chat.to_dict() names the field "type"
+        chat_data.setdefault("chat_type", chat_data.get("type", "private"))
+        state["chats"][chat_data["chat_id"]] = chat_data
+    return state
+
+
+def snapshot_from_state(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a replay state back into the on-disk snapshot layout"""
+    return {
+        "wal_seq": state["wal_seq"],
+        "users": list(state["users"].values()),
+        "chats": list(state["chats"].values()),
+    }
+
+
+def apply_record(state: Dict[str, Any], record: Dict[str, Any]):
+    """Apply a single log record to a replay state"""
+    seq = record.get("n", 0)
+    if seq <= state["wal_seq"]:
+        # Already folded into the snapshot we started from
+        return
+    state["wal_seq"] = seq
+
+    op = record["op"]
+    if op == "user":
+        # Update in place so a last_seen from the snapshot survives
+        user = state["users"].setdefault(record["user_id"], {"user_id": record["user_id"]})
+        user["username"] = record["username"]
+        user["avatar"] = record.get("avatar")
+    elif op == "chat":
+        state["chats"][record["chat_id"]] = {
+            "chat_id": record["chat_id"],
+            "name": record["name"],
+            "chat_type": record["chat_type"],
+            "participants": list(record["participants"]),
+            "avatar": record.get("avatar"),
+            "messages": [],
+            "read_seqs": {},
+        }
+    elif op == "message":
+        chat = state["chats"].get(record["chat_id"])
+        if chat is not None:
+            message = {
+                "message_id": record["message_id"],
+                "chat_id": record["chat_id"],
+                "sender_id": record["sender_id"],
+                "text": record["text"],
+                "message_type": record.get("message_type", "text"),
+                "timestamp": record["timestamp"],
+            }
+            if record.get("attachment") is not None:
+                message["attachment"] = record["attachment"]
+            chat["messages"].append(message)
+            # Sending a message reads everything up to it
+            chat["read_seqs"][record["sender_id"]] = len(chat["messages"]) - 1
+    elif op == "read":
+        chat = state["chats"].get(record["chat_id"])
+        if chat is not None:
+            read_seqs = chat["read_seqs"]
+            read_seqs[record["user_id"]] = max(read_seqs.get(record["user_id"], -1), record["seq"])
+    elif op == "presence":
+        user = state["users"].get(record["user_id"])
+        if user is not None:
+            user["last_seen_us"] = record["last_seen_us"]
+    elif op == "join":
+        chat = state["chats"].get(record["chat_id"])
+        if chat is not None and record["user_id"] not in chat["participants"]:
+            chat["participants"].append(record["user_id"])
+    elif op == "leave":
+        chat = state["chats"].get(record["chat_id"])
+        if chat is not None and record["user_id"] in chat["participants"]:
+            chat["participants"].remove(record["user_id"])
+
+
+class WriteAheadLog:
+    """Append-only mutation log with background snapshot compaction.
+
+    The snapshot lives at ``path`` in the same layout ``ChatService`` has
+    always written. Mutations are appended as one compact JSON line each to
+    ``path + ".wal"``. Once the active log grows past ``compact_threshold``
+    records it is sealed and a background thread folds the sealed segments
+    into a fresh snapshot, so appends never pay for the size of the history.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        fsync: str = FSYNC_INTERVAL,
+        fsync_interval: float = 1.0,
+        compact_threshold: int = 10000
+    ):
+        if fsync not in (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER):
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.path = path
+        self.log_path = path + ".wal"
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.compact_threshold = compact_threshold
+
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._compactor: Optional[threading.Thread] = None
+        self._file = None
+        self._seq = 0
+        self._active_records = 0
+        self._last_fsync = time.monotonic()
+
+    # Reading
+
+    def _sealed_segments(self) -> List[str]:
+        directory = os.path.dirname(self.log_path) or "."
+        prefix = os.path.basename(self.log_path) + "."
+        segments = []
+        for name in os.listdir(directory):
+            suffix = name[len(prefix):]
+            if name.startswith(prefix) and suffix.isdigit():
+                segments.append((int(suffix), os.path.join(directory, name)))
+        return [path for _, path in sorted(segments)]
+
+    @staticmethod
+    def _read_records(path: str):
+        """Yield ``(record, offset just past its line)`` for each intact record.
+
+        Stops at the first line that is not complete JSON ending in a newline:
+        a torn final write from a crash. Everything before it is intact.
+        """
+        offset = 0
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                stripped = line.strip()
+                if stripped:
+                    try:
+                        record = json.loads(stripped)
+                    except ValueError:
+                        break
+                else:
+                    record = None
+                offset += len(line)
+                if record is not None:
+                    yield record, offset
+
+    def _read_snapshot(self) -> Dict[str, Any]:
+        if not os.path.exists(self.path):
+            return empty_state()
+        with open(self.path, "r") as f:
+            return state_from_snapshot(json.load(f))
+
+    def load(self) -> Dict[str, Any]:
+        """Replay snapshot plus every log segment and return the state"""
+        state = self._read_snapshot()
+        active_records = 0
+        for segment in self._sealed_segments() + [self.log_path]:
+            if not os.path.exists(segment):
+                continue
+            intact = 0
+            for record, intact in self._read_records(segment):
+                apply_record(state, record)
+                if segment == self.log_path:
+                    active_records += 1
+            if segment == self.log_path and os.path.getsize(segment) > intact:
+                # Cut off a torn tail, or new appends would extend the broken
+                # line and be lost with it on the next replay
+                print(f"Truncating torn write at byte {intact} of {segment}")
+                os.truncate(segment, intact)
+
+        with self._lock:
+            self._seq = state["wal_seq"]
+            self._active_records = active_records
+        return state
+
+    # Writing
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.log_path, "a")
+
+    def _sync(self, force: bool = False):
+        now = time.monotonic()
+        if (
+            force
+            or self.fsync == FSYNC_ALWAYS
+            or (self.fsync == FSYNC_INTERVAL and now - self._last_fsync >= self.fsync_interval)
+        ):
+            os.fsync(self._file.fileno())
+            self._last_fsync = now
+
+    def append(self, op: str, **fields):
+        """Append one mutation record to the active log"""
+        fields["op"] = op
+        self.append_many([fields])
+
+    def append_many(self, records: List[Dict[str, Any]]):
+        """Append several records with a single write"""
+        with self._lock:
+            self._open()
+            lines = []
+            for record in records:
+                self._seq += 1
+                record["n"] = self._seq
+                lines.append(dumps(record))
+            lines.append("")
+            self._file.write("\n".join(lines))
+            self._file.flush()
+            if self.fsync != FSYNC_NEVER:
+                self._sync()
+            self._active_records += len(records)
+            should_compact = self._active_records >= self.compact_threshold
+
+        if should_compact:
+            self.compact()
+
+    def flush(self):
+        """Force everything appended so far to stable storage"""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                self._sync(force=True)
+
+    def write_snapshot(self, snapshot: Dict[str, Any]):
+        """Replace the snapshot with ``snapshot`` and drop every log segment.
+
+        Used for the initial seed and explicit checkpoints where the caller
+        already holds the full state in memory.
+        """
+        with self._compact_lock, self._lock:
+            snapshot["wal_seq"] = self._seq
+            self._write_snapshot_file(snapshot)
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            for segment in self._sealed_segments() + [self.log_path]:
+                if os.path.exists(segment):
+                    os.remove(segment)
+            self._active_records = 0
+
+    def _write_snapshot_file(self, snapshot: Dict[str, Any]):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f, separators=(",", ":"), default=str)
+            f.flush()
+            if self.fsync != FSYNC_NEVER:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    # Compaction
+
+    def _seal_active(self) -> bool:
+        """Rotate the active log into a numbered sealed segment"""
+        with self._lock:
+            if self._active_records == 0:
+                return False
+            if self._file is not None:
+                self._file.flush()
+                self._sync(force=True)
+                self._file.close()
+                self._file = None
+            os.replace(self.log_path, f"{self.log_path}.{self._seq}")
+            self._active_records = 0
+            return True
+
+    def _compact_sealed(self):
+        with self._compact_lock:
+            segments = self._sealed_segments()
+            if not segments:
+                return
+            started = metrics.start()
+            try:
+                state = self._read_snapshot()
+                for segment in segments:
+                    for record, _ in self._read_records(segment):
+                        apply_record(state, record)
+                # The snapshot records the highest folded sequence number, so a
+                # crash before the segments are removed just replays no-ops.
+                self._write_snapshot_file(snapshot_from_state(state))
+                for segment in segments:
+                    os.remove(segment)
+                metrics.COMPACTION.observe_since(started)
+            except Exception as e:
+                print(f"Error compacting log: {e}")
+
+    def compact(self, wait: bool = False):
+        """Seal the active log and fold sealed segments into the snapshot"""
+        if not self._seal_active() and not self._sealed_segments():
+            return
+        if self._compactor is None or not self._compactor.is_alive():
+            self._compactor = threading.Thread(
+                target=self._compact_sealed, name="wal-compactor", daemon=True
+            )
+            self._compactor.start()
+        if wait:
+            self._compactor.join()
+
+    def close(self):
+        """Flush the log and wait for any running compaction"""
+        self.flush()
+        if self._compactor is not None:
+            self._compactor.join()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,171 @@
+from typing import Callable, Dict, Iterable, List, Optional, Set
+import asyncio
+import time
+from encoding import dumps
+from models import from_epoch_us, now_us
+
+# publish(frame, recipient user ids, coalesce_key), e.g. ConnectionManager.broadcast_to_users
+Publish = Callable[[str, List[str], Optional[str]], None]
+# contacts(user_id): everyone who shares a chat with the user
+Contacts = Callable[[str], Iterable[str]]
+
+
+class PresenceService:
+    """Online/offline tracking with interest-scoped, debounced digests.
+
+    Connects and disconnects only mark a user as changed. Every
+    ``digest_interval`` seconds the pending changes are published, and only
+    to the users who share a chat with each subject. A disconnect is held for
+    ``debounce`` seconds first, so a client that drops and reconnects within
+    that time never produces an update at all. Each change is encoded once
+    and published to all of its recipients together; a recipient's own
+    connection batches them only if it opted into coalescing.
+
+    ``last_seen`` is kept in memory here and handed to ``on_change``, which
+    the server uses to write a ``presence`` record on every change, batched
+    by the group commit writer. Each worker tracks the connections it holds
+    itself. Once a user's offline change is settled, ``on_offline`` lets the
+    owner forget the user's contacts.
+    """
+    def __init__(
+        self,
+        publish: Publish,
+        contacts: Contacts,
+        debounce: float = 2.0,
+        digest_interval: float = 0.5,
+        on_change: Optional[Callable[[str, bool, int], None]] = None,
+        on_offline: Optional[Callable[[str], None]] = None
+    ):
+        self.publish = publish
+        self.contacts = contacts
+        self.debounce = debounce
+        self.digest_interval = digest_interval
+        self.on_change = on_change
+        self.on_offline = on_offline
+
+        # Connected users and the user payload announced for them
+        self._online: Dict[str, dict] = {}
+        # Users whose online status has been announced to their contacts
+        self._announced: Set[str] = set()
+        # Users with a change not yet published
+        self._dirty: Set[str] = set()
+        # Disconnected users still inside their debounce window (monotonic time)
+        self._offline_since: Dict[str, float] = {}
+        self._last_seen: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+        self.digests = 0
+        self.published = 0
+        self.suppressed = 0
+
+    def start(self):
+        self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.digest_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error publishing presence digest: {e}")
+
+    def connected(self, user_id: str, user: dict):
+        """Mark a user online; ``user`` is the payload sent in ``user_online``"""
+        self._online[user_id] = user
+        self._offline_since.pop(user_id, None)
+        self._dirty.add(user_id)
+        self._touch(user_id, True)
+
+    def disconnected(self, user_id: str):
+        """Mark a user offline once their last connection is gone"""
+        self._online.pop(user_id, None)
+        self._offline_since[user_id] = time.monotonic()
+        self._dirty.add(user_id)
+        self._touch(user_id, False)
+
+    def _touch(self, user_id: str, online: bool):
+        last_seen = now_us()
+        self._last_seen[user_id] = last_seen
+        if self.on_change is not None:
+            self.on_change(user_id, online, last_seen)
+
+    def is_online(self, user_id: str) -> bool:
+        return user_id in self._online
+
+    def last_seen_us(self, user_id: str) -> Optional[int]:
+        return self._last_seen.get(user_id)
+
+    def online_contacts(self, user_id: str) -> List[dict]:
+        """Current presence snapshot for a connecting user's contacts"""
+        return [self._online[contact] for contact in self.contacts(user_id) if contact in self._online]
+
+    def _due_changes(self, now: float) -> List[str]:
+        changed = []
+        for user_id in list(self._dirty):
+            since = self._offline_since.get(user_id)
+            if since is not None and now - since < self.debounce:
+                continue
+            self._dirty.discard(user_id)
+            self._offline_since.pop(user_id, None)
+            online = user_id in self._online
+            if online == (user_id in self._announced):
+                # Flapped back to what contacts already see
+                self.suppressed += 1
+                if not online:
+                    self._went_offline(user_id)
+                continue
+            if online:
+                self._announced.add(user_id)
+            else:
+                self._announced.discard(user_id)
+            changed.append(user_id)
+        return changed
+
+    def _went_offline(self, user_id: str):
+        if self.on_offline is not None:
+            self.on_offline(user_id)
+
+    def _encode(self, user_id: str) -> str:
+        if user_id in self._online:
+            return dumps({"type": "user_online", "user": self._online[user_id]})
+        last_seen = self._last_seen.get(user_id)
+        return dumps({
+            "type": "user_offline",
+            "user_id": user_id,
+            "last_seen": from_epoch_us(last_seen).isoformat() if last_seen is not None else None
+        })
+
+    def flush(self, now: Optional[float] = None) -> int:
+        """Publish every change that is due; returns the number of frames published"""
+        changed = self._due_changes(time.monotonic() if now is None else now)
+        if not changed:
+            return 0
+
+        published = 0
+        for user_id in changed:
+            recipients = [contact for contact in self.contacts(user_id) if contact != user_id]
+            if not recipients:
+                continue
+            self.publish(self._encode(user_id), recipients, f"presence:{user_id}")
+            published += 1
+        for user_id in changed:
+            if user_id not in self._online:
+                self._went_offline(user_id)
+
+        self.digests += 1
+        self.published += len(changed)
+        return published
+
+    def get_metrics(self) -> dict:
+        return {
+            "online": len(self._online),
+            "pending": len(self._dirty),
+            "digests": self.digests,
+            "published": self.published,
+            "suppressed": self.suppressed,
+        }
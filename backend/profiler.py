@@ -0,0 +1,84 @@
+from typing import Dict, List, Optional, Tuple
+import os
+import sys
+import threading
+import time
+
+# Deepest stack recorded per sample
+MAX_STACK_DEPTH = 64
+
+
+class SamplingProfiler:
+    """Statistical profiler for the thread running the event loop.
+
+    While running, a background thread wakes every ``interval`` seconds,
+    grabs the target thread's current stack with ``sys._current_frames`` and
+    counts it. Nothing is hooked into the profiled code, so when stopped it
+    costs nothing, and when running the cost is set by the interval rather
+    than by how much work the server does. ``report`` returns the counts in
+    the collapsed-stack format flame graph tools read.
+    """
+    def __init__(self, thread_id: Optional[int] = None):
+        self.thread_id = thread_id if thread_id is not None else threading.main_thread().ident
+        self.interval = 0.005
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self._stacks: Dict[Tuple[str, ...], int] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float = 0.005, thread_id: Optional[int] = None):
+        """Start sampling, discarding the previous profile"""
+        self.stop()
+        if thread_id is not None:
+            self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self._stacks = {}
+        self.started_at = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            key = tuple(reversed(stack))
+            self._stacks[key] = self._stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def report(self, limit: Optional[int] = None) -> str:
+        """Collapsed stacks, most sampled first: ``outer;inner count`` per line"""
+        # Copy first; the sampling thread keeps adding stacks
+        stacks: List[Tuple[Tuple[str, ...], int]] = sorted(
+            dict(self._stacks).items(), key=lambda item: item[1], reverse=True
+        )
+        if limit is not None:
+            stacks = stacks[:limit]
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in stacks)
+
+    def status(self) -> dict:
+        return {
+            "running": self.running,
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "stacks": len(self._stacks),
+            "started_at": self.started_at,
+        }
@@ -0,0 +1,157 @@
+from typing import Dict, Optional
+import os
+import time
+
+# Buckets kept before idle ones are swept; a full bucket carries no state worth keeping
+SWEEP_THRESHOLD = 10000
+
+
+class SlowDown(Exception):
+    """An event refused because its sender or chat is over its limit"""
+    def __init__(self, scope: str, retry_after: float, chat_id: Optional[str] = None):
+        super().__init__(f"Rate limited ({scope}), retry in {retry_after:.3f}s")
+        self.scope = scope
+        self.retry_after = retry_after
+        self.chat_id = chat_id
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class BucketSet:
+    """Token buckets of one rate and burst, one per key, refilled lazily.
+
+    Nothing runs in the background: a bucket is brought up to date only when
+    its key is charged. Balances may go negative by up to ``max_debt``
+    tokens; that debt is the time the caller has to wait before acting.
+    """
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._sweep_at = SWEEP_THRESHOLD
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def balance(self, key: str, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self._sweep_at:
+                self.sweep(now)
+            bucket = self._buckets[key] = TokenBucket(self.burst, now)
+        elif now > bucket.updated:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+        return bucket
+
+    def wait(self, bucket: TokenBucket, cost: float) -> float:
+        """Seconds until ``bucket`` would be back to zero after paying ``cost``"""
+        # A full bucket always admits one event, however costly
+        deficit = min(cost, self.burst) - bucket.tokens
+        return deficit / self.rate if deficit > 0 else 0.0
+
+    def sweep(self, now: float):
+        """Forget buckets that have refilled completely"""
+        full = self.burst / self.rate
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items() if now - bucket.updated < full
+        }
+        self._sweep_at = max(SWEEP_THRESHOLD, len(self._buckets) * 2)
+
+
+class RateLimiter:
+    """Per-user and per-chat token buckets for inbound WebSocket events.
+
+    Every event a user sends costs one token from their bucket, and a
+    message costs one more from its chat's bucket, which all senders in the
+    chat share. When a bucket is short the event is not dropped: if the
+    wait is at most ``max_pause`` seconds, ``reserve`` charges it and tells
+    the receive loop how long to sleep before handling it, which also stops
+    reading that socket so the client is pushed back by TCP. A longer wait
+    raises ``SlowDown`` without charging anything, so the client can be told
+    when to retry.
+
+    A rate of 0 switches that limit off. Buckets live in the worker's
+    memory; each worker limits the connections it holds.
+    """
+    def __init__(
+        self,
+        user_rate: float = 20.0,
+        user_burst: float = 40.0,
+        chat_rate: float = 50.0,
+        chat_burst: float = 100.0,
+        max_pause: float = 1.0
+    ):
+        self.users = BucketSet(user_rate, user_burst) if user_rate > 0 else None
+        self.chats = BucketSet(chat_rate, chat_burst) if chat_rate > 0 else None
+        self.max_pause = max_pause
+
+        self.admitted = 0
+        self.paused = 0
+        self.paused_seconds = 0.0
+        self.rejected: Dict[str, int] = {"user": 0, "chat": 0}
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        """Limits from ``RATE_LIMIT_*`` environment variables, defaults otherwise"""
+        def setting(name: str, default: float) -> float:
+            return float(os.environ.get(f"RATE_LIMIT_{name}", default))
+        return cls(
+            user_rate=setting("USER_RATE", 20.0),
+            user_burst=setting("USER_BURST", 40.0),
+            chat_rate=setting("CHAT_RATE", 50.0),
+            chat_burst=setting("CHAT_BURST", 100.0),
+            max_pause=setting("MAX_PAUSE_MS", 1000.0) / 1000
+        )
+
+    def reserve(self, user_id: str, cost: int = 1, chats: Optional[Dict[str, int]] = None,
+                now: Optional[float] = None) -> float:
+        """Charge an event; returns the seconds to wait before handling it.
+
+        ``cost`` is charged to the user and ``chats`` maps chat ids to the
+        messages the event adds to each. Raises SlowDown, charging nothing,
+        when any bucket would make the event wait longer than ``max_pause``.
+        """
+        now = now if now is not None else time.monotonic()
+        charges = []
+        delay = 0.0
+        if self.users is not None:
+            bucket = self.users.balance(user_id, now)
+            wait = self.users.wait(bucket, cost)
+            if wait > self.max_pause:
+                self.rejected["user"] += 1
+                raise SlowDown("user", wait - self.max_pause)
+            charges.append((self.users, bucket, cost))
+            delay = wait
+        if self.chats is not None and chats:
+            for chat_id, messages in chats.items():
+                bucket = self.chats.balance(chat_id, now)
+                wait = self.chats.wait(bucket, messages)
+                if wait > self.max_pause:
+                    self.rejected["chat"] += 1
+                    raise SlowDown("chat", wait - self.max_pause, chat_id)
+                charges.append((self.chats, bucket, messages))
+                delay = max(delay, wait)
+        for buckets, bucket, amount in charges:
+            bucket.tokens -= min(amount, buckets.burst)
+        self.admitted += 1
+        if delay > 0:
+            self.paused += 1
+            self.paused_seconds += delay
+        return delay
+
+    def get_metrics(self) -> dict:
+        return {
+            "users": len(self.users) if self.users is not None else 0,
+            "chats": len(self.chats) if self.chats is not None else 0,
+            "admitted": self.admitted,
+            "paused": self.paused,
+            "paused_seconds": self.paused_seconds,
+            "rejected": dict(self.rejected),
+        }
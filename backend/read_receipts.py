@@ -0,0 +1,78 @@
+from typing import Callable, Dict, List, Optional
+import asyncio
+from encoding import dumps
+
+# publish(frame, recipient user ids, coalesce_key), e.g. ConnectionManager.broadcast_to_users
+Publish = Callable[[str, List[str], Optional[str]], None]
+
+
+class ReadReceipts:
+    """Read receipts, coalesced per chat before they are fanned out.
+
+    A ``mark_read`` only records the reader's newest watermark. Every
+    ``interval`` seconds each chat with new receipts gets one
+    ``read_receipts`` frame carrying the latest watermark of every reader
+    since the last flush. It goes to all participants: senders learn how far
+    each reader got, and the reader's other sessions clear their unread
+    counts. A client marking messages read one at a time as they arrive
+    costs one frame per chat per interval, not one per message.
+    """
+    def __init__(self, publish: Publish, interval: float = 0.5):
+        self.publish = publish
+        self.interval = interval
+        # chat_id -> reader -> newest watermark not yet published
+        self._pending: Dict[str, Dict[str, int]] = {}
+        self._participants: Dict[str, List[str]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+        self.received = 0
+        self.published = 0
+        self.coalesced = 0
+
+    def start(self):
+        self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error publishing read receipts: {e}")
+
+    def record(self, chat_id: str, user_id: str, seq: int, participants: List[str]):
+        """Queue a moved watermark for the next flush"""
+        self.received += 1
+        readers = self._pending.setdefault(chat_id, {})
+        if user_id in readers:
+            self.coalesced += 1
+        readers[user_id] = max(readers.get(user_id, -1), seq)
+        self._participants[chat_id] = participants
+
+    def flush(self) -> int:
+        """Publish every pending receipt; returns the number of frames published"""
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        participants, self._participants = self._participants, {}
+        for chat_id, readers in pending.items():
+            self.publish(dumps({
+                "type": "read_receipts",
+                "chat_id": chat_id,
+                "read_seqs": readers
+            }), participants[chat_id], None)
+        self.published += len(pending)
+        return len(pending)
+
+    def get_metrics(self) -> dict:
+        return {
+            "pending": sum(len(readers) for readers in self._pending.values()),
+            "received": self.received,
+            "published": self.published,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,196 @@
+"""In-memory inverted index over message text.
+
+Every indexed message gets a document number in the order it was added, which
+is also time order, so the newest matches are found by walking postings
+backwards and a page of results stops as soon as it is full. Postings are
+compact ``array`` buffers of document numbers; the document table maps each
+number back to its chat and position.
+
+Queries are ANDed clauses: a bare word matches that word, ``word*`` matches
+any word starting with it, and ``"two words"`` matches the words adjacent and
+in order. Access control happens during the walk: only documents in chats the
+caller may read are returned.
+"""
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from array import array
+from bisect import bisect_left, insort
+import heapq
+import re
+
+_TOKEN = re.compile(r"\w+")
+_CLAUSE = re.compile(r'"([^"]*)"|(\S+)')
+
+# Most vocabulary terms a single prefix clause expands to
+MAX_PREFIX_TERMS = 256
+# Scope passed to pagination.encode_cursor for search result cursors
+CURSOR_SCOPE = "search"
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+def _contains_phrase(tokens: List[str], phrase: List[str]) -> bool:
+    width = len(phrase)
+    first = phrase[0]
+    for start in range(len(tokens) - width + 1):
+        if tokens[start] == first and tokens[start:start + width] == phrase:
+            return True
+    return False
+
+
+class _Clause:
+    """Sorted postings of one or more terms, matched as a union"""
+    def __init__(self, postings: List[array]):
+        self.postings = postings
+        self.size = sum(len(docs) for docs in postings)
+
+    def contains(self, doc: int) -> bool:
+        for docs in self.postings:
+            index = bisect_left(docs, doc)
+            if index < len(docs) and docs[index] == doc:
+                return True
+        return False
+
+    def iter_desc(self, before: int) -> Iterator[int]:
+        """Documents below ``before``, newest first"""
+        if len(self.postings) == 1:
+            return _desc(self.postings[0], before)
+        return self._merge_desc(before)
+
+    def _merge_desc(self, before: int) -> Iterator[int]:
+        previous = None
+        for doc in heapq.merge(*(_desc(docs, before) for docs in self.postings), reverse=True):
+            if doc != previous:
+                previous = doc
+                yield doc
+
+
+def _desc(docs: array, before: int) -> Iterator[int]:
+    for index in range(bisect_left(docs, before) - 1, -1, -1):
+        yield docs[index]
+
+
+class SearchIndex:
+    def __init__(self):
+        self._postings: Dict[str, array] = {}
+        # Sorted vocabulary for prefix expansion
+        self._terms: List[str] = []
+        # Document table: doc number -> chat number, position in chat
+        self._doc_chat = array("I")
+        self._doc_seq = array("I")
+        self._chat_numbers: Dict[str, int] = {}
+        self._chat_ids: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._doc_seq)
+
+    @property
+    def term_count(self) -> int:
+        return len(self._terms)
+
+    def _chat_number(self, chat_id: str) -> int:
+        number = self._chat_numbers.get(chat_id)
+        if number is None:
+            number = self._chat_numbers[chat_id] = len(self._chat_ids)
+            self._chat_ids.append(chat_id)
+        return number
+
+    def add(self, chat_id: str, seq: int, text: str):
+        """Index one message; messages must be added oldest first"""
+        doc = len(self._doc_seq)
+        self._doc_chat.append(self._chat_number(chat_id))
+        self._doc_seq.append(seq)
+        for term in set(tokenize(text)):
+            docs = self._postings.get(term)
+            if docs is None:
+                docs = self._postings[term] = array("I")
+                insort(self._terms, term)
+            docs.append(doc)
+
+    def _expand(self, prefix: str) -> List[array]:
+        start = bisect_left(self._terms, prefix)
+        postings = []
+        for term in self._terms[start:start + MAX_PREFIX_TERMS]:
+            if not term.startswith(prefix):
+                break
+            postings.append(self._postings[term])
+        return postings
+
+    def _parse(self, query: str) -> Tuple[List[_Clause], List[List[str]]]:
+        """Clauses to intersect plus phrases to verify against message text.
+
+        Raises ValueError for a query without any searchable words.
+        """
+        clauses: List[_Clause] = []
+        phrases: List[List[str]] = []
+        for quoted, word in _CLAUSE.findall(query):
+            if quoted:
+                terms = tokenize(quoted)
+                if len(terms) > 1:
+                    phrases.append(terms)
+                for term in terms:
+                    clauses.append(_Clause([self._postings.get(term, array("I"))]))
+            elif word.endswith("*"):
+                terms = tokenize(word[:-1])
+                for term in terms[:-1]:
+                    clauses.append(_Clause([self._postings.get(term, array("I"))]))
+                if terms:
+                    # Only the last word of e.g. "re-sche*" is a prefix
+                    clauses.append(_Clause(self._expand(terms[-1])))
+            else:
+                for term in tokenize(word):
+                    clauses.append(_Clause([self._postings.get(term, array("I"))]))
+        if not clauses:
+            raise ValueError("Empty search query")
+        return clauses, phrases
+
+    def search(
+        self,
+        query: str,
+        chat_ids: Iterable[str],
+        limit: int,
+        before: Optional[int] = None,
+        fetch: Optional[Callable[[str, int], object]] = None
+    ) -> Tuple[List[Tuple[str, int, object]], Optional[int]]:
+        """Newest matches in ``chat_ids`` below document ``before``.
+
+        Returns up to ``limit`` ``(chat_id, seq, message)`` hits and the
+        document number to continue from, or None on the last page.
+        ``fetch(chat_id, seq)`` returns the message, whose ``text`` is used to
+        verify phrases; hits it cannot find are skipped.
+        """
+        clauses, phrases = self._parse(query)
+        allowed: Set[int] = {
+            self._chat_numbers[chat_id] for chat_id in chat_ids if chat_id in self._chat_numbers
+        }
+        hits: List[Tuple[str, int, object]] = []
+        if not allowed:
+            return hits, None
+        last_doc = None
+
+        clauses.sort(key=lambda clause: clause.size)
+        driver, others = clauses[0], clauses[1:]
+        start = len(self._doc_seq) if before is None else before
+        for doc in driver.iter_desc(start):
+            if self._doc_chat[doc] not in allowed:
+                continue
+            if not all(clause.contains(doc) for clause in others):
+                continue
+            chat_id = self._chat_ids[self._doc_chat[doc]]
+            seq = self._doc_seq[doc]
+            message = None
+            if fetch is not None:
+                message = fetch(chat_id, seq)
+                if message is None:
+                    continue
+            if phrases and message is not None:
+                tokens = tokenize(message.text)
+                if not all(_contains_phrase(tokens, phrase) for phrase in phrases):
+                    continue
+            if len(hits) == limit:
+                # One more match exists, so there is a next page
+                return hits, last_doc
+            hits.append((chat_id, seq, message))
+            last_doc = doc
+        return hits, None
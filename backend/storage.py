@@ -0,0 +1,434 @@
+from typing import IO, Any, Dict, Iterable, List, Optional
+from contextlib import contextmanager
+import json
+import queue
+import sqlite3
+import threading
+from models import Chat, User
+from persistence import WriteAheadLog, FSYNC_INTERVAL
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - no advisory locks on Windows
+    fcntl = None
+
+
+class StoreInUse(RuntimeError):
+    """Another process already has the store open"""
+
+
+def lock_store(path: str) -> Optional[IO]:
+    """Hold an exclusive lock on ``path + ".lock"`` until the returned file is closed.
+
+    Chat state lives in the memory of the process that loaded it, so two
+    processes on one store would hand out the same log sequence numbers and
+    message positions and overwrite each other's snapshots. A second
+    process, such as another gunicorn worker, fails to start instead.
+    """
+    if fcntl is None:
+        return None
+    lock_file = open(path + ".lock", "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        raise StoreInUse(
+            f"{path} is already open in another process; run a single worker, "
+            f"or give each server its own DATA_FILE/STORAGE_URL"
+        )
+    return lock_file
+
+
+class StorageEngine:
+    """Where ChatService keeps its users, chats and messages.
+
+    ``load`` returns the replay-state layout used by the write-ahead log:
+    users and chats keyed by id, where each chat carries the messages the
+    engine chose to load plus ``message_offset``, the position of the first
+    of them. Mutations arrive in batches from the ``GroupCommitWriter``
+    thread as the same records the write-ahead log stores.
+
+    Engines with ``pages_messages`` set can serve any written position
+    through ``fetch_messages``, so messages may be dropped from memory.
+    """
+    pages_messages = False
+
+    def load(self, recent: Optional[int] = None) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def write_batch(self, records: List[Dict[str, Any]]):
+        """Store a batch of mutation records with as few writes as possible"""
+        raise NotImplementedError
+
+    def sync(self):
+        """Make every written batch durable"""
+
+    def fetch_messages(self, chat_id: str, start: int, end: int) -> List[Dict[str, Any]]:
+        """Messages at positions [start, end) that ``load`` did not return"""
+        return []
+
+    def write_snapshot(self, users: Iterable[User], chats: Iterable[Chat]):
+        """Persist the complete in-memory state in one go"""
+        raise NotImplementedError
+
+    def close(self):
+        self.sync()
+
+
+class JsonStorage(StorageEngine):
+    """The JSON snapshot plus write-ahead log; always loads every message"""
+    def __init__(
+        self,
+        data_file: str = "chat_data.json",
+        fsync: str = FSYNC_INTERVAL,
+        compact_threshold: int = 10000
+    ):
+        self._store_lock = lock_store(data_file)
+        self.wal = WriteAheadLog(data_file, fsync=fsync, compact_threshold=compact_threshold)
+
+    def load(self, recent: Optional[int] = None) -> Dict[str, Any]:
+        state = self.wal.load()
+        for chat_data in state["chats"].values():
+            chat_data["message_offset"] = 0
+        return state
+
+    def write_batch(self, records: List[Dict[str, Any]]):
+        self.wal.append_many(records)
+
+    def sync(self):
+        self.wal.flush()
+
+    def write_snapshot(self, users: Iterable[User], chats: Iterable[Chat]):
+        self.wal.write_snapshot({
+            'users': [user.to_dict() for user in users],
+            'chats': [chat.to_dict() for chat in chats]
+        })
+
+    def close(self):
+        self.wal.close()
+        if self._store_lock is not None:
+            self._store_lock.close()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    avatar TEXT,
+    last_seen INTEGER
+);
+CREATE TABLE IF NOT EXISTS chats (
+    chat_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    chat_type TEXT NOT NULL,
+    participants TEXT NOT NULL,
+    avatar TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    chat_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    message_id TEXT NOT NULL,
+    sender_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    message_type TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    attachment TEXT,
+    PRIMARY KEY (chat_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS messages_chat_timestamp ON messages (chat_id, timestamp);
+CREATE TABLE IF NOT EXISTS read_seqs (
+    chat_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, user_id)
+) WITHOUT ROWID;
+"""
+
+MESSAGE_COLUMNS = "message_id, chat_id, sender_id, text, message_type, timestamp, attachment"
+
+
+def _message_row(row) -> Dict[str, Any]:
+    message = {
+        "message_id": row[0],
+        "chat_id": row[1],
+        "sender_id": row[2],
+        "text": row[3],
+        "message_type": row[4],
+        "timestamp": row[5],
+    }
+    if row[6] is not None:
+        message["attachment"] = json.loads(row[6])
+    return message
+
+
+class SqliteStorage(StorageEngine):
+    """Embedded SQLite driver.
+
+    Runs in WAL journal mode so readers never wait for the writer. Each
+    batch is committed as one transaction with batched inserts, and reads
+    use a small pool of connections. Only the most recent ``recent``
+    messages per chat are loaded at startup; older pages are read through
+    the ``(chat_id, position)`` primary key on demand.
+    """
+    pages_messages = True
+
+    def __init__(
+        self,
+        path: str = "chat_data.db",
+        pool_size: int = 4,
+        synchronous: str = "NORMAL"
+    ):
+        self.path = path
+        self.synchronous = synchronous
+        self._store_lock = lock_store(path)
+
+        writer = self._connect()
+        writer.executescript(SCHEMA)
+        columns = [row[1] for row in writer.execute("PRAGMA table_info(users)")]
+        if "last_seen" not in columns:
+            # Databases created before last_seen was persisted
+            writer.execute("ALTER TABLE users ADD COLUMN last_seen INTEGER")
+        columns = [row[1] for row in writer.execute("PRAGMA table_info(messages)")]
+        if "attachment" not in columns:
+            # Databases created before media messages
+            writer.execute("ALTER TABLE messages ADD COLUMN attachment TEXT")
+        writer.commit()
+        self._writer_conn = writer
+        self._write_lock = threading.Lock()
+
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(pool_size):
+            self._pool.put(self._connect())
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    # Reading
+
+    def load(self, recent: Optional[int] = None) -> Dict[str, Any]:
+        state = {"users": {}, "chats": {}}
+        with self._connection() as conn:
+            for user_id, username, avatar, last_seen in conn.execute(
+                "SELECT user_id, username, avatar, last_seen FROM users"
+            ):
+                state["users"][user_id] = {
+                    "user_id": user_id,
+                    "username": username,
+                    "avatar": avatar,
+                    "last_seen_us": last_seen,
+                }
+
+            read_seqs: Dict[str, Dict[str, int]] = {}
+            for chat_id, user_id, seq in conn.execute("SELECT chat_id, user_id, seq FROM read_seqs"):
+                read_seqs.setdefault(chat_id, {})[user_id] = seq
+
+            for chat_id, name, chat_type, participants, avatar in conn.execute(
+                "SELECT chat_id, name, chat_type, participants, avatar FROM chats"
+            ).fetchall():
+                (count,) = conn.execute(
+                    "SELECT COALESCE(MAX(position) + 1, 0) FROM messages WHERE chat_id = ?",
+                    (chat_id,)
+                ).fetchone()
+                offset = 0 if recent is None else max(count - recent, 0)
+                rows = conn.execute(
+                    f"SELECT {MESSAGE_COLUMNS} FROM messages "
+                    "WHERE chat_id = ? AND position >= ? ORDER BY position",
+                    (chat_id, offset)
+                ).fetchall()
+                state["chats"][chat_id] = {
+                    "chat_id": chat_id,
+                    "name": name,
+                    "chat_type": chat_type,
+                    "participants": json.loads(participants),
+                    "avatar": avatar,
+                    "messages": [_message_row(row) for row in rows],
+                    "message_offset": offset,
+                    "read_seqs": read_seqs.get(chat_id, {}),
+                }
+        return state
+
+    def fetch_messages(self, chat_id: str, start: int, end: int) -> List[Dict[str, Any]]:
+        with self._connection() as conn:
+            rows = conn.execute(
+                f"SELECT {MESSAGE_COLUMNS} FROM messages "
+                "WHERE chat_id = ? AND position >= ? AND position < ? ORDER BY position",
+                (chat_id, start, end)
+            ).fetchall()
+        return [_message_row(row) for row in rows]
+
+    # Writing
+
+    def sync(self):
+        """Commits are already durable with ``synchronous=FULL``; the default
+        NORMAL may lose the last transactions on power loss, not on a crash"""
+
+    def close(self):
+        with self._write_lock:
+            self._writer_conn.close()
+        while not self._pool.empty():
+            self._pool.get().close()
+        if self._store_lock is not None:
+            self._store_lock.close()
+
+    def write_snapshot(self, users: Iterable[User], chats: Iterable[Chat]):
+        records = []
+        for user in users:
+            records.append({
+                "op": "user",
+                "user_id": user.user_id,
+                "username": user.username,
+                "avatar": user.avatar,
+                "last_seen_us": user.last_seen_us,
+            })
+        for chat in chats:
+            records.append({
+                "op": "chat",
+                "chat_id": chat.chat_id,
+                "name": chat.name,
+                "chat_type": chat.chat_type,
+                "participants": chat.participants,
+                "avatar": chat.avatar,
+            })
+            for user_id, seq in chat.read_seqs.items():
+                records.append({"op": "read", "chat_id": chat.chat_id, "user_id": user_id, "seq": seq})
+            if not chat.messages_loaded:
+                # Evicted or never loaded; everything it has is already stored
+                continue
+            for index, message in enumerate(chat.messages):
+                records.append({
+                    "op": "message",
+                    "message_id": message.message_id,
+                    "chat_id": chat.chat_id,
+                    "sender_id": message.sender_id,
+                    "text": message.text,
+                    "message_type": message.message_type.value,
+                    "timestamp": message.timestamp.isoformat(),
+                    "position": chat.message_offset + index,
+                    "attachment": message.attachment,
+                })
+        self.write_batch(records)
+
+    def write_batch(self, records: List[Dict[str, Any]]):
+        with self._write_lock:
+            self._write_batch(records)
+
+    def _write_batch(self, records: List[Dict[str, Any]]):
+        conn = self._writer_conn
+        messages = []
+        # (chat_id, user_id) -> highest seq read; a sender has read their own message
+        reads: Dict[tuple, int] = {}
+        # user_id -> newest last_seen in the batch
+        presence: Dict[str, int] = {}
+        with conn:
+            for record in records:
+                op = record["op"]
+                if op == "message":
+                    messages.append((
+                        record["chat_id"],
+                        record["position"],
+                        record["message_id"],
+                        record["sender_id"],
+                        record["text"],
+                        record.get("message_type", "text"),
+                        record["timestamp"],
+                        json.dumps(record["attachment"]) if record.get("attachment") is not None else None,
+                    ))
+                    key = (record["chat_id"], record["sender_id"])
+                    reads[key] = max(reads.get(key, -1), record["position"])
+                    continue
+                if op == "read":
+                    key = (record["chat_id"], record["user_id"])
+                    reads[key] = max(reads.get(key, -1), record["seq"])
+                    continue
+                if op == "presence":
+                    presence[record["user_id"]] = record["last_seen_us"]
+                    continue
+
+                # Keep ordering: write queued messages before any other change
+                if messages:
+                    self._insert_messages(conn, messages)
+                    messages = []
+                if op == "user":
+                    # Plain user records carry no last_seen; keep the stored one
+                    conn.execute(
+                        "INSERT INTO users (user_id, username, avatar, last_seen) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (user_id) DO UPDATE SET username = excluded.username, "
+                        "avatar = excluded.avatar, last_seen = COALESCE(excluded.last_seen, users.last_seen)",
+                        (record["user_id"], record["username"], record.get("avatar"), record.get("last_seen_us"))
+                    )
+                elif op == "chat":
+                    conn.execute(
+                        "INSERT OR REPLACE INTO chats (chat_id, name, chat_type, participants, avatar) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (
+                            record["chat_id"],
+                            record["name"],
+                            record["chat_type"],
+                            json.dumps(record["participants"]),
+                            record.get("avatar"),
+                        )
+                    )
+                elif op in ("join", "leave"):
+                    row = conn.execute(
+                        "SELECT participants FROM chats WHERE chat_id = ?", (record["chat_id"],)
+                    ).fetchone()
+                    if row is None:
+                        continue
+                    participants = json.loads(row[0])
+                    if op == "join" and record["user_id"] not in participants:
+                        participants.append(record["user_id"])
+                    elif op == "leave" and record["user_id"] in participants:
+                        participants.remove(record["user_id"])
+                    conn.execute(
+                        "UPDATE chats SET participants = ? WHERE chat_id = ?",
+                        (json.dumps(participants), record["chat_id"])
+                    )
+            if messages:
+                self._insert_messages(conn, messages)
+            if reads:
+                # Watermarks only move forward, so these can go last
+                conn.executemany(
+                    "INSERT INTO read_seqs (chat_id, user_id, seq) VALUES (?, ?, ?) "
+                    "ON CONFLICT (chat_id, user_id) DO UPDATE SET seq = MAX(seq, excluded.seq)",
+                    [(chat_id, user_id, seq) for (chat_id, user_id), seq in reads.items()]
+                )
+            if presence:
+                # After the batch's user records, which never carry last_seen
+                conn.executemany(
+                    "UPDATE users SET last_seen = ? WHERE user_id = ?",
+                    [(last_seen, user_id) for user_id, last_seen in presence.items()]
+                )
+
+    @staticmethod
+    def _insert_messages(conn: sqlite3.Connection, rows: List[tuple]):
+        conn.executemany(
+            "INSERT OR IGNORE INTO messages "
+            "(chat_id, position, message_id, sender_id, text, message_type, timestamp, attachment) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+
+
+def create_storage(url: Optional[str], **options) -> StorageEngine:
+    """Build a storage engine from ``STORAGE_URL``.
+
+    ``json://chat_data.json`` (the default when empty) or ``sqlite:///path/to.db``.
+    """
+    if not url:
+        return JsonStorage(**options)
+    if url.startswith("json://"):
+        return JsonStorage(url[len("json://"):], **options)
+    if url.startswith("sqlite://"):
+        return SqliteStorage(url[len("sqlite://"):], **options)
+    raise ValueError(f"Unsupported storage URL: {url}")
@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+import pytest
+
+from async_chat_service import AsyncChatService
+from chat_service import ChatService
+from group_commit import CommitFailed
+from storage import create_storage
+
+
+def facade_for(tmp_path) -> AsyncChatService:
+    url = "sqlite://" + str(tmp_path / "chat_data.db")
+    return AsyncChatService(lambda: ChatService(storage=create_storage(url), lazy=True))
+
+
+def test_service_work_does_not_stall_the_event_loop(tmp_path):
+    def busy(service: ChatService):
+        # Storage writes and a snapshot, plus a stand-in for a slow disk
+        for n in range(500):
+            service.add_message("chat_2", "alice", f"burst {n}")
+        service.save_data()
+        time.sleep(0.3)
+
+    async def scenario():
+        facade = facade_for(tmp_path)
+        await facade.start()
+        loop = asyncio.get_event_loop()
+        lags = []
+        work = loop.create_task(facade._call(busy, facade.service))
+        while not work.done():
+            due = loop.time() + 0.005
+            await asyncio.sleep(0.005)
+            lags.append(loop.time() - due)
+        await work
+        await facade.close()
+        return lags
+
+    lags = asyncio.run(scenario())
+    assert len(lags) > 20
+    assert max(lags) < 0.1
+
+
+def test_only_participants_can_send(tmp_path):
+    async def scenario():
+        facade = facade_for(tmp_path)
+        await facade.start()
+        before = (await facade.history("alice", "chat_1"))["messages"]
+        with pytest.raises(PermissionError):
+            await facade.send_message("charlie", "chat_1", "not my chat")
+        with pytest.raises(PermissionError):
+            # Nothing of a batch is stored if any chat in it is not the sender's
+            await facade.send_messages("charlie", {"chat_2": [("mine", None)], "chat_1": [("not mine", None)]})
+        assert (await facade.history("alice", "chat_1"))["messages"] == before
+        assert "mine" not in [m["text"] for m in (await facade.history("charlie", "chat_2"))["messages"]]
+        sent = await facade.send_message("alice", "chat_1", "mine")
+        assert sent[0]["text"] == "mine"
+        await facade.close()
+
+    asyncio.run(scenario())
+
+
+def test_contacts_are_dropped_when_a_user_leaves(tmp_path):
+    async def scenario():
+        facade = facade_for(tmp_path)
+        await facade.start()
+        await facade.join_user("charlie")
+        assert "alice" in facade.contacts("charlie")
+        facade.leave_user("charlie")
+        assert facade.contacts("charlie") == set()
+        assert "charlie" not in facade._contacts
+        await facade.close()
+
+    asyncio.run(scenario())
+
+
+def test_sends_wait_for_their_commit(tmp_path):
+    async def scenario():
+        facade = facade_for(tmp_path)
+        await facade.start()
+        facade.service.writer.retries = 0
+        write_batch = facade.service.storage.write_batch
+
+        def broken(records):
+            raise OSError("disk full")
+
+        facade.service.storage.write_batch = broken
+        with pytest.raises(CommitFailed):
+            await facade.send_message("alice", "chat_1", "not stored")
+        facade.service.storage.write_batch = write_batch
+        await facade.send_message("alice", "chat_1", "stored")
+        assert facade.service.writer.records == facade.service.writer.submitted
+        await facade.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,60 @@
+import hashlib
+import threading
+
+from blob_store import BlobStore, OffsetMismatch
+
+
+def race(workers):
+    """Run the callables at once; returns what each returned or raised"""
+    barrier = threading.Barrier(len(workers))
+    outcomes = [None] * len(workers)
+
+    def run(index, work):
+        barrier.wait()
+        try:
+            outcomes[index] = work()
+        except Exception as e:
+            outcomes[index] = e
+
+    threads = [threading.Thread(target=run, args=(index, work)) for index, work in enumerate(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+def test_one_chunk_wins_each_offset(tmp_path):
+    store = BlobStore(str(tmp_path))
+    for _ in range(50):
+        session = store.begin("alice", "file.bin", "application/octet-stream")
+        chunks = [bytes([n]) * 65536 for n in range(4)]
+        outcomes = race([lambda chunk=chunk: store.append(session.upload_id, 0, chunk) for chunk in chunks])
+        assert outcomes.count(65536) == 1
+        assert all(isinstance(outcome, OffsetMismatch) for outcome in outcomes if outcome != 65536)
+
+        winner = chunks[outcomes.index(65536)]
+        metadata = store.commit(session.upload_id)
+        assert metadata["size"] == len(winner)
+        assert metadata["blob_id"] == hashlib.sha256(winner).hexdigest()
+        with open(store.path(metadata["blob_id"]), "rb") as f:
+            assert f.read() == winner
+
+
+def test_chunk_racing_the_commit_is_in_the_blob_or_refused(tmp_path):
+    store = BlobStore(str(tmp_path))
+    for attempt in range(50):
+        session = store.begin("alice", "file.bin", "application/octet-stream")
+        store.append(session.upload_id, 0, b"first " * 1000)
+        metadata, appended = race([
+            lambda: store.commit(session.upload_id),
+            lambda: store.append(session.upload_id, 6000, f"second {attempt}".encode() * 1000),
+        ])
+        with open(store.path(metadata["blob_id"]), "rb") as f:
+            content = f.read()
+        assert metadata["blob_id"] == hashlib.sha256(content).hexdigest()
+        assert len(content) == metadata["size"]
+        if isinstance(appended, KeyError):
+            assert metadata["size"] == 6000
+        else:
+            assert metadata["size"] == appended
@@ -0,0 +1,63 @@
+import asyncio
+from typing import List
+
+from connection_manager import ConnectionManager
+from fanout import ShardedFanout
+
+
+class RecordingSocket:
+    def __init__(self):
+        self.frames: List[str] = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        self.frames.append(data)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def deliver_to_large_group():
+    fanout = ShardedFanout(shards=4, threshold=10, slice_size=3)
+    manager = ConnectionManager(fanout=fanout)
+    fanout.start()
+    members = [f"user{i}" for i in range(60)]
+    sockets = {}
+    # Two thirds online, some of them on two devices
+    for n, user_id in enumerate(members):
+        if n % 3 == 2:
+            continue
+        sessions = 2 if n % 5 == 0 else 1
+        sockets[user_id] = [RecordingSocket() for _ in range(sessions)]
+        for socket in sockets[user_id]:
+            await manager.connect(socket, user_id)
+
+    frames = [f'{{"type":"new_message","n":{n}}}' for n in range(5)]
+    for frame in frames:
+        manager.broadcast_to_users(frame, members)
+    for _ in range(1000):
+        done = fanout.completed == len(frames) and all(
+            len(socket.frames) == len(frames) for sessions in sockets.values() for socket in sessions
+        )
+        if done:
+            break
+        await asyncio.sleep(0.001)
+    await fanout.stop()
+    for user_id in list(manager.active_connections):
+        manager.disconnect_user(user_id)
+    return fanout, sockets, frames, members
+
+
+def test_every_online_recipient_gets_every_frame_in_order():
+    fanout, sockets, frames, members = asyncio.run(deliver_to_large_group())
+    for user_id, sessions in sockets.items():
+        for socket in sessions:
+            assert socket.frames == frames, user_id
+    # Recipients really were spread over several shards
+    assert len({hash(user_id) % fanout.shards for user_id in sockets}) > 1
+    assert fanout.deliveries == fanout.completed == len(frames)
+    assert fanout.skipped_offline == len(frames) * (len(members) - len(sockets))
+    assert fanout.recipients == len(frames) * len(sockets)
+    assert fanout.backlog() == 0
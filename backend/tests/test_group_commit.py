@@ -0,0 +1,70 @@
+import pytest
+
+from chat_service import ChatService
+from group_commit import ACK_ON_FSYNC, CommitFailed, GroupCommitWriter
+from storage import create_storage
+
+
+class FlakyStorage:
+    """Fails the first ``failures`` writes, then stores batches in order"""
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.batches = []
+
+    def write_batch(self, records):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("disk hiccup")
+        self.batches.append([record["n"] for record in records])
+
+    def sync(self):
+        pass
+
+
+def test_a_failed_batch_is_retried_in_order():
+    storage = FlakyStorage(failures=2)
+    writer = GroupCommitWriter(storage, durability=ACK_ON_FSYNC, max_delay=0.01, retry_delay=0.001)
+    futures = [writer.submit("message", n=n) for n in range(5)]
+    writer.flush()
+    for future in futures:
+        assert future.result() is None
+    assert [n for batch in storage.batches for n in batch] == list(range(5))
+    assert writer.records == writer.submitted == 5
+    assert writer.failed == 0
+    writer.close()
+
+
+def test_a_batch_that_keeps_failing_is_given_up_and_counted():
+    storage = FlakyStorage(failures=3)
+    writer = GroupCommitWriter(storage, retries=2, retry_delay=0.001)
+    lost = writer.submit("message", n=0)
+    with pytest.raises(CommitFailed):
+        lost.result()
+    kept = writer.submit("message", n=1)
+    assert kept.result() is None
+    # Later records are not stuck behind the lost ones
+    assert writer.records == writer.submitted == 2
+    assert writer.failed == 1
+    assert storage.batches == [[1]]
+    writer.close()
+
+
+def test_messages_after_a_lost_batch_drain_from_the_unwritten_list(tmp_path):
+    service = ChatService(storage=create_storage("sqlite://" + str(tmp_path / "chat_data.db")))
+    service.writer.retries = 0
+    write_batch = service.storage.write_batch
+
+    def broken(records):
+        raise OSError("disk full")
+
+    service.storage.write_batch = broken
+    service.add_message("chat_1", "alice", "lost")
+    with pytest.raises(CommitFailed):
+        service.committed().result()
+    service.storage.write_batch = write_batch
+    service.add_message("chat_1", "alice", "kept")
+    service.committed().result()
+    chat = service.get_chat("chat_1")
+    assert service._written(chat) == chat.message_count
+    assert not service._unwritten
+    service.close()
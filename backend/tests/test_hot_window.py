@@ -0,0 +1,27 @@
+import asyncio
+
+from async_chat_service import AsyncChatService
+from chat_service import ChatService
+from storage import create_storage
+
+
+def test_idle_chats_are_swept_to_the_age_limit(tmp_path):
+    url = "sqlite://" + str(tmp_path / "chat_data.db")
+
+    async def scenario():
+        facade = AsyncChatService(
+            lambda: ChatService(storage=create_storage(url), hot_window_age=0.1),
+            sweep_interval=0.05
+        )
+        await facade.start()
+        for n in range(20):
+            await facade.send_message("alice", "chat_2", f"message {n}")
+        await facade._call(lambda: facade.service.committed().result())
+        # Nobody touches the chat again; only the sweeper can trim it
+        await asyncio.sleep(0.5)
+        stats = await facade._call(facade.service.get_cache_stats)
+        await facade.close()
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert stats["trimmed_messages"] >= 20
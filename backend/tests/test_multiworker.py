@@ -0,0 +1,133 @@
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+websockets = pytest.importorskip("websockets")
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+GROUP_CHAT = "chat_2"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(connect, timeout: float = 20.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            connect().close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """A chat service, a backplane broker and two workers sharing them; yields the worker ports"""
+    service_path = str(tmp_path / "service.sock")
+    broker_path = str(tmp_path / "backplane.sock")
+    env = dict(
+        os.environ,
+        DATA_FILE=str(tmp_path / "chat_data.json"),
+        MEDIA_ROOT=str(tmp_path / "media"),
+        CHAT_SERVICE_URL="unix://" + service_path,
+        BACKPLANE_URL="unix://" + broker_path,
+    )
+    processes = [
+        subprocess.Popen([sys.executable, "chat_rpc.py", "--path", service_path], cwd=BACKEND, env=env),
+        subprocess.Popen([sys.executable, "backplane.py", "--path", broker_path], cwd=BACKEND, env=env),
+    ]
+    ports = [free_port(), free_port()]
+    try:
+        for path in (service_path, broker_path):
+            def connect(path=path):
+                s = socket.socket(socket.AF_UNIX)
+                s.connect(path)
+                return s
+            wait_for(connect)
+        for port in ports:
+            processes.append(subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                cwd=BACKEND, env=env
+            ))
+        for port in ports:
+            wait_for(lambda: socket.create_connection(("127.0.0.1", port)))
+        yield ports
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait(timeout=10)
+
+
+async def receive(ws, kind: str) -> dict:
+    """The next event of one type, looking inside batched frames"""
+    while True:
+        frame = json.loads(await asyncio.wait_for(ws.recv(), 10))
+        for event in frame["events"] if frame["type"] == "events" else [frame]:
+            if event["type"] == kind:
+                return event
+
+
+async def connect(port: int, user_id: str, since: dict = None):
+    url = f"ws://127.0.0.1:{port}/ws/{user_id}"
+    if since is not None:
+        url += "?since=" + json.dumps(since, separators=(",", ":"))
+    ws = await websockets.connect(url)
+    first = await receive(ws, "sync" if since is not None else "initial_data")
+    return ws, first
+
+
+async def scenario(ports):
+    # Members of one group spread over both workers
+    alice, _ = await connect(ports[0], "alice")
+    bob, first = await connect(ports[1], "bob")
+    charlie, _ = await connect(ports[1], "charlie")
+    start = next(chat for chat in first["chats"] if chat["id"] == GROUP_CHAT)["last_seq"] + 1
+
+    # Senders on both workers write into the same chat
+    for n in range(4):
+        await alice.send(json.dumps({"type": "send_message", "chat_id": GROUP_CHAT, "text": f"alice {n}"}))
+        await bob.send(json.dumps({"type": "send_message", "chat_id": GROUP_CHAT, "text": f"bob {n}"}))
+    seen = [(await receive(charlie, "new_message"))["message"] for _ in range(8)]
+    assert sorted(message["seq"] for message in seen) == list(range(start, start + 8))
+
+    # Bob drops, misses messages sent on the other worker and comes back there
+    await bob.close()
+    for n in range(3):
+        await alice.send(json.dumps({"type": "send_message", "chat_id": GROUP_CHAT, "text": f"missed {n}"}))
+    for _ in range(3):
+        await receive(charlie, "new_message")
+    bob, sync = await connect(ports[0], "bob", since={GROUP_CHAT: start + 7})
+    delta = next(delta for delta in sync["deltas"] if delta["chat_id"] == GROUP_CHAT)
+    assert [message["text"] for message in delta["messages"]] == ["missed 0", "missed 1", "missed 2"]
+    assert [message["seq"] for message in delta["messages"]] == [start + 8, start + 9, start + 10]
+
+    # Both workers page through the same history
+    pages = []
+    for ws in (alice, charlie):
+        await ws.send(json.dumps({"type": "load_history", "chat_id": GROUP_CHAT, "limit": 11}))
+        pages.append([(m["seq"], m["text"]) for m in (await receive(ws, "history"))["messages"]])
+    assert pages[0] == pages[1]
+    assert [seq for seq, _ in pages[0]] == list(range(start, start + 11))
+
+    # A read watermark set on one worker reaches a sender on the other
+    await bob.send(json.dumps({"type": "mark_read", "chat_id": GROUP_CHAT, "seq": start + 10}))
+    receipt = await receive(alice, "read_receipts")
+    assert receipt["chat_id"] == GROUP_CHAT
+    for ws in (alice, bob, charlie):
+        await ws.close()
+
+
+def test_members_on_different_workers_share_history_and_seqs(workers):
+    asyncio.run(scenario(workers))
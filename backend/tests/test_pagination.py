@@ -0,0 +1,80 @@
+import pytest
+
+from chat_service import ChatService
+from pagination import MAX_SYNC_DELTA, encode_cursor
+from storage import create_storage
+
+
+@pytest.fixture(params=[("json://", "chat_data.json"), ("sqlite://", "chat_data.db")], ids=["json", "sqlite"])
+def service(request, tmp_path):
+    scheme, name = request.param
+    service = ChatService(storage=create_storage(scheme + str(tmp_path / name)))
+    yield service
+    service.close()
+
+
+def texts(page):
+    return [message["text"] for message in page["messages"]]
+
+
+def test_seqs_are_numbered_per_chat(service):
+    first = [service.add_message("chat_1", "alice", f"one {n}").seq for n in range(3)]
+    other = [service.add_message("chat_2", "alice", f"two {n}").seq for n in range(3)]
+    first.append(service.add_message("chat_1", "bob", "one 3").seq)
+    assert first == list(range(first[0], first[0] + 4))
+    assert other == list(range(other[0], other[0] + 3))
+    assert service.get_chat("chat_1").message_count == first[-1] + 1
+
+
+def test_pages_walk_back_and_forward_with_cursors(service):
+    start = service.get_chat("chat_2").message_count
+    for n in range(25):
+        service.add_message("chat_2", "alice", f"page {n}")
+
+    latest = service.get_chat_history("chat_2", limit=10)
+    assert texts(latest) == [f"page {n}" for n in range(15, 25)]
+    assert latest["has_more_before"] and not latest["has_more_after"]
+
+    older = service.get_chat_history("chat_2", before=latest["before"], limit=10)
+    assert texts(older) == [f"page {n}" for n in range(5, 15)]
+    assert older["has_more_after"]
+
+    newer = service.get_chat_history("chat_2", after=older["after"], limit=10)
+    assert texts(newer) == texts(latest)
+    assert not newer["has_more_after"]
+
+    oldest = service.get_chat_history("chat_2", before=encode_cursor("chat_2", start), limit=200)
+    assert not oldest["has_more_before"] and oldest["before"] is None
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor", encode_cursor("chat_1", 1), encode_cursor("chat_2", -1)])
+def test_bad_cursors_are_rejected(service, cursor):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        service.get_chat_history("chat_2", before=cursor)
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        service.get_chat_history("chat_2", after=cursor)
+
+
+def test_reconnect_gets_only_missed_messages(service):
+    seen = service.get_chat("chat_2").message_count - 1
+    current = service.get_chat("chat_1").message_count - 1
+    for n in range(3):
+        service.add_message("chat_2", "bob", f"missed {n}")
+
+    sync = service.get_sync_delta("alice", {"chat_1": current, "chat_2": seen, "gone": 4})
+    assert [delta["chat_id"] for delta in sync["deltas"]] == ["chat_2"]
+    delta = sync["deltas"][0]
+    assert texts(delta) == ["missed 0", "missed 1", "missed 2"]
+    assert [message["seq"] for message in delta["messages"]] == [seen + 1, seen + 2, seen + 3]
+    assert delta["last_seq"] == seen + 3
+    # chat_3 was not in since, so it is resent whole
+    assert [summary["id"] for summary in sync["resync"]] == ["chat_3"]
+    assert sync["removed"] == ["gone"]
+
+
+def test_far_behind_clients_resync_instead(service):
+    for n in range(MAX_SYNC_DELTA + 1):
+        service.add_message("chat_1", "bob", f"flood {n}")
+    sync = service.get_sync_delta("alice", {"chat_1": -1})
+    assert "chat_1" in [summary["id"] for summary in sync["resync"]]
+    assert "chat_1" not in [delta["chat_id"] for delta in sync["deltas"]]
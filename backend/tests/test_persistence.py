@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from chat_service import ChatService
+from storage import JsonStorage, SqliteStorage, StoreInUse, create_storage
+
+
+def open_service(data_file: str) -> ChatService:
+    return ChatService(storage=JsonStorage(data_file))
+
+
+def test_records_after_a_torn_tail_survive_restart(tmp_path):
+    data_file = str(tmp_path / "chat_data.json")
+    service = open_service(data_file)
+    service.get_or_create_user("before", "Before")
+    service.close()
+
+    # A crash in the middle of a write leaves half a record at the end
+    with open(data_file + ".wal", "a") as f:
+        f.write('{"op":"user","user_id":"torn","userna')
+
+    service = open_service(data_file)
+    assert "before" in service.users
+    assert "torn" not in service.users
+    service.get_or_create_user("after", "After")
+    chat = service.get_chat("chat_1")
+    service.add_message(chat.chat_id, "alice", "written after the crash")
+    service.close()
+
+    service = open_service(data_file)
+    assert "before" in service.users
+    assert "after" in service.users
+    assert service.get_chat_messages(chat.chat_id)[-1].text == "written after the crash"
+    service.close()
+
+
+def test_log_is_truncated_to_the_last_intact_record(tmp_path):
+    data_file = str(tmp_path / "chat_data.json")
+    service = open_service(data_file)
+    service.get_or_create_user("before", "Before")
+    service.close()
+    intact = os.path.getsize(data_file + ".wal")
+    with open(data_file + ".wal", "a") as f:
+        f.write('{"op":"user"')
+
+    open_service(data_file).close()
+    assert os.path.getsize(data_file + ".wal") == intact
+
+
+@pytest.mark.parametrize("engine, name", [(JsonStorage, "chat_data.json"), (SqliteStorage, "chat_data.db")])
+def test_a_store_is_opened_by_one_process_at_a_time(tmp_path, engine, name):
+    path = str(tmp_path / name)
+    storage = engine(path)
+    with pytest.raises(StoreInUse):
+        engine(path)
+    storage.close()
+    engine(path).close()
+
+
+@pytest.mark.parametrize("scheme, name", [("json://", "chat_data.json"), ("sqlite://", "chat_data.db")])
+def test_last_seen_survives_restart(tmp_path, scheme, name):
+    url = scheme + str(tmp_path / name)
+    service = ChatService(storage=create_storage(url))
+    last_seen_us = 1700000000123456
+    service.update_presence("alice", False, last_seen_us)
+    service.close()
+
+    service = ChatService(storage=create_storage(url))
+    assert service.users["alice"].last_seen_us == last_seen_us
+    service.close()
@@ -0,0 +1,34 @@
+from presence import PresenceService
+
+CONTACTS = {"alice": {"bob"}, "bob": {"alice"}}
+
+
+def test_contacts_are_released_once_offline_is_published():
+    published = []
+    released = []
+    presence = PresenceService(
+        lambda frame, user_ids, key: published.append((frame, user_ids)),
+        CONTACTS.__getitem__,
+        debounce=2.0,
+        on_offline=released.append
+    )
+    presence.connected("alice", {"id": "alice"})
+    presence.flush(now=0.0)
+    presence.disconnected("alice")
+    presence._offline_since["alice"] = 10.0
+
+    # Still inside the debounce window: contacts are needed for the update
+    presence.flush(now=11.0)
+    assert released == []
+    presence.flush(now=12.5)
+    assert '"user_offline"' in published[-1][0] and published[-1][1] == ["bob"]
+    assert released == ["alice"]
+
+
+def test_contacts_are_released_when_offline_is_never_announced():
+    released = []
+    presence = PresenceService(lambda *args: None, CONTACTS.__getitem__, debounce=0, on_offline=released.append)
+    presence.connected("bob", {"id": "bob"})
+    presence.disconnected("bob")
+    presence.flush()
+    assert released == ["bob"]
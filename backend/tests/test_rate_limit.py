@@ -0,0 +1,55 @@
+import pytest
+
+from rate_limit import RateLimiter, SlowDown
+
+
+def test_events_past_the_burst_are_rejected_without_charging():
+    limiter = RateLimiter(user_rate=10, user_burst=5, chat_rate=0, max_pause=0)
+    for _ in range(5):
+        assert limiter.reserve("alice", now=0.0) == 0.0
+    with pytest.raises(SlowDown) as refused:
+        limiter.reserve("alice", now=0.0)
+    assert refused.value.scope == "user"
+    assert refused.value.retry_after == pytest.approx(0.1)
+    assert limiter.rejected == {"user": 1, "chat": 0}
+    # Other users have buckets of their own
+    assert limiter.reserve("bob", now=0.0) == 0.0
+
+
+def test_buckets_refill_over_time():
+    limiter = RateLimiter(user_rate=10, user_burst=5, chat_rate=0, max_pause=0)
+    for _ in range(5):
+        limiter.reserve("alice", now=0.0)
+    with pytest.raises(SlowDown):
+        limiter.reserve("alice", now=0.05)
+    limiter.reserve("alice", now=0.1)
+    with pytest.raises(SlowDown):
+        limiter.reserve("alice", now=0.1)
+    # Refills up to the burst and no further
+    for _ in range(5):
+        limiter.reserve("alice", now=10.0)
+    with pytest.raises(SlowDown):
+        limiter.reserve("alice", now=10.0)
+
+
+def test_short_waits_pause_instead_of_rejecting():
+    limiter = RateLimiter(user_rate=10, user_burst=1, chat_rate=0, max_pause=0.15)
+    assert limiter.reserve("alice", now=0.0) == 0.0
+    assert limiter.reserve("alice", now=0.0) == pytest.approx(0.1)
+    assert limiter.paused == 1
+    with pytest.raises(SlowDown):
+        limiter.reserve("alice", now=0.0)
+
+
+def test_chat_buckets_are_shared_by_senders_and_separate_per_chat():
+    limiter = RateLimiter(user_rate=0, chat_rate=1, chat_burst=3, max_pause=0)
+    limiter.reserve("alice", chats={"chat_1": 2}, now=0.0)
+    limiter.reserve("bob", chats={"chat_1": 1}, now=0.0)
+    with pytest.raises(SlowDown) as refused:
+        limiter.reserve("charlie", chats={"chat_1": 1}, now=0.0)
+    assert (refused.value.scope, refused.value.chat_id) == ("chat", "chat_1")
+    limiter.reserve("charlie", chats={"chat_2": 3}, now=0.0)
+    # A batch over one full chat is refused before anything is charged
+    with pytest.raises(SlowDown):
+        limiter.reserve("alice", chats={"chat_3": 1, "chat_1": 1}, now=0.0)
+    limiter.reserve("alice", chats={"chat_3": 3}, now=0.0)
@@ -0,0 +1,44 @@
+import pytest
+
+from chat_service import ChatService
+from encoding import loads
+from read_receipts import ReadReceipts
+from storage import create_storage
+
+
+@pytest.mark.parametrize("scheme,name", [("json://", "chat_data.json"), ("sqlite://", "chat_data.db")])
+def test_watermarks_only_move_forward(tmp_path, scheme, name):
+    url = scheme + str(tmp_path / name)
+    service = ChatService(storage=create_storage(url))
+    for n in range(5):
+        service.add_message("chat_2", "alice", f"unread {n}")
+    last = service.get_chat("chat_2").message_count - 1
+
+    assert service.mark_read("chat_2", "bob", last - 2) == last - 2
+    assert service.mark_read("chat_2", "bob", last - 4) is None
+    assert service.mark_read("chat_2", "bob", last - 2) is None
+    # Past the newest message is clamped to it
+    assert service.mark_read("chat_2", "bob", last + 100) == last
+    assert service.mark_read("chat_2", "bob", last - 1) is None
+    # Only participants have a watermark
+    assert service.mark_read("chat_1", "charlie", 0) is None
+    assert service.get_chat("chat_2").read_seqs["bob"] == last
+    service.close()
+
+    service = ChatService(storage=create_storage(url))
+    assert service.get_chat("chat_2").read_seqs["bob"] == last
+    assert service.get_chat("chat_2").unread_count("bob") == 0
+    service.close()
+
+
+def test_receipts_keep_each_readers_newest_watermark():
+    published = []
+    receipts = ReadReceipts(lambda frame, user_ids, key: published.append((loads(frame), user_ids)))
+    receipts.record("chat_2", "bob", 7, ["alice", "bob"])
+    receipts.record("chat_2", "bob", 5, ["alice", "bob"])
+    receipts.record("chat_2", "charlie", 3, ["alice", "bob", "charlie"])
+    assert receipts.flush() == 1
+    frame, recipients = published[0]
+    assert frame == {"type": "read_receipts", "chat_id": "chat_2", "read_seqs": {"bob": 7, "charlie": 3}}
+    assert recipients == ["alice", "bob", "charlie"]
+    assert receipts.flush() == 0
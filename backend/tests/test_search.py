@@ -0,0 +1,29 @@
+import pytest
+
+from chat_service import ChatService, SearchNotReady
+from storage import create_storage
+
+
+@pytest.mark.parametrize("scheme,name", [("json://", "chat_data.json"), ("sqlite://", "chat_data.db")])
+def test_history_is_indexed_in_chunks_around_new_messages(tmp_path, scheme, name):
+    url = scheme + str(tmp_path / name)
+    service = ChatService(storage=create_storage(url))
+    for n in range(40):
+        service.add_message("chat_2", "alice", f"stored {n}")
+    service.close()
+
+    service = ChatService(storage=create_storage(url), preload_messages=5, lazy=True)
+    with pytest.raises(SearchNotReady):
+        service.search_messages("alice", "stored")
+    steps = 0
+    while not service.build_search_index(7):
+        # Messages keep arriving while the history is indexed
+        service.add_message("chat_2", "bob", f"stored live {steps}")
+        steps += 1
+    assert steps > 1
+
+    texts = [hit["message"]["text"] for hit in service.search_messages("alice", "stored", limit=200)["results"]]
+    assert texts == [f"stored live {n}" for n in reversed(range(steps))] + [f"stored {n}" for n in reversed(range(40))]
+    service.add_message("chat_2", "alice", "stored last")
+    assert service.search_messages("alice", "stored", limit=1)["results"][0]["message"]["text"] == "stored last"
+    service.close()
@@ -0,0 +1,36 @@
+import json
+
+from models import ChatRoom
+from typing_indicators import TypingTracker
+
+
+def make_tracker():
+    frames = []
+    room = ChatRoom("chat_1")
+    room.add_participant("alice")
+    room.add_participant("bob")
+    tracker = TypingTracker(lambda frame, user_ids, key: frames.append(json.loads(frame)), {"chat_1": room})
+    return tracker, frames
+
+
+def test_toggling_is_throttled():
+    tracker, frames = make_tracker()
+    # Ten start/stop switches a second for ten seconds
+    for n in range(200):
+        tracker.typing("chat_1", "alice", n % 2 == 0, now=n * 0.05)
+    # At most one start and one stop per 2s window
+    assert len(frames) <= 2 * 6
+    assert [frame["is_typing"] for frame in frames[:2]] == [True, False]
+    assert frames[-1]["is_typing"] is False
+
+
+def test_throttled_start_is_sent_by_a_later_keystroke():
+    tracker, frames = make_tracker()
+    assert tracker.typing("chat_1", "alice", True, now=0.0)
+    assert tracker.typing("chat_1", "alice", False, now=0.5)
+    # Too soon after the stop, so neither it nor its stop goes out
+    assert not tracker.typing("chat_1", "alice", True, now=1.0)
+    assert not tracker.typing("chat_1", "alice", False, now=1.1)
+    assert not tracker.typing("chat_1", "alice", True, now=1.2)
+    assert tracker.typing("chat_1", "alice", True, now=2.6)
+    assert [frame["is_typing"] for frame in frames] == [True, False, True]
@@ -0,0 +1,143 @@
+import json
+import os
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(scope="module")
+def app(tmp_path_factory):
+    # main reads its settings from the environment on import
+    tmp = tmp_path_factory.mktemp("server")
+    os.environ["DATA_FILE"] = str(tmp / "chat_data.json")
+    os.environ["MEDIA_ROOT"] = str(tmp / "media")
+    import main
+    return main
+
+
+@pytest.fixture(scope="module")
+def client(app):
+    # The server's executors are shut down on exit, so tests share one client
+    with TestClient(app.app) as client:
+        yield client
+
+
+def eventually(predicate, timeout: float = 2.0) -> bool:
+    """The server handles a close on its own loop; give it a moment"""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.mark.parametrize("frame", [
+    "not json",
+    "[1, 2]",
+    '{"type": "typing"}',
+    '{"type": "send_message", "chat_id": ["chat_1"], "text": "hi"}',
+    '{"type": "send_message", "chat_id": "chat_1", "text": 5}',
+    '{"type": "send_messages", "messages": "hi"}',
+])
+def test_bad_frames_get_an_error_and_keep_the_session(app, client, frame):
+    with client.websocket_connect("/ws/alice") as ws:
+        chat_id = ws.receive_json()["chats"][0]["id"]
+        ws.send_text(frame)
+        assert ws.receive_json()["type"] == "error"
+        ws.send_json({"type": "send_message", "chat_id": chat_id, "text": "still here"})
+        assert ws.receive_json()["message"]["text"] == "still here"
+    assert eventually(lambda: not app.manager.is_user_online("alice"))
+
+
+def test_a_failing_handler_still_takes_the_user_offline(app, client, monkeypatch):
+    async def broken(*args, **kwargs):
+        raise RuntimeError("service is down")
+
+    monkeypatch.setattr(app.chat_service, "history", broken)
+    with client.websocket_connect("/ws/alice") as ws:
+        chat_id = ws.receive_json()["chats"][0]["id"]
+        ws.send_json({"type": "load_history", "chat_id": chat_id})
+        with pytest.raises(Exception):
+            ws.receive_json()
+    assert eventually(lambda: not app.manager.is_user_online("alice"))
+    assert eventually(lambda: not app.presence.is_online("alice"))
+
+
+def receive_type(ws, kind: str) -> dict:
+    """The next frame of one type, skipping presence and other side traffic"""
+    while True:
+        frame = ws.receive_json()
+        if frame["type"] == kind:
+            return frame
+
+
+def test_batched_sends_reach_plain_clients_as_single_messages(app, client):
+    batch = {"type": "send_messages", "messages": [
+        {"chat_id": "chat_1", "text": f"line {n}"} for n in range(3)
+    ]}
+    with client.websocket_connect("/ws/bob") as bob, \
+            client.websocket_connect("/ws/bob?coalesce_ms=50") as coalescing:
+        bob.receive_json()
+        coalescing.receive_json()
+        with client.websocket_connect("/ws/alice") as alice:
+            alice.receive_json()
+            alice.send_json(batch)
+            assert [receive_type(bob, "new_message")["message"]["text"] for _ in range(3)] == [
+                "line 0", "line 1", "line 2"
+            ]
+            events = receive_type(coalescing, "events")["events"]
+            assert [event["message"]["text"] for event in events if event["type"] == "new_message"] == [
+                "line 0", "line 1", "line 2"
+            ]
+
+
+@pytest.mark.parametrize("request_, problem", [
+    ({"chat_id": "chat_2", "limit": "10"}, "int limit"),
+    ({"chat_id": "chat_2", "before": 5}, "str before"),
+    ({"chat_id": "chat_2", "before": "not a cursor"}, "Invalid cursor"),
+    ({"chat_id": "chat_3"}, "Not a participant"),
+    ({"chat_id": "no_such_chat"}, "Unknown chat"),
+])
+def test_history_requests_that_cannot_be_served_get_an_error(app, client, request_, problem):
+    with client.websocket_connect("/ws/charlie") as ws:
+        ws.receive_json()
+        ws.send_json({"type": "load_history", **request_})
+        error = receive_type(ws, "error")
+        assert problem in error["message"]
+        ws.send_json({"type": "load_history", "chat_id": "chat_2", "limit": 1})
+        assert len(receive_type(ws, "history")["messages"]) == 1
+
+
+def test_reconnecting_with_since_gets_a_delta(app, client):
+    with client.websocket_connect("/ws/diana") as diana:
+        chats = {chat["id"]: chat for chat in diana.receive_json()["chats"]}
+        since = {chat_id: chat["last_seq"] for chat_id, chat in chats.items()}
+    assert eventually(lambda: not app.manager.is_user_online("diana"))
+
+    with client.websocket_connect("/ws/alice") as alice:
+        alice.receive_json()
+        for n in range(2):
+            alice.send_json({"type": "send_message", "chat_id": "chat_2", "text": f"while away {n}"})
+            receive_type(alice, "new_message")
+
+    query = json.dumps(since, separators=(",", ":"))
+    with client.websocket_connect(f"/ws/diana?since={query}") as diana:
+        sync = receive_type(diana, "sync")
+    delta = next(delta for delta in sync["deltas"] if delta["chat_id"] == "chat_2")
+    assert [message["text"] for message in delta["messages"]] == ["while away 0", "while away 1"]
+    assert [message["seq"] for message in delta["messages"]] == [since["chat_2"] + 1, since["chat_2"] + 2]
+    assert sync["resync"] == []
+
+
+def test_a_read_receipt_reaches_the_sender(app, client):
+    with client.websocket_connect("/ws/alice") as alice, client.websocket_connect("/ws/bob") as bob:
+        alice.receive_json()
+        bob.receive_json()
+        alice.send_json({"type": "send_message", "chat_id": "chat_1", "text": "did you read this?"})
+        seq = receive_type(bob, "new_message")["message"]["seq"]
+        bob.send_json({"type": "mark_read", "chat_id": "chat_1", "seq": seq})
+        receipt = receive_type(alice, "read_receipts")
+        assert receipt["chat_id"] == "chat_1"
+        assert receipt["read_seqs"] == {"bob": seq}
@@ -0,0 +1,27 @@
+import zlib
+
+import pytest
+
+pytest.importorskip("msgpack")
+
+import wire  # noqa: E402
+from wire import FLAG_DEFLATE, MsgpackCodec  # noqa: E402
+
+
+def deflated(body: bytes) -> bytes:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return bytes((FLAG_DEFLATE,)) + compressor.compress(body) + compressor.flush()
+
+
+def test_deflated_frames_round_trip():
+    codec = MsgpackCodec(deflate=True)
+    frame = '{"type":"send_message","chat_id":"chat_1","text":"' + "hello " * 100 + '"}'
+    assert codec.decode(codec.encode(frame))["text"] == "hello " * 100
+
+
+def test_a_frame_inflating_past_the_limit_is_refused(monkeypatch):
+    monkeypatch.setattr(wire, "MAX_FRAME", 1024 * 1024)
+    bomb = deflated(b"\0" * (64 * 1024 * 1024))
+    assert len(bomb) < 100 * 1024
+    with pytest.raises(ValueError, match="inflates past"):
+        MsgpackCodec().decode(bomb)
@@ -0,0 +1,49 @@
+from typing import Dict, Hashable, List
+
+
+class TimerWheel:
+    """Hashed timing wheel for many short-lived deadlines.
+
+    Time is cut into ``tick``-second slots arranged in a ring of ``slots``.
+    Scheduling drops a key into the slot its deadline falls in, and advancing
+    the wheel only visits the slots that passed since the last call, so both
+    cost O(1) per timer however many are pending. Deadlines further out than
+    one turn of the ring simply stay in their slot for another turn.
+
+    Keys are not cancelled; the owner checks on expiry whether the deadline
+    still stands, and schedules again if it was pushed back.
+    """
+    def __init__(self, tick: float = 0.1, slots: int = 512, now: float = 0.0):
+        self.tick = tick
+        self._slots: List[Dict[Hashable, int]] = [{} for _ in range(slots)]
+        self._current = int(now / tick)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def schedule(self, key: Hashable, deadline: float):
+        """Expire ``key`` on the first ``advance`` at or after ``deadline``"""
+        # Round up so a key never fires early, and never into a slot already passed
+        at = max(-int(-deadline // self.tick), self._current + 1)
+        slot = self._slots[at % len(self._slots)]
+        if key not in slot:
+            self._size += 1
+        slot[key] = at
+
+    def advance(self, now: float) -> List[Hashable]:
+        """Move the wheel to ``now`` and return the keys whose deadline passed"""
+        target = int(now / self.tick)
+        expired: List[Hashable] = []
+        steps = min(target - self._current, len(self._slots))
+        for step in range(1, steps + 1):
+            slot = self._slots[(self._current + step) % len(self._slots)]
+            if not slot:
+                continue
+            due = [key for key, at in slot.items() if at <= target]
+            for key in due:
+                del slot[key]
+            expired.extend(due)
+        self._current = max(self._current, target)
+        self._size -= len(expired)
+        return expired
@@ -0,0 +1,166 @@
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import time
+from encoding import dumps
+from models import ChatRoom
+from timer_wheel import TimerWheel
+
+# publish(frame, recipient user ids, coalesce_key), e.g. ConnectionManager.broadcast_to_users
+Publish = Callable[[str, List[str], Optional[str]], None]
+
+
+class TypingTracker:
+    """Typing indicators for the active participants of each ``ChatRoom``.
+
+    Clients send ``typing`` at keystroke rate. A keystroke only pushes the
+    indicator's expiry back, a dict write; a frame goes out when typing
+    starts or stops, and at most once per ``throttle`` seconds in between so
+    receivers can keep their own copy alive. Starts are throttled as well: one
+    within ``throttle`` seconds of a stop waits for a keystroke after that, so
+    a client toggling its indicator costs at most a start and a stop per
+    window, and a stop whose start was never sent is not sent either.
+    Indicators nobody refreshes expire ``ttl`` seconds after the last
+    keystroke via a timer wheel that is advanced every ``tick`` seconds.
+    """
+    def __init__(
+        self,
+        publish: Publish,
+        rooms: Optional[Dict[str, ChatRoom]] = None,
+        ttl: float = 5.0,
+        throttle: float = 2.0,
+        tick: float = 0.25
+    ):
+        self.publish = publish
+        self.rooms = rooms if rooms is not None else {}
+        self.ttl = ttl
+        self.throttle = throttle
+        self.wheel = TimerWheel(tick=tick, now=time.monotonic())
+        # (chat_id, user_id) -> when the last typing frame went out, while receivers see it
+        self._last_sent: Dict[Tuple[str, str], float] = {}
+        # (chat_id, user_id) -> when a stop frame went out, kept for ``throttle`` seconds
+        self._stopped: Dict[Tuple[str, str], float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+        self.events = 0
+        self.published = 0
+        self.throttled = 0
+        self.expired = 0
+
+    def start(self):
+        self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.wheel.tick)
+            try:
+                self.expire()
+            except Exception as e:
+                print(f"Error expiring typing indicators: {e}")
+
+    def room(self, chat_id: str) -> ChatRoom:
+        room = self.rooms.get(chat_id)
+        if room is None:
+            room = self.rooms[chat_id] = ChatRoom(chat_id)
+        return room
+
+    def join(self, user_id: str, chat_ids: Iterable[str]):
+        """Make a connected user an active participant of their chats"""
+        for chat_id in chat_ids:
+            self.room(chat_id).add_participant(user_id)
+
+    def leave(self, user_id: str, chat_ids: Iterable[str]):
+        """Drop a user from their rooms, stopping any indicator they left behind"""
+        for chat_id in chat_ids:
+            room = self.rooms.get(chat_id)
+            if room is None:
+                continue
+            self.clear(chat_id, user_id)
+            room.remove_participant(user_id)
+            if not room.active_participants:
+                del self.rooms[chat_id]
+
+    def typing(self, chat_id: str, user_id: str, is_typing: bool, now: Optional[float] = None) -> bool:
+        """Handle one ``typing`` event; returns True if a frame was published"""
+        self.events += 1
+        room = self.rooms.get(chat_id)
+        if room is None or user_id not in room.active_participants:
+            return False
+        now = time.monotonic() if now is None else now
+        if not is_typing:
+            return self.clear(chat_id, user_id, now)
+
+        key = (chat_id, user_id)
+        if room.set_typing(user_id, True, now + self.ttl):
+            self.wheel.schedule(key, now + self.ttl)
+        # Starts count against the throttle too: a client flipping between
+        # typing and not gets one start and one stop per window
+        last = self._last_sent.get(key, self._stopped.get(key))
+        if last is not None and now - last < self.throttle:
+            self.throttled += 1
+            return False
+        self._last_sent[key] = now
+        self._stopped.pop(key, None)
+        self._publish(room, user_id, True)
+        return True
+
+    def clear(self, chat_id: str, user_id: str, now: Optional[float] = None) -> bool:
+        """Stop a user's indicator, e.g. because they sent the message"""
+        room = self.rooms.get(chat_id)
+        if room is None or not room.set_typing(user_id, False):
+            return False
+        key = (chat_id, user_id)
+        if self._last_sent.pop(key, None) is None:
+            # The start was throttled, so receivers never saw it
+            return False
+        self._stopped[key] = time.monotonic() if now is None else now
+        self._publish(room, user_id, False)
+        return True
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Stop indicators whose ttl passed; returns how many expired"""
+        now = time.monotonic() if now is None else now
+        count = 0
+        for chat_id, user_id in self.wheel.advance(now):
+            room = self.rooms.get(chat_id)
+            expires_at = room.typing_expires_at(user_id) if room is not None else None
+            if expires_at is None:
+                # Already stopped or left
+                continue
+            if expires_at > now:
+                # Refreshed by later keystrokes
+                self.wheel.schedule((chat_id, user_id), expires_at)
+                continue
+            self.clear(chat_id, user_id, now)
+            count += 1
+        self.expired += count
+        if self._stopped:
+            self._stopped = {
+                key: stopped for key, stopped in self._stopped.items() if now - stopped < self.throttle
+            }
+        return count
+
+    def _publish(self, room: ChatRoom, user_id: str, is_typing: bool):
+        recipients = [participant for participant in room.active_participants if participant != user_id]
+        if not recipients:
+            return
+        payload = {"type": "typing", "chat_id": room.chat_id, "user_id": user_id, "is_typing": is_typing}
+        if is_typing:
+            payload["ttl"] = self.ttl
+        # A newer indicator from the same user replaces one still queued
+        self.publish(dumps(payload), recipients, f"typing:{room.chat_id}:{user_id}")
+        self.published += 1
+
+    def get_metrics(self) -> dict:
+        return {
+            "typing": sum(len(room.typing_users) for room in self.rooms.values()),
+            "timers": len(self.wheel),
+            "events": self.events,
+            "published": self.published,
+            "throttled": self.throttled,
+            "expired": self.expired,
+        }
@@ -0,0 +1,115 @@
+from typing import Any, Dict, Optional, Union
+import zlib
+from encoding import loads
+import metrics
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional binary protocol
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+ENCODINGS = (JSON, MSGPACK)
+
+# Binary frames start with one flag byte describing the body
+FLAG_PLAIN = 0
+FLAG_DEFLATE = 1
+# Smaller bodies are sent as is; deflate barely shrinks them
+DEFLATE_MIN_BYTES = 256
+# Encoded frames kept per codec, so a broadcast is transcoded once, not per recipient
+ENCODED_CACHE_SIZE = 1024
+# Largest body a deflated client frame may inflate to; uvicorn's default limit for a whole frame
+MAX_FRAME = 16 * 1024 * 1024
+
+
+class WireCodec:
+    """How frames are written to and read from one connection.
+
+    Frames are built once as JSON text and shared by every recipient's
+    queue; a codec turns them into what its connections expect just before
+    they are written.
+    """
+    binary = False
+    name = JSON
+
+    def encode(self, frame: str) -> Union[str, bytes]:
+        return frame
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        return loads(data)
+
+
+class MsgpackCodec(WireCodec):
+    """MessagePack in binary frames, optionally deflated.
+
+    Every binary frame is one flag byte, ``FLAG_PLAIN`` or
+    ``FLAG_DEFLATE``, followed by the MessagePack body, raw-deflated
+    (zlib ``wbits=-15``) when the flag says so. Bodies under
+    ``DEFLATE_MIN_BYTES`` are never deflated. Clients may send frames in
+    the same format; a deflated one that inflates past ``MAX_FRAME`` bytes
+    is refused before the rest of it is inflated.
+    """
+    binary = True
+    name = MSGPACK
+
+    def __init__(self, deflate: bool = False, level: int = 6):
+        if msgpack is None:
+            raise ValueError("MessagePack encoding needs the msgpack package")
+        self.deflate = deflate
+        self.level = level
+        self._encoded: Dict[str, bytes] = {}
+
+    def encode(self, frame: str) -> bytes:
+        encoded = self._encoded.get(frame)
+        if encoded is not None:
+            return encoded
+        started = metrics.start()
+        body = msgpack.packb(loads(frame), use_bin_type=True)
+        if self.deflate and len(body) >= DEFLATE_MIN_BYTES:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+            encoded = bytes((FLAG_DEFLATE,)) + compressor.compress(body) + compressor.flush()
+        else:
+            encoded = bytes((FLAG_PLAIN,)) + body
+        metrics.TRANSCODE.observe_since(started)
+        if len(self._encoded) >= ENCODED_CACHE_SIZE:
+            self._encoded.clear()
+        self._encoded[frame] = encoded
+        return encoded
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        if isinstance(data, str):
+            # Text frames are always JSON
+            return loads(data)
+        if not data:
+            raise ValueError("Empty frame")
+        body = data[1:]
+        if data[0] == FLAG_DEFLATE:
+            decompressor = zlib.decompressobj(-15)
+            body = decompressor.decompress(body, MAX_FRAME)
+            if decompressor.unconsumed_tail:
+                raise ValueError(f"Frame inflates past {MAX_FRAME} bytes")
+        elif data[0] != FLAG_PLAIN:
+            raise ValueError(f"Unknown frame flag: {data[0]}")
+        return msgpack.unpackb(body, raw=False)
+
+
+JSON_CODEC = WireCodec()
+_codecs: Dict[bool, MsgpackCodec] = {}
+
+
+def negotiate(encoding: Optional[str], deflate: bool = False) -> WireCodec:
+    """The codec for a connection's ``?encoding=`` and ``?deflate=`` parameters.
+
+    Connections with the same choice share a codec, and with it the cache of
+    encoded frames. Raises ValueError for an unknown or unavailable encoding.
+    """
+    if not encoding or encoding == JSON:
+        # Text frames rely on the transport's permessage-deflate instead
+        return JSON_CODEC
+    if encoding != MSGPACK:
+        raise ValueError(f"Unsupported encoding: {encoding}")
+    codec = _codecs.get(deflate)
+    if codec is None:
+        codec = _codecs[deflate] = MsgpackCodec(deflate)
+    return codec